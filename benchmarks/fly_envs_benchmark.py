@@ -0,0 +1,194 @@
+"""Start-up and step-throughput benchmark of the flybody.fly_envs factories.
+
+For each environment factory, measures construction time, reset latency
+(first reset, which compiles the model, and p50/p99 of subsequent resets),
+control steps per second with a uniform random policy, and the breakdown of
+step time into phases and observables with StepProfiler. Import time of
+flybody.fly_envs is measured once in a fresh interpreter. Results are written
+as JSON for comparison across commits.
+
+All tasks run with inference trajectory loaders, so no datasets are needed,
+and vision_guided_flight uses ray-cast eyes, so no OpenGL is needed.
+
+Usage:
+
+    python benchmarks/fly_envs_benchmark.py --output results.json
+    python benchmarks/fly_envs_benchmark.py --envs template_task walk_on_ball
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from flybody.tasks.step_profiler import StepProfiler, merge_reports
+
+# Factory name -> keyword arguments. Defaults of all factories use inference
+# trajectory loaders and approximate wing beat patterns.
+FACTORIES = {
+    'template_task': {},
+    'multi_fly_template_task': {'num_flies': 4},
+    'walk_on_ball': {},
+    'walk_imitation': {},
+    'flight_imitation': {},
+    'vision_guided_flight': {'eye_raycast': 'intensity'},
+}
+
+
+def import_time() -> float:
+    """Returns time to import flybody.fly_envs in a fresh interpreter, s."""
+    code = ('import time; start = time.perf_counter(); '
+            'import flybody.fly_envs; print(time.perf_counter() - start)')
+    output = subprocess.run([sys.executable, '-c', code],
+                            capture_output=True,
+                            text=True,
+                            check=True).stdout
+    return float(output.split()[-1])
+
+
+def make_env(name: str, seed: int = 0):
+    """Creates environment `name` from FACTORIES."""
+    from flybody import fly_envs
+    factory = getattr(fly_envs, name)
+    return factory(random_state=np.random.RandomState(seed), **FACTORIES[name])
+
+
+def random_policy(env, seed: int = 0):
+    """Returns a uniform random policy for env."""
+    spec = env.action_spec()
+    rng = np.random.RandomState(seed)
+
+    def policy():
+        return rng.uniform(spec.minimum, spec.maximum).astype(spec.dtype)
+
+    return policy
+
+
+def benchmark_env(name: str,
+                  num_steps: int = 1000,
+                  num_resets: int = 20,
+                  seed: int = 0) -> dict:
+    """Benchmarks one environment factory, returns results as a dict.
+
+    Args:
+        name: Name of a factory in FACTORIES.
+        num_steps: Number of timed control steps, run twice: without and
+            with profiling. Episode resets in between are not timed.
+        num_resets: Number of timed resets after the first one.
+        seed: Seed of the environment and the random policy.
+
+    Returns:
+        Dict of results, times in seconds, step breakdown in ms per step.
+    """
+    start = time.perf_counter()
+    env = make_env(name, seed)
+    construction = time.perf_counter() - start
+
+    start = time.perf_counter()
+    env.reset()
+    first_reset = time.perf_counter() - start
+    reset_times = []
+    for _ in range(num_resets):
+        start = time.perf_counter()
+        env.reset()
+        reset_times.append(time.perf_counter() - start)
+
+    policy = random_policy(env, seed)
+    step_time = 0.
+    num_episodes = 0
+    for _ in range(num_steps):
+        action = policy()
+        start = time.perf_counter()
+        timestep = env.step(action)
+        step_time += time.perf_counter() - start
+        if timestep.last():
+            num_episodes += 1
+            env.reset()
+
+    # Separate profiled run, so profiling doesn't affect steps per second.
+    env.reset()
+    profiler = StepProfiler(env, max_episode_reports=None)
+    for _ in range(num_steps):
+        if env.step(policy()).last():
+            env.reset()
+    profile = merge_reports(list(profiler.episode_reports) +
+                            [profiler.report()])
+    profiler.disable()
+    return {
+        'kwargs': FACTORIES[name],
+        'construction_s': construction,
+        'first_reset_s': first_reset,
+        'reset_p50_s': float(np.percentile(reset_times, 50)),
+        'reset_p99_s': float(np.percentile(reset_times, 99)),
+        'steps_per_second': num_steps / step_time,
+        'step_phases_ms': profile['phases_ms'],
+        'step_observables_ms': profile['observables_ms'],
+        'num_steps': num_steps,
+        'num_episodes': num_episodes,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(names=None, num_steps: int = 1000, num_resets: int = 20,
+        seed: int = 0) -> dict:
+    """Benchmarks environment factories, returns results with metadata."""
+    import mujoco
+    results = {
+        'commit': _git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'mujoco': mujoco.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'mujoco_gl': os.environ.get('MUJOCO_GL'),
+        'import_time_s': import_time(),
+        'envs': {},
+    }
+    for name in names or FACTORIES:
+        results['envs'][name] = benchmark_env(name, num_steps, num_resets,
+                                              seed)
+    return results
+
+
+def _print_results(results):
+    print(f'commit {results["commit"]}, '
+          f'import flybody.fly_envs: {results["import_time_s"]:.2f} s')
+    for name, r in results['envs'].items():
+        phases = ', '.join(f'{phase} {t:.2f}'
+                           for phase, t in r['step_phases_ms'].items())
+        print(f'{name}: construction {r["construction_s"]:.2f} s, '
+              f'first reset {r["first_reset_s"]:.2f} s, '
+              f'reset p50/p99 {1e3 * r["reset_p50_s"]:.1f}/'
+              f'{1e3 * r["reset_p99_s"]:.1f} ms, '
+              f'{r["steps_per_second"]:.0f} steps/s ({phases} ms)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--envs', nargs='+', choices=list(FACTORIES),
+                        help='Factories to benchmark, default all.')
+    parser.add_argument('--num_steps', type=int, default=1000)
+    parser.add_argument('--num_resets', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Path of JSON results file.')
+    args = parser.parse_args()
+    results = run(args.envs, args.num_steps, args.num_resets, args.seed)
+    _print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,169 @@
+"""Learner steps-per-second benchmark of DistributionalMPOLearner.
+
+Builds the DMPO networks of walk_on_ball and a learner on a synthetic
+dataset, i.e. no replay server is needed, and measures learner steps per
+second after warm-up (tracing and compilation are timed separately). Run
+once per configuration, since the mixed precision graph rewrite is
+process-wide; the devices used are recorded in the results. Use
+CUDA_VISIBLE_DEVICES= to benchmark on CPU on a machine with GPUs.
+
+Usage:
+
+    python benchmarks/learner_benchmark.py
+    python benchmarks/learner_benchmark.py --jit_compile
+    python benchmarks/learner_benchmark.py --jit_compile \\
+        --mixed_precision bfloat16 --output results.json
+"""
+
+import argparse
+import collections
+import json
+import platform
+import time
+
+# Replay sample stand-in, the learner only reads the `data` field.
+Sample = collections.namedtuple('Sample', ['data'])
+
+
+def make_learner(batch_size: int = 256,
+                 num_fused_steps: int = 1,
+                 jit_compile: bool = False,
+                 mixed_precision: str | None = None,
+                 seed: int = 0):
+    """Returns a walk_on_ball DMPO learner on a synthetic dataset."""
+    import copy
+
+    from acme import specs
+    from acme import types
+    from acme import wrappers
+    from acme.utils import loggers
+    import numpy as np
+    import tensorflow as tf
+
+    from flybody.agents import agent_dmpo
+    from flybody.agents.learning_dmpo import DistributionalMPOLearner
+    from flybody.agents.network_factory import (make_network_factory_dmpo,
+                                                policy_loss_module_dmpo)
+    from flybody.fly_envs import walk_on_ball
+
+    env = walk_on_ball(random_state=np.random.RandomState(seed))
+    env = wrappers.SinglePrecisionWrapper(env)
+    env = wrappers.CanonicalSpecWrapper(env, clip=True)
+    environment_spec = specs.make_environment_spec(env)
+
+    networks_dict = make_network_factory_dmpo()(environment_spec.actions)
+    online_networks = agent_dmpo.DMPONetworks(
+        policy_network=networks_dict['policy'],
+        critic_network=networks_dict['critic'],
+        observation_network=networks_dict['observation'])
+    target_networks = copy.deepcopy(online_networks)
+    online_networks.init(environment_spec)
+    target_networks.init(environment_spec)
+
+    # One random batch, repeated.
+    tf.random.set_seed(seed)
+
+    def batch(spec):
+        return tf.random.uniform((batch_size, *spec.shape), dtype=spec.dtype)
+
+    transition = types.Transition(
+        observation=tf.nest.map_structure(batch,
+                                          environment_spec.observations),
+        action=batch(environment_spec.actions),
+        reward=batch(environment_spec.rewards),
+        discount=batch(environment_spec.discounts),
+        next_observation=tf.nest.map_structure(
+            batch, environment_spec.observations),
+    )
+    dataset = tf.data.Dataset.from_tensors(Sample(transition)).repeat()
+    if num_fused_steps > 1:
+        dataset = dataset.batch(num_fused_steps, drop_remainder=True)
+
+    return DistributionalMPOLearner(
+        policy_network=online_networks.policy_network,
+        critic_network=online_networks.critic_network,
+        observation_network=online_networks.observation_network,
+        target_policy_network=target_networks.policy_network,
+        target_critic_network=target_networks.critic_network,
+        target_observation_network=target_networks.observation_network,
+        policy_loss_module=policy_loss_module_dmpo(),
+        discount=0.99,
+        num_samples=20,
+        target_policy_update_period=101,
+        target_critic_update_period=107,
+        dataset=dataset,
+        logger=loggers.NoOpLogger(),
+        checkpoint_enable=False,
+        num_fused_steps=num_fused_steps,
+        jit_compile=jit_compile,
+        mixed_precision=mixed_precision)
+
+
+def benchmark_learner(num_steps: int = 200, **kwargs) -> dict:
+    """Benchmarks learner steps, returns results as a dict.
+
+    Args:
+        num_steps: Number of timed learner steps, rounded up to a multiple of
+            num_fused_steps.
+        **kwargs: Arguments of make_learner.
+
+    Returns:
+        Dict of results, times in seconds.
+    """
+    learner = make_learner(**kwargs)
+    num_fused_steps = kwargs.get('num_fused_steps', 1)
+    start = time.perf_counter()
+    learner.step()  # Traces and compiles.
+    first_step = time.perf_counter() - start
+    num_calls = -(-num_steps // num_fused_steps)
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        learner.step()
+    elapsed = time.perf_counter() - start
+    return {
+        'kwargs': kwargs,
+        'first_step_s': first_step,
+        'learner_steps_per_second': num_calls * num_fused_steps / elapsed,
+        'num_steps': num_calls * num_fused_steps,
+    }
+
+
+def run(num_steps: int = 200, **kwargs) -> dict:
+    """Benchmarks the learner, returns results with metadata."""
+    import tensorflow as tf
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'tensorflow': tf.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'devices': [
+            device.name for device in tf.config.list_logical_devices()
+        ],
+    }
+    results.update(benchmark_learner(num_steps, **kwargs))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--num_steps', type=int, default=200)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--num_fused_steps', type=int, default=1)
+    parser.add_argument('--jit_compile', action='store_true')
+    parser.add_argument('--mixed_precision',
+                        choices=['float16', 'bfloat16'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Path of JSON results file.')
+    args = parser.parse_args()
+    results = run(args.num_steps,
+                  batch_size=args.batch_size,
+                  num_fused_steps=args.num_fused_steps,
+                  jit_compile=args.jit_compile,
+                  mixed_precision=args.mixed_precision,
+                  seed=args.seed)
+    print(f'{results["devices"]}: first step {results["first_step_s"]:.1f} '
+          f's, {results["learner_steps_per_second"]:.1f} learner steps/s')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
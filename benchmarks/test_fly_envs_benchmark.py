@@ -0,0 +1,37 @@
+"""pytest-benchmark entry point for the fly_envs benchmark.
+
+Run with `pytest benchmarks --benchmark-json=results.json`. Skipped if
+pytest-benchmark is not installed; see fly_envs_benchmark.py for a standalone
+run.
+"""
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from fly_envs_benchmark import FACTORIES, make_env, random_policy  # noqa: E402
+
+
+@pytest.mark.parametrize('name', FACTORIES)
+def test_construction(benchmark, name):
+    benchmark.pedantic(make_env, args=(name, ), rounds=3)
+
+
+@pytest.mark.parametrize('name', FACTORIES)
+def test_reset(benchmark, name):
+    env = make_env(name)
+    env.reset()
+    benchmark(env.reset)
+
+
+@pytest.mark.parametrize('name', FACTORIES)
+def test_step(benchmark, name):
+    env = make_env(name)
+    env.reset()
+    policy = random_policy(env)
+
+    def step():
+        if env.step(policy()).last():
+            env.reset()
+
+    benchmark(step)
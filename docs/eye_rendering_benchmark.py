@@ -0,0 +1,57 @@
+# %% [markdown]
+# # Eye rendering benchmark
+# Per-step time of rendering both OpenGL eyes with two separate
+# `physics.render` calls vs one `StereoEyeRenderer` pass, which keeps its
+# scene between steps, updates it once and reads both eyes back together.
+#
+# Uses OSMesa software rendering by default. Set MUJOCO_GL to use another
+# backend, e.g. `MUJOCO_GL=egl python eye_rendering_benchmark.py`.
+
+# %%
+import os
+os.environ.setdefault('MUJOCO_GL', 'osmesa')
+
+import time
+
+import numpy as np
+from dm_control.mujoco import wrapper as mj_wrapper
+
+from flybody.fly_envs import template_task, vision_guided_flight
+from flybody.fruitfly.eye_renderer import StereoEyeRenderer
+
+NUM_STEPS = 100
+EYE_SIZE = 32
+
+
+def eye_rendering_ms(env):
+    """Returns ms per step of separate and single-pass rendering of eyes."""
+    walker = env.task.walker
+    cameras = [walker.left_eye, walker.right_eye]
+    scene_option = mj_wrapper.MjvOption()
+    scene_option.geomgroup[1] = 1
+    renderer = StereoEyeRenderer(cameras, EYE_SIZE, scene_option)
+    env.reset()
+    physics = env.physics
+    separate, stereo = 0., 0.
+    for _ in range(NUM_STEPS):
+        if env.step(np.zeros(env.action_spec().shape)).last():
+            env.reset()
+        start = time.perf_counter()
+        for camera in cameras:
+            physics.render(EYE_SIZE, EYE_SIZE,
+                           camera_id=camera.full_identifier,
+                           scene_option=scene_option)
+        separate += time.perf_counter() - start
+        start = time.perf_counter()
+        renderer.render(physics)
+        stereo += time.perf_counter() - start
+    return 1e3 * separate / NUM_STEPS, 1e3 * stereo / NUM_STEPS
+
+
+# %%
+print(f'MUJOCO_GL={os.environ["MUJOCO_GL"]}, eyes {EYE_SIZE}x{EYE_SIZE}')
+for name, make_env in [('template_task', template_task),
+                       ('vision_guided_flight', vision_guided_flight)]:
+    separate, stereo = eye_rendering_ms(make_env())
+    print(f'{name}: separate {separate:.2f} ms, single-pass {stereo:.2f} ms '
+          'per step')
@@ -0,0 +1,239 @@
+"""Elastic, self-healing pool of Ray environment loop actors."""
+
+import logging
+import math
+import threading
+from typing import Callable
+
+import ray
+
+from flybody.agents.remote_as_local_wrapper import RemoteAsLocal
+from flybody.agents.utils_ray import is_alive
+
+
+class ActorPool():
+    """Keeps a pool of running environment loop actors healthy and sized.
+
+    Each call to `check` (or each supervision interval, after
+    `start_supervisor`) runs one pass which:
+      1. Replaces actors which died (their `run` call ended or the actor is
+         not alive) or stalled (no `heartbeat` answer, or no finished episode
+         for heartbeat_timeout seconds while inserts are not rate limited).
+      2. If a replay server is given, scales the number of actors between
+         min_actors and max_actors from rate limiter wait times measured
+         since the last pass: if the learner waited on samples, actors are
+         added, and if actors waited on inserts, they are removed, in
+         proportion to the fraction of time spent waiting.
+
+    Actors are scheduled with their own resource requests, nothing is
+    reserved up front. With spread=True, they are spread over nodes with Ray's
+    SPREAD scheduling strategy.
+
+    The actors must have `isready`, `run` and `heartbeat` methods, like
+    ray_distributed_dmpo.EnvironmentLoop, and be created with
+    max_concurrency > 1, so `heartbeat` is answered while `run` runs.
+    """
+
+    def __init__(self,
+                 create_actor: Callable[[dict], RemoteAsLocal],
+                 num_actors: int,
+                 min_actors: int | None = None,
+                 max_actors: int | None = None,
+                 replay_server: RemoteAsLocal | None = None,
+                 heartbeat_timeout: float = 1800.,
+                 wait_threshold: float = 0.1,
+                 spread: bool = False,
+                 ready_timeout: float | None = 600.,
+                 label: str = 'actor'):
+        """Initializes the pool, without starting actors.
+
+        Args:
+            create_actor: Creates an actor, given Ray actor options (i.e.
+                scheduling_strategy, if any), and returns it wrapped with
+                RemoteAsLocal, without calling `run`.
+            num_actors: Initial number of actors.
+            min_actors: Minimum number of actors when scaling, default
+                num_actors.
+            max_actors: Maximum number of actors when scaling, default
+                num_actors.
+            replay_server: ReplayServer actor to measure rate limiter stats
+                from, None for a pool of fixed size.
+            heartbeat_timeout: Seconds without a finished episode after which
+                an actor is considered stalled.
+            wait_threshold: Fraction of time the learner or the actors wait on
+                the rate limiter above which actors are added or removed.
+            spread: Whether to spread actors over nodes.
+            ready_timeout: Seconds to wait for started actors to be ready,
+                None to wait forever.
+            label: Label of the pool in logs.
+        """
+        self._create_actor = create_actor
+        self._min_actors = num_actors if min_actors is None else min_actors
+        self._max_actors = num_actors if max_actors is None else max_actors
+        if not self._min_actors <= num_actors <= self._max_actors:
+            raise ValueError(f'Need min_actors <= num_actors <= max_actors, '
+                             f'got {self._min_actors}, {num_actors}, '
+                             f'{self._max_actors}.')
+        self._target = num_actors
+        self._replay_server = replay_server
+        self._heartbeat_timeout = heartbeat_timeout
+        self._wait_threshold = wait_threshold
+        self._label = label
+        self._options = {'scheduling_strategy': 'SPREAD'} if spread else {}
+        self._ready_timeout = ready_timeout
+        # Index, in order of starting -> (actor, future of its `run` call).
+        self._actors = {}
+        self._next_index = 0
+        self._last_rate_stats = None
+        self._stats = {'replaced': 0, 'started': 0, 'removed': 0}
+        self._lock = threading.Lock()
+        self._supervisor = None
+        self._stop = threading.Event()
+
+    @property
+    def num_actors(self) -> int:
+        return len(self._actors)
+
+    def start(self):
+        """Starts the initial actors, blocks until they are all running."""
+        with self._lock:
+            self._add(self._target)
+
+    def _add(self, num: int):
+        """Starts num actors, blocks until they are ready.
+
+        Raises:
+            TimeoutError: If not all actors are ready within ready_timeout, in
+                which case they are killed.
+        """
+        if num <= 0:
+            return
+        actors = {}
+        for _ in range(num):
+            actors[self._next_index] = self._create_actor(dict(self._options))
+            self._next_index += 1
+        refs = [actor.isready(block=False) for actor in actors.values()]
+        ready, _ = ray.wait(refs, num_returns=len(refs),
+                            timeout=self._ready_timeout)
+        if len(ready) < len(refs):
+            for actor in actors.values():
+                ray.kill(actor._remote_handle, no_restart=True)
+            raise TimeoutError(
+                f'{len(refs) - len(ready)} of {len(refs)} {self._label} '
+                f'actors not ready after {self._ready_timeout} s. The cluster '
+                f'may lack the resources they request, available: '
+                f'{ray.available_resources()}.')
+        ray.get(ready)  # Raises errors of actor construction.
+        for i, actor in actors.items():
+            self._actors[i] = (actor, actor.run(block=False))
+
+    def _remove(self, index: int):
+        actor, _ = self._actors.pop(index)
+        ray.kill(actor._remote_handle, no_restart=True)
+
+    def _unhealthy(self, inserts_limited: bool) -> list[int]:
+        """Returns indices of dead and stalled actors."""
+        unhealthy = []
+        heartbeats = {}
+        for i, (actor, run) in self._actors.items():
+            finished, _ = ray.wait([run], timeout=0)
+            if finished or not is_alive(actor):
+                logging.warning('%s %d died.', self._label, i)
+                unhealthy.append(i)
+            else:
+                heartbeats[i] = actor.heartbeat(block=False)
+        refs = list(heartbeats.values())
+        ready, _ = ray.wait(refs, num_returns=len(refs), timeout=60.)
+        ready = set(ready)
+        for i, ref in heartbeats.items():
+            if ref not in ready:
+                logging.warning('%s %d does not answer heartbeat.',
+                                self._label, i)
+                unhealthy.append(i)
+                continue
+            try:
+                age = ray.get(ref)
+            except ray.exceptions.RayError:
+                unhealthy.append(i)
+                continue
+            # Actors blocked on a rate limited insert are not stalled.
+            if age > self._heartbeat_timeout and not inserts_limited:
+                logging.warning('%s %d stalled for %.0f s.', self._label, i,
+                                age)
+                unhealthy.append(i)
+        return unhealthy
+
+    def _scaled_target(self, rate_stats: dict) -> int:
+        """Returns number of actors balancing rate limiter waits."""
+        last, self._last_rate_stats = self._last_rate_stats, rate_stats
+        if last is None:
+            return self._target
+        elapsed = rate_stats['time'] - last['time']
+        # Fraction of time the learner waited on samples (summed over its
+        # sample streams) and an actor waited on inserts, on average.
+        sample_wait = min((rate_stats['sample_wait_s'] -
+                           last['sample_wait_s']) / elapsed, 1.)
+        insert_wait = min((rate_stats['insert_wait_s'] -
+                           last['insert_wait_s']) / elapsed /
+                          max(self.num_actors, 1), 1.)
+        target = self._target
+        if sample_wait > self._wait_threshold:
+            target += max(1, math.ceil(target * sample_wait))
+        elif insert_wait > self._wait_threshold:
+            target -= max(1, math.floor(target * insert_wait))
+        return min(max(target, self._min_actors), self._max_actors)
+
+    def check(self):
+        """Replaces dead and stalled actors, rescales the pool."""
+        with self._lock:
+            rate_stats = None
+            if self._replay_server is not None:
+                rate_stats = self._replay_server.get_rate_limiter_stats()
+            inserts_limited = bool(rate_stats and
+                                   rate_stats['pending_inserts'])
+            for i in self._unhealthy(inserts_limited):
+                self._remove(i)
+                self._stats['replaced'] += 1
+            if rate_stats is not None:
+                target = self._scaled_target(rate_stats)
+                if target != self._target:
+                    logging.info('Scaling %s pool from %d to %d.',
+                                 self._label, self._target, target)
+                self._target = target
+            while self.num_actors > self._target:
+                # Remove most recently started actors first.
+                self._remove(max(self._actors))
+                self._stats['removed'] += 1
+            num_missing = self._target - self.num_actors
+            if num_missing > 0:
+                self._add(num_missing)
+                self._stats['started'] += num_missing
+
+    def stats(self) -> dict:
+        """Returns number of actors and counts of pool events."""
+        with self._lock:
+            return dict(self._stats,
+                        num_actors=self.num_actors,
+                        target_actors=self._target)
+
+    def start_supervisor(self, interval: float = 60.):
+        """Calls `check` every interval seconds on a background thread."""
+
+        def supervise():
+            while not self._stop.wait(interval):
+                try:
+                    self.check()
+                except Exception:  # Keep supervising, e.g. after preemption.
+                    logging.exception('%s pool check failed.', self._label)
+
+        self._supervisor = threading.Thread(target=supervise, daemon=True)
+        self._supervisor.start()
+
+    def close(self):
+        """Stops supervision, kills the actors."""
+        self._stop.set()
+        if self._supervisor is not None:
+            self._supervisor.join()
+        with self._lock:
+            for i in list(self._actors):
+                self._remove(i)
@@ -1,6 +1,7 @@
 """Acme agent implementations -- Acme代理实现."""
 
-from typing import Callable #从 Python 标准库 typing 中导入 Callable，用于类型注解，表示一个可调用对象（如函数、类构造函数等）
+import collections
+from typing import Callable, Sequence #从 Python 标准库 typing 中导入 Callable，用于类型注解，表示一个可调用对象（如函数、类构造函数等）
 
 import numpy as np          #导入 NumPy 库，并将其简写为 np。NumPy 是 Python 中用于科学计算的核心库，主要用于处理数组和矩阵运算
 
@@ -8,6 +9,7 @@ from acme import adders # 从 DeepMind 的强化学习框架 Acme 中导入以
 from acme import core   # core：Acme 的核心接口和抽象类，定义了 Agent 和环境交互的基本结构。
 from acme import types  # adders：用于将经验数据（如状态、动作、奖励等）添加到回放缓冲区的工具。
 
+from acme.utils import tree_utils
 from acme.tf import utils as tf2_utils                      # tf2_utils：TensorFlow 2.x 的工具函数，常用于构建网络、处理变量等。
 from acme.tf import variable_utils as tf2_variable_utils    # tf2_variable_utils：用于处理 TensorFlow 变量的工具，比如变量复制、同步等，常用于分布式训练或目标网络更新。
 
@@ -147,3 +149,99 @@ class DelayedFeedForwardActor(core.Actor):
     def update(self, wait: bool = False):
         if self._variable_client:
             self._variable_client.update(wait)
+
+
+class BatchedFeedForwardActor():
+    """A feed-forward actor driving several environments with one policy call.
+
+    Observations of num_envs environments are stacked along the batch
+    dimension, the policy is run once, and the batched action is split back
+    into per-environment actions. Thus the TF dispatch overhead is paid once
+    per step of all environments. Each environment has its own action delay
+    queue and adder. See BatchedEnvironmentLoop.
+    """
+
+    def __init__(
+        self,
+        policy_network: snt.Module,
+        num_envs: int,
+        adders: Sequence[adders.Adder | None] | None = None,
+        variable_client: tf2_variable_utils.VariableClient | None = None,
+        action_delay: int | None = None,
+        observation_callback: Callable | None = None,
+    ):
+        """Initializes the actor.
+
+        Args:
+            policy_network: the policy to run.
+            num_envs: number of environments driven by the actor.
+            adders: optional per-environment adders, length num_envs.
+            variable_client: object which allows to copy weights from the
+                learner copy of the policy to the actor copy. Its update
+                period counts batched steps, i.e. num_envs environment steps.
+            action_delay: number of timesteps to delay the actions for.
+            observation_callback: Optional callable to process observations
+                before passing them to policy.
+        """
+        if adders is None:
+            adders = [None] * num_envs
+        if len(adders) != num_envs:
+            raise ValueError(
+                f'Expected {num_envs} adders, got {len(adders)}.')
+        self._num_envs = num_envs
+        self._adders = list(adders)
+        self._variable_client = variable_client
+        self._policy_network = policy_network
+        self._action_delay = action_delay
+        self._action_queues = [collections.deque() for _ in range(num_envs)]
+        self._observation_callback = observation_callback
+
+    @property
+    def num_envs(self) -> int:
+        return self._num_envs
+
+    @tf.function
+    def _policy(self,
+                observations: types.NestedTensor) -> types.NestedTensor:
+        # Compute the policy, conditioned on the batch of observations.
+        policy = self._policy_network(observations)
+        # Sample from the policy if it is stochastic.
+        return policy.sample() if isinstance(policy, tfd.Distribution) else policy
+
+    def select_actions(
+            self,
+            observations: Sequence[types.NestedArray]) -> list[np.ndarray]:
+        """Returns actions for a sequence of per-environment observations."""
+        if self._observation_callback is not None:
+            observations = [self._observation_callback(observation)
+                            for observation in observations]
+        batched_observation = tree_utils.stack_sequence_fields(observations)
+        batched_action = tf2_utils.to_numpy(self._policy(batched_observation))
+        actions = tree_utils.unstack_sequence_fields(batched_action,
+                                                     len(observations))
+        # Maybe delay actions, separately for each environment.
+        if self._action_delay is not None:
+            for i, action in enumerate(actions):
+                queue = self._action_queues[i]
+                queue.append(action)
+                if len(queue) <= self._action_delay:
+                    # Return 0 while filling the initial queue.
+                    actions[i] = 0 * action
+                else:
+                    actions[i] = queue.popleft()
+        return actions
+
+    def observe_first(self, index: int, timestep: dm_env.TimeStep):
+        """Observes the first timestep of environment `index`."""
+        if self._adders[index]:
+            self._adders[index].add_first(timestep)
+
+    def observe(self, index: int, action: types.NestedArray,
+                next_timestep: dm_env.TimeStep):
+        """Observes action and next timestep of environment `index`."""
+        if self._adders[index]:
+            self._adders[index].add(action, next_timestep)
+
+    def update(self, wait: bool = False):
+        if self._variable_client:
+            self._variable_client.update(wait)
@@ -22,6 +22,8 @@ import sonnet as snt
 import tensorflow as tf
 
 from flybody.agents import learning_dmpo
+from flybody.agents import local_replay
+from flybody.agents.observation_codec import EncodingAdder, ObservationCodec
 from flybody.agents.actors import DelayedFeedForwardActor
 
 
@@ -44,6 +46,66 @@ class DMPOConfig:
     num_samples: int = 20
     clipping: bool = True
     replay_table_name: str = reverb_adders.DEFAULT_PRIORITY_TABLE
+    num_parallel_calls: int = 12
+    max_in_flight_samples_per_worker: Optional[int] = None
+    prefetch_to_device: Optional[str] = None
+    replay_backend: str = 'reverb'  # Or 'local', see local_replay.
+    # Compact replay storage of observations, None to store them as is.
+    observation_codec: Optional[ObservationCodec] = None
+
+
+def make_replay_dataset(
+    server_address: str,
+    table: str,
+    batch_size: int,
+    prefetch_size: Optional[int] = None,
+    num_parallel_calls: int = 12,
+    max_in_flight_samples_per_worker: Optional[int] = None,
+    prefetch_to_device: Optional[str] = None,
+    observation_codec: Optional[ObservationCodec] = None,
+    num_fused_steps: int = 1,
+) -> tf.data.Dataset:
+    """Makes the learner dataset of batched samples from a Reverb table.
+
+    Args:
+        server_address: Address of the Reverb server.
+        table: Name of the table to sample from.
+        batch_size: Batch size.
+        prefetch_size: Number of batches to prefetch on the host.
+        num_parallel_calls: Number of parallel sample streams, each with its
+            own connection to the server, interleaved into one dataset.
+        max_in_flight_samples_per_worker: Number of samples requested but not
+            yet received per stream, None for 2 * batch_size.
+        prefetch_to_device: Optional device, e.g. '/gpu:0', to prefetch one
+            batch to, so the host-to-device copy overlaps the learner step.
+        observation_codec: Codec the observations were encoded with, to
+            decode them after batching.
+        num_fused_steps: If > 1, stacks this many batches into one element,
+            the inputs of DistributionalMPOLearner._fused_step.
+
+    Returns:
+        Dataset of batched reverb.ReplaySample, with a leading dimension of
+        size num_fused_steps if num_fused_steps > 1.
+    """
+    dataset = datasets.make_reverb_dataset(
+        table=table,
+        server_address=server_address,
+        batch_size=batch_size,
+        prefetch_size=prefetch_size,
+        num_parallel_calls=num_parallel_calls,
+        max_in_flight_samples_per_worker=max_in_flight_samples_per_worker)
+    if observation_codec is not None:
+        dataset = dataset.map(observation_codec.decode_sample,
+                              num_parallel_calls=tf.data.AUTOTUNE)
+    if num_fused_steps > 1:
+        # Stack in the input pipeline, not in Python per learner step.
+        dataset = dataset.batch(num_fused_steps, drop_remainder=True)
+        dataset = dataset.prefetch(1)
+    if prefetch_to_device is not None:
+        # Has to be the last transformation of the dataset.
+        dataset = dataset.apply(
+            tf.data.experimental.prefetch_to_device(prefetch_to_device))
+    return dataset
 
 
 @dataclasses.dataclass
@@ -106,11 +168,22 @@ class DMPOBuilder:
     def __init__(self, config: DMPOConfig):
         self._config = config
 
+    def _replay_spec(
+        self,
+        environment_spec: specs.EnvironmentSpec,
+    ) -> specs.EnvironmentSpec:
+        """Returns environment spec of the stored, encoded transitions."""
+        codec = self._config.observation_codec
+        if codec is None:
+            return environment_spec
+        return codec.encode_environment_spec(environment_spec)
+
     def make_replay_tables(
         self,
         environment_spec: specs.EnvironmentSpec,
     ) -> List[reverb.Table]:
         """Create tables to insert data into."""
+        environment_spec = self._replay_spec(environment_spec)
         if self._config.samples_per_insert is None:
             # We will take a samples_per_insert ratio of None to mean that there is
             # no limit, i.e. this only implies a min size limit.
@@ -137,30 +210,66 @@ class DMPOBuilder:
 
         return [replay_table]
 
+    def make_local_replay(
+        self,
+        environment_spec: specs.EnvironmentSpec,
+    ) -> local_replay.LocalReplay:
+        """Create an in-process replay, replacing the replay tables."""
+        return local_replay.LocalReplay(
+            self._replay_spec(environment_spec),
+            max_size=self._config.max_replay_size,
+            min_size_to_sample=self._config.min_replay_size,
+            samples_per_insert=self._config.samples_per_insert)
+
     def make_dataset_iterator(
         self,
-        reverb_client: reverb.Client,
+        reverb_client: reverb.Client | local_replay.LocalReplay,
     ) -> Iterator[reverb.ReplaySample]:
         """Create a dataset iterator to use for learning/updating the agent."""
+        if isinstance(reverb_client, local_replay.LocalReplay):
+            dataset = local_replay.make_local_dataset(
+                reverb_client,
+                batch_size=self._config.batch_size,
+                prefetch_size=self._config.prefetch_size)
+            if self._config.observation_codec is not None:
+                dataset = dataset.map(
+                    self._config.observation_codec.decode_sample,
+                    num_parallel_calls=tf.data.AUTOTUNE)
+            return iter(dataset)
+
         # The dataset provides an interface to sample from replay.
-        dataset = datasets.make_reverb_dataset(
-            table=self._config.replay_table_name,
+        dataset = make_replay_dataset(
             server_address=reverb_client.server_address,
+            table=self._config.replay_table_name,
             batch_size=self._config.batch_size,
-            prefetch_size=self._config.prefetch_size)
+            prefetch_size=self._config.prefetch_size,
+            num_parallel_calls=self._config.num_parallel_calls,
+            max_in_flight_samples_per_worker=self._config.
+            max_in_flight_samples_per_worker,
+            prefetch_to_device=self._config.prefetch_to_device,
+            observation_codec=self._config.observation_codec)
 
         return iter(dataset)  # pytype: disable=wrong-arg-types
 
     def make_adder(
         self,
-        replay_client: reverb.Client,
+        replay_client: reverb.Client | local_replay.LocalReplay,
     ) -> adders.Adder:
         """Create an adder which records data generated by the actor/environment."""
-        return reverb_adders.NStepTransitionAdder(
-            priority_fns={self._config.replay_table_name: lambda x: 1.},
-            client=replay_client,
-            n_step=self._config.n_step,
-            discount=self._config.discount)
+        if isinstance(replay_client, local_replay.LocalReplay):
+            adder = local_replay.LocalNStepTransitionAdder(
+                replay_client,
+                n_step=self._config.n_step,
+                discount=self._config.discount)
+        else:
+            adder = reverb_adders.NStepTransitionAdder(
+                priority_fns={self._config.replay_table_name: lambda x: 1.},
+                client=replay_client,
+                n_step=self._config.n_step,
+                discount=self._config.discount)
+        if self._config.observation_codec is not None:
+            adder = EncodingAdder(adder, self._config.observation_codec)
+        return adder
 
     def make_actor(
         self,
@@ -261,7 +370,9 @@ class DMPO(agent.Agent):
             logger: Optional[loggers.Logger] = None,
             counter: Optional[counting.Counter] = None,
             checkpoint_enable: bool = True,
-            replay_table_name: str = reverb_adders.DEFAULT_PRIORITY_TABLE):
+            replay_table_name: str = reverb_adders.DEFAULT_PRIORITY_TABLE,
+            replay_backend: str = 'reverb',
+            observation_codec: Optional[ObservationCodec] = None):
         """Initialize the agent.
         Args:
             environment_spec: description of the actions, observations, etc.
@@ -293,6 +404,10 @@ class DMPO(agent.Agent):
             counter: counter object used to keep track of steps.
             checkpoint_enable: boolean indicating whether to checkpoint the learner.
             replay_table_name: string indicating what name to give the replay table.
+            replay_backend: 'reverb' for a Reverb server, or 'local' for an
+                in-process replay without serialization and RPCs.
+            observation_codec: optional codec to store observations compactly
+                in replay, e.g. grayscale eyes and float16 proprioception.
         """
         # Create the Builder object which will internally create agent components.
         builder = DMPOBuilder(
@@ -317,6 +432,8 @@ class DMPO(agent.Agent):
                 num_samples=num_samples,
                 clipping=True,
                 replay_table_name=reverb_adders.DEFAULT_PRIORITY_TABLE,
+                replay_backend=replay_backend,
+                observation_codec=observation_codec,
             ))
 
         # Create networks
@@ -344,10 +461,17 @@ class DMPO(agent.Agent):
             network_utils.StochasticSamplingHead(),
         ])
 
-        # Create the replay server and grab its address.
-        replay_tables = builder.make_replay_tables(environment_spec)
-        replay_server = reverb.Server(replay_tables, port=None)
-        replay_client = reverb.Client(f'localhost:{replay_server.port}')
+        # Create the replay server and grab its address, or the in-process
+        # replay which is its own client.
+        if replay_backend == 'local':
+            replay_server = builder.make_local_replay(environment_spec)
+            replay_client = replay_server
+        elif replay_backend == 'reverb':
+            replay_tables = builder.make_replay_tables(environment_spec)
+            replay_server = reverb.Server(replay_tables, port=None)
+            replay_client = reverb.Client(f'localhost:{replay_server.port}')
+        else:
+            raise ValueError(f'Unknown replay_backend {replay_backend}.')
 
         # Create actor, dataset, and learner for generating, storing, and consuming
         # data respectively.
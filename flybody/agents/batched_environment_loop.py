@@ -0,0 +1,127 @@
+"""Environment loop driving several environments with a batched actor."""
+# ruff: noqa: F821
+
+import operator
+import time
+from typing import Callable, Sequence
+
+import dm_env
+import numpy as np
+import tree
+
+from acme import core
+from acme.utils import counting
+from acme.utils import loggers
+
+
+class BatchedEnvironmentLoop(core.Worker):
+    """Steps several environments in lockstep with a BatchedFeedForwardActor.
+
+    At each step, the actor selects actions for all environments with one
+    policy call, then each environment is stepped. Environments whose episode
+    ended are reset independently, and their episode results are logged and
+    counted as in acme.EnvironmentLoop.
+    """
+
+    def __init__(
+        self,
+        environments: Sequence[dm_env.Environment],
+        actor: 'BatchedFeedForwardActor',
+        counter: counting.Counter | None = None,
+        logger: loggers.Logger | None = None,
+        should_update: bool = True,
+        label: str = 'environment_loop',
+        metrics_fn: Callable[[], dict] | None = None,
+    ):
+        """Initializes the loop.
+
+        Args:
+            environments: Environments, as many as actor.num_envs.
+            actor: Batched actor, see flybody.agents.actors.
+            counter: Optional counter of episodes and steps.
+            logger: Optional logger of episode results.
+            should_update: Whether to update the actor after each step.
+            label: Label of the default logger.
+            metrics_fn: Optional callable returning extra metrics to log with
+                each episode result.
+        """
+        if len(environments) != actor.num_envs:
+            raise ValueError(f'Actor drives {actor.num_envs} environments, '
+                             f'got {len(environments)}.')
+        self._environments = list(environments)
+        self._actor = actor
+        self._counter = counter or counting.Counter()
+        self._logger = logger or loggers.make_default_logger(label)
+        self._should_update = should_update
+        self._metrics_fn = metrics_fn
+
+    def run(self,
+            num_episodes: int | None = None,
+            num_steps: int | None = None):
+        """Runs the loop for num_episodes episodes or num_steps steps.
+
+        Both are summed over all environments, and None for both runs the loop
+        forever. Episodes in progress when the loop stops are not logged.
+
+        Args:
+            num_episodes: Number of episodes to run the loop for.
+            num_steps: Minimal number of steps to run the loop for.
+        """
+        if not (num_episodes is None or num_steps is None):
+            raise ValueError(
+                'Either "num_episodes" or "num_steps" should be None.')
+
+        def should_terminate(episode_count: int, step_count: int) -> bool:
+            return ((num_episodes is not None
+                     and episode_count >= num_episodes)
+                    or (num_steps is not None and step_count >= num_steps))
+
+        reward_spec = self._environments[0].reward_spec()
+        num_envs = len(self._environments)
+        timesteps = [None] * num_envs
+        start_times = [0.] * num_envs
+        episode_steps = [0] * num_envs
+        episode_returns = [None] * num_envs
+
+        def reset(i):
+            timesteps[i] = self._environments[i].reset()
+            self._actor.observe_first(i, timesteps[i])
+            start_times[i] = time.time()
+            episode_steps[i] = 0
+            episode_returns[i] = tree.map_structure(
+                lambda spec: np.zeros(spec.shape, spec.dtype), reward_spec)
+
+        for i in range(num_envs):
+            reset(i)
+        episode_count, step_count = 0, 0
+        while not should_terminate(episode_count, step_count):
+            actions = self._actor.select_actions(
+                [timestep.observation for timestep in timesteps])
+            for i, (environment, action) in enumerate(
+                    zip(self._environments, actions)):
+                timestep = environment.step(action)
+                self._actor.observe(i, action, next_timestep=timestep)
+                timesteps[i] = timestep
+                episode_steps[i] += 1
+                episode_returns[i] = tree.map_structure(
+                    operator.iadd, episode_returns[i], timestep.reward)
+                if timestep.last():
+                    counts = self._counter.increment(
+                        episodes=1, steps=episode_steps[i])
+                    result = {
+                        'episode_length': episode_steps[i],
+                        'episode_return': episode_returns[i],
+                        # Per environment, i.e. the loop steps num_envs
+                        # times faster in total.
+                        'steps_per_second': episode_steps[i] /
+                        (time.time() - start_times[i]),
+                    }
+                    result.update(counts)
+                    if self._metrics_fn is not None:
+                        result.update(self._metrics_fn())
+                    self._logger.write(result)
+                    episode_count += 1
+                    step_count += episode_steps[i]
+                    reset(i)
+            if self._should_update:
+                self._actor.update()
@@ -1,15 +1,22 @@
 """A simple, hierarchical distributed counter."""
 # ruff: noqa: F821
 
+import concurrent.futures
+import contextlib
+import logging
+import random
 import threading
 import time
-from typing import Dict, Mapping, Optional, Union
+from typing import Dict, Mapping, Optional, Sequence, Union
 
 from acme import core
 from acme.utils.counting import _prefix_keys
 
 Number = Union[int, float]
 
+# Stands in for a lock not created yet.
+_NO_LOCK = contextlib.nullcontext()
+
 
 class PicklableCounter(core.Saveable):
     """A simple counter object that can periodically sync with a parent.
@@ -116,3 +123,276 @@ class PicklableCounter(core.Saveable):
         if not self._prefix or self._return_only_prefixed:
             return 'steps'
         return f'{self._prefix}_steps'
+
+
+class AggregatingCounter(core.Saveable):
+    """Counter which accumulates increments locally and flushes in batches.
+
+  Drop-in replacement for acme.utils.counting.Counter as a client of a remote
+  parent counter. Increments are summed locally, and a background thread
+  sends them to the parent as one `increment` call every `time_delta` seconds.
+  The parent's totals returned by that call are cached, so `increment` and
+  `get_counts` never wait on the parent; counts from other clients are at most
+  about `time_delta` seconds stale.
+  """
+
+    def __init__(self,
+                 parent: Optional['Counter'] = None,
+                 prefix: str = '',
+                 time_delta: float = 1.0,
+                 return_only_prefixed: bool = False):
+        """Initialize the counter.
+    Args:
+      parent: a Counter object to flush increments to (or None for a local
+        counter).
+      prefix: string prefix to use for all local counts.
+      time_delta: time difference in seconds between flushes to the parent.
+      return_only_prefixed: if True, and if `prefix` isn't empty, return counts
+        restricted to the given `prefix` on each call to `increment` and
+        `get_counts`. The `prefix` is stripped from returned count names.
+    """
+        self._parent = parent
+        self._prefix = prefix
+        self._time_delta = time_delta
+        self._return_only_prefixed = return_only_prefixed
+        # Local counts not yet flushed, counts being flushed and the parent
+        # totals returned by the last flush, which include all earlier flushes.
+        self._counts = {}
+        self._in_flight = {}
+        self._cache = {}
+        # Created on first use, so the counter can be pickled until then.
+        self._lock = None
+        self._thread = None
+        self._closed = False
+        # Flush calls to the parent, for telemetry.
+        self._flush_stats = {'flushes': 0, 'flush_errors': 0, 'flush_s': 0.}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Counts being flushed are kept, in case the flush fails.
+        with self._lock or _NO_LOCK:
+            counts = dict(self._counts)
+            for key, value in self._in_flight.items():
+                counts[key] = counts.get(key, 0) + value
+            state['_flush_stats'] = dict(self._flush_stats)
+        state['_counts'] = counts
+        state['_in_flight'] = {}
+        state['_lock'] = None
+        state['_stop'] = None
+        state['_thread'] = None
+        return state
+
+    def _start(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        if self._parent is not None and not self._closed:
+            self._thread = threading.Thread(target=self._flush_loop,
+                                            daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self._time_delta):
+            try:
+                self.flush()
+            except Exception:  # The counts are kept for the next flush.
+                logging.exception('Flushing counts to the parent failed.')
+
+    def flush(self):
+        """Sends local counts to the parent and caches its totals, blocking."""
+        if self._parent is None:
+            return
+        if self._lock is None:
+            self._start()
+        with self._lock:
+            self._in_flight, self._counts = self._counts, {}
+            counts = _prefix_keys(self._in_flight, self._prefix)
+        start = time.perf_counter()
+        try:
+            cache = self._parent.increment(**counts)
+        except Exception:  # Keep the counts for the next flush.
+            with self._lock:
+                self._flush_stats['flush_errors'] += 1
+                for key, value in self._in_flight.items():
+                    self._counts[key] = self._counts.get(key, 0) + value
+                self._in_flight = {}
+            raise
+        with self._lock:
+            self._cache = cache
+            self._in_flight = {}
+            self._flush_stats['flushes'] += 1
+            self._flush_stats['flush_s'] += time.perf_counter() - start
+
+    def flush_stats(self) -> Dict[str, Number]:
+        """Returns numbers of flushes (RPCs to the parent), failed flushes
+        and total flush time, 'flushes', 'flush_errors' and 'flush_s'."""
+        if self._lock is None:
+            self._start()
+        with self._lock:
+            return dict(self._flush_stats)
+
+    def close(self):
+        """Flushes remaining counts and stops the flush thread."""
+        self._closed = True
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def increment(self, **counts: Number) -> Dict[str, Number]:
+        """Increment a set of counters.
+    Args:
+      **counts: keyword arguments specifying count increments.
+    Returns:
+      The [name, value] mapping of all counters stored, i.e. this will also
+      include counts that were not updated by this call to increment.
+    """
+        if self._lock is None:
+            self._start()
+        with self._lock:
+            for key, value in counts.items():
+                self._counts[key] = self._counts.get(key, 0) + value
+        return self.get_counts()
+
+    def get_counts(self) -> Dict[str, Number]:
+        """Return all counts tracked by this counter, without waiting."""
+        if self._lock is None:
+            self._start()
+        with self._lock:
+            counts = _prefix_keys(self._counts, self._prefix)
+            # Copy, so we don't modify the internal self._counts.
+            counts = dict(counts)
+            in_flight = _prefix_keys(self._in_flight, self._prefix)
+            for key, value in list(in_flight.items()) + list(
+                    self._cache.items()):
+                counts[key] = counts.get(key, 0) + value
+
+        if self._prefix and self._return_only_prefixed:
+            counts = dict([(key[len(self._prefix) + 1:], value)
+                           for key, value in counts.items()
+                           if key.startswith(f'{self._prefix}_')])
+        return counts
+
+    def save(self) -> Mapping[str, Mapping[str, Number]]:
+        counts = dict(self._counts)
+        for key, value in self._in_flight.items():
+            counts[key] = counts.get(key, 0) + value
+        return {'counts': counts, 'cache': dict(self._cache)}
+
+    def restore(self, state: Mapping[str, Mapping[str, Number]]):
+        # Restored local counts are sent to the parent with the next flush.
+        self._counts = dict(state['counts'])
+        self._in_flight = {}
+        self._cache = dict(state['cache'])
+
+    def get_steps_key(self) -> str:
+        """Returns the key to use for steps by this counter."""
+        if not self._prefix or self._return_only_prefixed:
+            return 'steps'
+        return f'{self._prefix}_steps'
+
+
+class ShardedCounter():
+    """Parent counter whose counts are stored in several counter shards.
+
+  Each instance (e.g. each unpickled copy in a client process) increments one
+  shard, picked at random on first use, so the load of clients is spread over
+  the shards. Counts are the sums over all shards. Counts of the other shards
+  are fetched in parallel in background threads every `time_delta` seconds
+  and cached, so an increment waits on its own shard only. Meant as parent of
+  AggregatingCounter clients, with shards being e.g. PicklableCounter Ray
+  actors wrapped with RemoteAsLocal.
+  """
+
+    def __init__(self, shards: Sequence['Counter'], time_delta: float = 10.):
+        """Initialize the counter.
+    Args:
+      shards: counters to store counts in, without parents.
+      time_delta: time difference in seconds between fetching counts of the
+        other shards.
+    """
+        self._shards = list(shards)
+        self._time_delta = time_delta
+        # Created on first use, so the counter can be pickled until then.
+        self._lock = None
+        self._shard = None
+        self._executor = None
+        # Last known counts of each shard and pending fetches of them.
+        self._shard_counts = [{} for _ in self._shards]
+        self._pending = {}
+        self._last_fetch_time = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_lock'] = None
+        state['_shard'] = None
+        state['_executor'] = None
+        state['_shard_counts'] = [{} for _ in self._shards]
+        state['_pending'] = {}
+        state['_last_fetch_time'] = None
+        return state
+
+    def _start(self):
+        self._lock = threading.Lock()
+        self._shard = random.randrange(len(self._shards))
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, len(self._shards) - 1),
+            thread_name_prefix='sharded_counter')
+
+    def _update(self, fetch: bool = False,
+                wait: bool = False) -> Dict[str, Number]:
+        """Maybe fetches counts of the other shards, caches finished fetches
+        and returns the totals."""
+        with self._lock:
+            now = time.monotonic()
+            if (fetch or self._last_fetch_time is None
+                    or now - self._last_fetch_time >= self._time_delta):
+                self._last_fetch_time = now
+                for i, shard in enumerate(self._shards):
+                    if i != self._shard and i not in self._pending:
+                        self._pending[i] = self._executor.submit(
+                            shard.get_counts)
+            if wait:
+                concurrent.futures.wait(self._pending.values())
+            for i, future in list(self._pending.items()):
+                if future.done():
+                    del self._pending[i]
+                    try:
+                        self._shard_counts[i] = future.result()
+                    except Exception:  # Keep the last known counts.
+                        logging.exception('Getting counts of shard %d failed.',
+                                          i)
+            totals = {}
+            for shard_counts in self._shard_counts:
+                for key, value in shard_counts.items():
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def increment(self, **counts: Number) -> Dict[str, Number]:
+        """Increments counts in this instance's shard, returns all counts."""
+        if self._lock is None:
+            self._start()
+        shard_counts = self._shards[self._shard].increment(**counts)
+        with self._lock:
+            self._shard_counts[self._shard] = shard_counts
+        return self._update()
+
+    def get_counts(self) -> Dict[str, Number]:
+        """Return the counts summed over all shards, without waiting.
+
+    Counts of the other shards are the last fetched ones.
+    """
+        if self._lock is None:
+            self._start()
+        return self._update()
+
+    def refresh(self) -> Dict[str, Number]:
+        """Fetches counts of all shards, blocking, and returns their sums."""
+        if self._lock is None:
+            self._start()
+        # Fetches started earlier may miss recent increments.
+        self._update(wait=True)
+        shard_counts = self._shards[self._shard].get_counts()
+        with self._lock:
+            self._shard_counts[self._shard] = shard_counts
+        return self._update(fetch=True, wait=True)
@@ -0,0 +1,270 @@
+"""Node-local fork server for fast start-up of environment worker processes.
+
+Starting an actor from scratch means importing TF, dm_control and MuJoCo and
+building and compiling the environment, which takes tens of seconds per actor.
+A ForkServer pays this cost once: it starts a fresh Python process which
+imports the given modules and builds one template environment. Each worker
+is then forked from this process, inheriting the imported modules and the
+built environment copy-on-write, and is ready within milliseconds.
+
+The server process must stay fork-safe: the environment factory and the
+preloaded modules should not start threads, gRPC channels, TF eager contexts
+or OpenGL contexts. Workers create such clients after being forked.
+
+Example:
+
+    server = ForkServer(environment_factory, preload_modules=['tensorflow'])
+    futures = [server.start_worker(run_actor, actor_id=i) for i in range(32)]
+    concurrent.futures.wait(futures)  # Resolved as workers call `ready()`.
+    ...
+    server.close()  # Also terminates the workers.
+"""
+
+import concurrent.futures
+import importlib
+import itertools
+import os
+import random
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from multiprocessing import connection
+from typing import Any, Callable, Sequence
+
+import cloudpickle
+import numpy as np
+
+_AUTHKEY_ENV = 'FLYBODY_FORK_SERVER_AUTHKEY'
+# Status messages are (sender, status, info); sender None is the server.
+_READY = 'ready'
+_ERROR = 'error'
+
+
+class ForkServer():
+    """Forks ready worker processes from a process with a built environment."""
+
+    def __init__(self,
+                 environment_factory: Callable[[], Any],
+                 preload_modules: Sequence[str] = (),
+                 env_vars: dict[str, str] | None = None):
+        """Starts the server and blocks until the template environment is built.
+
+        Args:
+            environment_factory: Callable without arguments returning the
+                template environment, serialized with cloudpickle.
+            preload_modules: Names of modules to import in the server before
+                building the environment, e.g. ['tensorflow', 'reverb'].
+            env_vars: Optional environment variables for the server and
+                workers, e.g. {'MUJOCO_GL': 'egl'}.
+        """
+        self._authkey = secrets.token_bytes(32)
+        self._listener = connection.Listener(('127.0.0.1', 0),
+                                             authkey=self._authkey)
+        self._futures = {None: concurrent.futures.Future()}
+        self._worker_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._accept_thread = threading.Thread(target=self._accept_loop,
+                                               daemon=True)
+        self._accept_thread.start()
+
+        env = dict(os.environ, **(env_vars or {}))
+        env[_AUTHKEY_ENV] = self._authkey.hex()
+        host, port = self._listener.address
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', __name__, host, str(port)],
+            stdin=subprocess.PIPE,
+            env=env)
+        # Commands to the server are sent through its stdin.
+        self._commands = connection.Connection(
+            os.dup(self._process.stdin.fileno()), readable=False)
+        self._process.stdin.close()
+        self._commands.send_bytes(
+            cloudpickle.dumps((environment_factory, list(preload_modules))))
+        self._build_time = self._wait_for_server()
+
+    def _wait_for_server(self) -> float:
+        future = self._futures[None]
+        while True:
+            try:
+                return future.result(timeout=1.)
+            except concurrent.futures.TimeoutError:
+                if self._process.poll() is not None:
+                    self.close()
+                    raise RuntimeError('Fork server exited with code '
+                                       f'{self._process.returncode}.')
+
+    def _accept_loop(self):
+        """Resolves futures with status messages from server and workers."""
+        while True:
+            try:
+                conn = self._listener.accept()
+            except connection.AuthenticationError:
+                continue
+            except OSError:
+                return  # Listener closed.
+            with conn:
+                try:
+                    sender, status, info = conn.recv()
+                except (EOFError, OSError):
+                    continue
+            if sender == 'close':
+                return
+            with self._lock:
+                future = self._futures.pop(sender, None)
+            if future is None:
+                continue
+            if status == _READY:
+                future.set_result(info)
+            else:
+                future.set_exception(
+                    RuntimeError(f'Fork server worker {sender} failed:\n{info}'))
+
+    @property
+    def build_time(self) -> float:
+        """Time the server took to import modules and build the environment."""
+        return self._build_time
+
+    def start_worker(self, worker_fn: Callable, *args,
+                     **kwargs) -> concurrent.futures.Future:
+        """Forks a worker process running worker_fn, returns its readiness.
+
+        The worker calls `worker_fn(environment, ready, *args, **kwargs)`,
+        where `environment` is the worker's copy of the template environment,
+        with its random state reseeded, and `ready` is a callable the worker
+        should call once it's initialized, e.g. before entering its run loop.
+
+        Args:
+            worker_fn: Function to run in the worker, serialized together with
+                args and kwargs with cloudpickle.
+            *args: Positional arguments of worker_fn.
+            **kwargs: Keyword arguments of worker_fn.
+
+        Returns:
+            Future resolved with the worker's pid when it calls `ready` (or
+            returns), or with an exception if it fails before that.
+        """
+        if self._closed:
+            raise RuntimeError('Fork server is closed.')
+        future = concurrent.futures.Future()
+        with self._lock:
+            worker_id = next(self._worker_ids)
+            self._futures[worker_id] = future
+        self._commands.send(
+            ('fork', worker_id, cloudpickle.dumps((worker_fn, args, kwargs))))
+        return future
+
+    def close(self):
+        """Stops the server and terminates all its workers."""
+        if self._closed:
+            return
+        self._closed = True
+        self._commands.close()  # Server exits on end of its stdin.
+        try:
+            self._process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+        # Unblock the accept loop and fail pending futures.
+        _send_status(self._listener.address, self._authkey, 'close', None,
+                     None)
+        self._accept_thread.join()
+        self._listener.close()
+        with self._lock:
+            for future in self._futures.values():
+                if not future.done():
+                    future.set_exception(RuntimeError('Fork server closed.'))
+            self._futures.clear()
+
+
+def _send_status(address, authkey, sender, status, info):
+    with connection.Client(address, authkey=authkey) as conn:
+        conn.send((sender, status, info))
+
+
+def _reseed(environment):
+    """Reseeds global and environment random states after fork."""
+    seed = int.from_bytes(os.urandom(4), 'little')
+    random.seed(seed)
+    np.random.seed(seed)
+    random_state = getattr(environment, 'random_state', None)
+    if isinstance(random_state, np.random.RandomState):
+        random_state.seed(seed)
+
+
+def _run_worker(environment, worker_id, payload, address, authkey):
+    """Runs in the forked worker process, never returns."""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    # Workers don't read the server's command stream.
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    is_ready = False
+
+    def ready():
+        nonlocal is_ready
+        if not is_ready:
+            is_ready = True
+            _send_status(address, authkey, worker_id, _READY, os.getpid())
+
+    exit_code = 0
+    try:
+        _reseed(environment)
+        worker_fn, args, kwargs = cloudpickle.loads(payload)
+        worker_fn(environment, ready, *args, **kwargs)
+        ready()
+    except BaseException:
+        exit_code = 1
+        if is_ready:
+            traceback.print_exc()
+        else:
+            _send_status(address, authkey, worker_id, _ERROR,
+                         traceback.format_exc())
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def _serve(address, authkey):
+    """Main loop of the server process."""
+    commands = connection.Connection(os.dup(0), writable=False)
+    try:
+        start = time.time()
+        environment_factory, preload_modules = cloudpickle.loads(
+            commands.recv_bytes())
+        for name in preload_modules:
+            importlib.import_module(name)
+        environment = environment_factory()
+        build_time = time.time() - start
+    except BaseException:
+        _send_status(address, authkey, None, _ERROR, traceback.format_exc())
+        return
+    _send_status(address, authkey, None, _READY, build_time)
+
+    # Reap finished workers automatically.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    workers = []
+    while True:
+        try:
+            _, worker_id, payload = commands.recv()
+        except EOFError:
+            break  # Closed by the driver.
+        pid = os.fork()
+        if pid == 0:
+            commands.close()
+            _run_worker(environment, worker_id, payload, address, authkey)
+        workers.append(pid)
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+if __name__ == '__main__':
+    _authkey = bytes.fromhex(os.environ.pop(_AUTHKEY_ENV))
+    _serve((sys.argv[1], int(sys.argv[2])), _authkey)
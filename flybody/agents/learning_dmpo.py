@@ -16,6 +16,15 @@ import numpy as np                      #科学计算库，用于数组、数值
 import sonnet as snt                    #DeepMind 的神经网络库，用于构建模块化模型
 import tensorflow as tf                 #Google 的深度学习框架，用于训练和推理
 
+from flybody.agents.telemetry import Telemetry
+
+# Mixed precision compute dtype -> grappler graph rewrite producing it.
+_MIXED_PRECISION_REWRITES = {
+    'float16': 'auto_mixed_precision',  # GPUs.
+    'bfloat16': 'auto_mixed_precision_mkl',  # CPUs with oneDNN.
+}
+# Consecutive finite float16 steps before the loss scale is doubled.
+_LOSS_SCALE_GROWTH_INTERVAL = 2000
 
 class DistributionalMPOLearner(acme.Learner):
     """分布式最大后验策略优化学习器"""
@@ -47,6 +56,10 @@ class DistributionalMPOLearner(acme.Learner):
         directory: str | None = '~/acme/',
         checkpoint_to_load: Optional[str] = None,
         time_delta_minutes: float = 30.,
+        num_fused_steps: int = 1,
+        jit_compile: bool = False,
+        mixed_precision: Optional[str] = None,
+        telemetry: Optional[Telemetry] = None,
     ):
 
         # 在线存储和目标网络.
@@ -75,6 +88,31 @@ class DistributionalMPOLearner(acme.Learner):
         self._num_steps = tf.Variable(0, dtype=tf.int32)
         self._target_policy_update_period = target_policy_update_period
         self._target_critic_update_period = target_critic_update_period
+        # Number of learner steps run in one compiled loop per `step` call.
+        # If > 1, dataset elements must be this many stacked batches.
+        self._num_fused_steps = num_fused_steps
+        # Optional throughput telemetry, see flybody.agents.telemetry.
+        self._telemetry = telemetry
+
+        # Float32 variables (incl. MPO dual variables) are kept either way,
+        # mixed precision only changes the compute dtype of the step graph.
+        # The grappler rewrite is process-wide.
+        self._loss_scale = None
+        if mixed_precision is not None:
+            if mixed_precision not in _MIXED_PRECISION_REWRITES:
+                raise ValueError(
+                    f'Unknown mixed_precision {mixed_precision}, expected '
+                    f'one of {list(_MIXED_PRECISION_REWRITES)}.')
+            tf.config.optimizer.set_experimental_options(
+                {_MIXED_PRECISION_REWRITES[mixed_precision]: True})
+            if mixed_precision == 'float16':
+                # Dynamic loss scale, so float16 gradients don't underflow.
+                self._loss_scale = tf.Variable(2.**15, trainable=False)
+                self._loss_scale_good_steps = tf.Variable(0, trainable=False)
+        # Compile the learning computation, incl. the MPO loss, with XLA.
+        # Dataset iteration and target updates stay outside the XLA cluster.
+        if jit_compile:
+            self._learn = tf.function(self._learn, jit_compile=True)
 
         # 批处理数据集并创造迭代器.
         # TODO(b/155086959): Fix type stubs and remove
@@ -189,7 +227,28 @@ class DistributionalMPOLearner(acme.Learner):
         self._timestamp = None
 
     @tf.function
-    def _step(self) -> types.NestedTensor:
+    def _step(self, inputs: types.NestedTensor) -> types.NestedTensor:
+        return self._update(inputs)
+
+    @tf.function
+    def _fused_step(self, inputs: types.NestedTensor) -> types.NestedTensor:
+        """Runs num_fused_steps learner steps in one graph.
+
+        The loop is compiled to a tf.while_loop over the leading dimension of
+        inputs, i.e. num_fused_steps stacked batches. Returns fetches averaged
+        over the steps.
+        """
+        # First step outside the loop, so optimizer slots are created there.
+        totals = self._update(tf.nest.map_structure(lambda x: x[0], inputs))
+        for i in tf.range(1, self._num_fused_steps):
+            totals = tf.nest.map_structure(
+                tf.add, totals,
+                self._update(tf.nest.map_structure(lambda x: x[i], inputs)))
+        return tf.nest.map_structure(
+            lambda total: total / self._num_fused_steps, totals)
+
+    def _update(self, inputs: types.NestedTensor) -> types.NestedTensor:
+        """A single learner step, called inside tf.function."""
         # Update target network.
         online_policy_variables = self._policy_network.variables
         target_policy_variables = self._target_policy_network.variables
@@ -217,11 +276,15 @@ class DistributionalMPOLearner(acme.Learner):
 
         self._num_steps.assign_add(1)
 
-        # Get data from replay (dropping extras if any). Note there is no
+        # Learn from replay data (dropping extras if any). Note there is no
         # extra data here because we do not insert any into Reverb.
-        inputs = next(self._iterator)
-        transitions: types.Transition = inputs.data
+        return self._learn(inputs.data)
+
+    def _learn(self, transitions: types.Transition) -> types.NestedTensor:
+        """Computes losses and applies gradients for a batch of transitions.
 
+        Replaced with an XLA-compiled tf.function if jit_compile is True.
+        """
         # Get batch size and scalar dtype.
         batch_size = transitions.reward.shape[0]
 
@@ -296,6 +359,13 @@ class DistributionalMPOLearner(acme.Learner):
                 actions=sampled_actions,
                 q_values=sampled_q_values)
 
+            if self._loss_scale is not None:
+                critic_loss_to_minimize = critic_loss * self._loss_scale
+                policy_loss_to_minimize = policy_loss * self._loss_scale
+            else:
+                critic_loss_to_minimize = critic_loss
+                policy_loss_to_minimize = policy_loss
+
         # For clarity, explicitly define which variables are trained by which loss.
         critic_trainable_variables = (
             # In this agent, the critic loss trains the observation network.
@@ -306,15 +376,20 @@ class DistributionalMPOLearner(acme.Learner):
         dual_trainable_variables = self._policy_loss_module.trainable_variables
 
         # Compute gradients.
-        critic_gradients = tape.gradient(critic_loss,
+        critic_gradients = tape.gradient(critic_loss_to_minimize,
                                          critic_trainable_variables)
         policy_gradients, dual_gradients = tape.gradient(
-            policy_loss,
+            policy_loss_to_minimize,
             (policy_trainable_variables, dual_trainable_variables))
 
         # Delete the tape manually because of the persistent=True flag.
         del tape
 
+        if self._loss_scale is not None:
+            critic_gradients, policy_gradients, dual_gradients = (
+                self._unscale_gradients(
+                    (critic_gradients, policy_gradients, dual_gradients)))
+
         # Maybe clip gradients.
         if self._clipping:
             policy_gradients = tuple(
@@ -335,12 +410,55 @@ class DistributionalMPOLearner(acme.Learner):
             'policy_loss': policy_loss,
         }
         fetches.update(policy_stats)  # Log MPO stats.
+        if self._loss_scale is not None:
+            fetches['loss_scale'] = tf.identity(self._loss_scale)
 
         return fetches
 
+    def _unscale_gradients(self, gradients):
+        """Unscales gradients and updates the dynamic float16 loss scale.
+
+        If any gradient is not finite, all gradients are zeroed and the loss
+        scale is halved. The loss scale is doubled after
+        _LOSS_SCALE_GROWTH_INTERVAL consecutive finite steps. Branch-free, so
+        it compiles with XLA.
+        """
+        flat = tf.nest.flatten(gradients)
+        finite = tf.reduce_all(
+            [tf.reduce_all(tf.math.is_finite(g)) for g in flat])
+        flat = [
+            tf.where(finite, g / self._loss_scale, tf.zeros_like(g))
+            for g in flat
+        ]
+        good_steps = tf.where(finite, self._loss_scale_good_steps + 1, 0)
+        grow = good_steps >= _LOSS_SCALE_GROWTH_INTERVAL
+        scale = self._loss_scale
+        self._loss_scale.assign(
+            tf.where(finite, tf.where(grow, 2. * scale, scale),
+                     tf.maximum(scale / 2., 1.)))
+        self._loss_scale_good_steps.assign(tf.where(grow, 0, good_steps))
+        return tf.nest.pack_sequence_as(gradients, flat)
+
     def step(self):
-        # Run the learning step.
-        fetches = self._step()
+        # Get data from replay outside the graph, so the time spent waiting
+        # for it can be told apart from learning.
+        # With num_fused_steps > 1, the dataset yields num_fused_steps stacked
+        # batches per element, see agent_dmpo.make_replay_dataset.
+        start = time.time()
+        inputs = next(self._iterator)
+        input_wait_time = time.time() - start
+
+        # Run the learning step. Converting fetches to numpy waits for the
+        # step to finish on accelerators, so compute time can be measured and
+        # the fetches logged. This keeps Python from queuing the next call
+        # while the device runs, which costs one host round trip per call;
+        # num_fused_steps > 1 amortizes it over the fused steps.
+        if self._num_fused_steps > 1:
+            fetches = self._fused_step(inputs)
+        else:
+            fetches = self._step(inputs)
+        fetches = tf2_utils.to_numpy(fetches)
+        compute_time = time.time() - start - input_wait_time
 
         # Compute elapsed time.
         timestamp = time.time()
@@ -348,8 +466,17 @@ class DistributionalMPOLearner(acme.Learner):
         self._timestamp = timestamp
 
         # Update our counts and record it.
-        counts = self._counter.increment(steps=1, walltime=elapsed_time)
+        counts = self._counter.increment(steps=self._num_fused_steps,
+                                         walltime=elapsed_time)
         fetches.update(counts)
+        fetches['input_wait_time'] = input_wait_time
+        fetches['compute_time'] = compute_time
+        fetches['input_wait_fraction'] = input_wait_time / (input_wait_time +
+                                                            compute_time)
+        if self._telemetry is not None:
+            self._telemetry.record('dataset_wait', input_wait_time)
+            self._telemetry.record('learner_compute', compute_time)
+            self._telemetry.increment('learner_steps', self._num_fused_steps)
 
         # Checkpoint and attempt to write the logs.
         if self._checkpointer is not None:
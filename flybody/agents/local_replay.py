@@ -0,0 +1,315 @@
+"""In-process replay backend for single-process DMPO.
+
+Drop-in replacement of the Reverb table, NStepTransitionAdder and
+make_reverb_dataset for an actor and learner in one process: transitions are
+written to a NumPy ring buffer and sampled into a tf.data pipeline without
+serialization or RPCs.
+"""
+
+import collections
+import threading
+import time
+
+from acme import adders
+from acme import specs
+from acme import types
+import dm_env
+import numpy as np
+import tree
+
+# Same fields as reverb.ReplaySample and reverb.SampleInfo, as far as used.
+ReplaySample = collections.namedtuple('ReplaySample', ['info', 'data'])
+SampleInfo = collections.namedtuple('SampleInfo', ['key', 'probability'])
+
+
+def transition_spec(
+        environment_spec: specs.EnvironmentSpec) -> types.Transition:
+    """Returns spec of n-step transitions, as NStepTransitionAdder.signature."""
+    return types.Transition(
+        observation=environment_spec.observations,
+        action=environment_spec.actions,
+        reward=environment_spec.rewards,
+        discount=environment_spec.discounts,
+        next_observation=environment_spec.observations,
+    )
+
+
+class LocalReplay():
+    """Thread-safe ring buffer of transitions with a rate limiter.
+
+    Transitions are evicted first in, first out, and sampled uniformly. The
+    rate limiter follows reverb.rate_limiters.SampleToInsertRatio: sampling
+    waits until min_size_to_sample transitions were inserted, and inserts and
+    samples wait to keep inserts * samples_per_insert - samples within
+    error_buffer of min_size_to_sample * samples_per_insert. Without
+    samples_per_insert, only the minimum size is enforced, as with
+    reverb.rate_limiters.MinSize. As in Reverb, samples are rate limited per
+    item, so a batch may be taken in several parts.
+    """
+
+    def __init__(self,
+                 environment_spec: specs.EnvironmentSpec,
+                 max_size: int,
+                 min_size_to_sample: int = 1,
+                 samples_per_insert: float | None = None,
+                 error_buffer: float | None = None,
+                 seed: int | None = None):
+        """Initializes the buffer, storage is allocated up front.
+
+        Args:
+            environment_spec: Environment spec of the transitions.
+            max_size: Capacity, in transitions.
+            min_size_to_sample: Number of inserts before sampling starts.
+            samples_per_insert: Target ratio of sampled to inserted
+                transitions, None for no limit.
+            error_buffer: Tolerance of the ratio, in sampled transitions, at
+                least 2 * max(1, samples_per_insert), default 10% of
+                min_size_to_sample * samples_per_insert.
+            seed: Seed of sampling.
+        """
+        self._spec = transition_spec(environment_spec)
+        self._flat_spec = tree.flatten(self._spec)
+        self._storage = [
+            np.zeros((max_size, *spec.shape), spec.dtype)
+            for spec in self._flat_spec
+        ]
+        self._max_size = max_size
+        self._min_size = min_size_to_sample
+        self._samples_per_insert = samples_per_insert
+        if samples_per_insert is None:
+            self._min_diff, self._max_diff = -np.inf, np.inf
+        else:
+            if error_buffer is None:
+                error_buffer = 0.1 * min_size_to_sample * samples_per_insert
+            if error_buffer < 2 * max(1., samples_per_insert):
+                # Otherwise inserts and samples could block each other.
+                raise ValueError('error_buffer must be at least '
+                                 '2 * max(1, samples_per_insert).')
+            offset = min_size_to_sample * samples_per_insert
+            self._min_diff = offset - error_buffer
+            self._max_diff = offset + error_buffer
+        self._rng = np.random.default_rng(seed)
+        self._cond = threading.Condition()
+        self._size = 0
+        self._next = 0
+        self._inserts = 0
+        self._samples = 0
+        self._insert_wait = 0.
+        self._sample_wait = 0.
+        self._pending_inserts = 0
+        self._pending_samples = 0
+        self._closed = False
+
+    @property
+    def spec(self) -> types.Transition:
+        return self._spec
+
+    def _diff(self) -> float:
+        if self._samples_per_insert is None:
+            return 0.
+        return self._inserts * self._samples_per_insert - self._samples
+
+    def _can_insert(self) -> bool:
+        if self._inserts < self._min_size:
+            return True
+        spi = self._samples_per_insert or 0.
+        return self._diff() + spi <= self._max_diff
+
+    def _can_sample(self, num_samples: int) -> bool:
+        if self._inserts < self._min_size or not self._size:
+            return False
+        return self._diff() - num_samples >= self._min_diff
+
+    def _num_can_sample(self) -> int:
+        """Returns number of items which can be sampled now."""
+        if not self._can_sample(1):
+            return 0
+        if self._samples_per_insert is None:
+            return np.iinfo(np.int64).max
+        return int(np.floor(self._diff() - self._min_diff))
+
+    def _wait(self, predicate, pending: str) -> float:
+        """Waits on the condition until predicate, returns wait time."""
+        if predicate() or self._closed:
+            return 0.
+        start = time.time()
+        setattr(self, pending, getattr(self, pending) + 1)
+        self._cond.wait_for(lambda: predicate() or self._closed)
+        setattr(self, pending, getattr(self, pending) - 1)
+        return time.time() - start
+
+    def insert(self, transition: types.Transition):
+        """Inserts a transition, waits while the rate limiter blocks."""
+        values = tree.flatten(transition)
+        with self._cond:
+            self._insert_wait += self._wait(self._can_insert,
+                                            '_pending_inserts')
+            if self._closed:
+                raise RuntimeError('Replay is closed.')
+            for storage, value in zip(self._storage, values):
+                storage[self._next] = value
+            self._next = (self._next + 1) % self._max_size
+            self._size = min(self._size + 1, self._max_size)
+            self._inserts += 1
+            self._cond.notify_all()
+
+    def sample(self, batch_size: int) -> ReplaySample | None:
+        """Samples a batch uniformly, waits while the rate limiter blocks.
+
+        Items are taken as the rate limiter allows, so inserts can continue
+        while a batch larger than the error buffer is being filled.
+
+        Returns:
+            ReplaySample of stacked transitions, None if the replay is closed.
+        """
+        parts = []
+        remaining = batch_size
+        with self._cond:
+            while remaining:
+                self._sample_wait += self._wait(lambda: self._can_sample(1),
+                                                '_pending_samples')
+                if self._closed:
+                    return None
+                num = min(remaining, self._num_can_sample())
+                keys = self._rng.integers(self._size, size=num)
+                values = [storage[keys] for storage in self._storage]
+                parts.append((keys, values, np.full(num, 1. / self._size)))
+                self._samples += num
+                remaining -= num
+                self._cond.notify_all()
+        keys, values, probability = zip(*parts)
+        values = [np.concatenate(value) for value in zip(*values)]
+        return ReplaySample(info=SampleInfo(key=np.concatenate(keys),
+                                            probability=np.concatenate(
+                                                probability)),
+                            data=tree.unflatten_as(self._spec, values))
+
+    def close(self):
+        """Wakes up and ends waiting and future samples."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def size(self) -> int:
+        with self._cond:
+            return self._size
+
+    def get_rate_limiter_stats(self) -> dict:
+        """Returns cumulative rate limiter stats, as ReplayServer does."""
+        with self._cond:
+            return {
+                'time': time.time(),
+                'size': self._size,
+                'inserts': self._inserts,
+                'samples': self._samples,
+                'insert_wait_s': self._insert_wait,
+                'sample_wait_s': self._sample_wait,
+                'pending_inserts': self._pending_inserts,
+                'pending_samples': self._pending_samples,
+            }
+
+
+class LocalNStepTransitionAdder(adders.Adder):
+    """Adds n-step transitions to a LocalReplay.
+
+    Transitions are the same as of acme's NStepTransitionAdder:
+    (o_t, a_t, R_{t:t+n}, D_{t:t+n}, o_{t+n}) with
+      R_{t:t+n} = r_t + discount * d_t * r_{t+1} + ...
+      D_{t:t+n} = d_t * discount * d_{t+1} * ... * discount * d_{t+n-1},
+    where r_t and d_t are reward and discount of the timestep following a_t.
+    Transitions of the last n - 1 steps of an episode are shorter.
+    """
+
+    def __init__(self, replay: LocalReplay, n_step: int, discount: float):
+        """Initializes the adder.
+
+        Args:
+            replay: Replay to insert transitions into.
+            n_step: Number of steps per transition.
+            discount: Additional discount of rewards within a transition.
+        """
+        self._replay = replay
+        self._n_step = n_step
+        self._discount = discount
+        # Steps (o_t, a_t, r_t, d_t) of transitions not yet inserted.
+        self._steps = collections.deque()
+        self._observation = None
+
+    def reset(self):
+        self._steps.clear()
+        self._observation = None
+
+    def add_first(self, timestep: dm_env.TimeStep):
+        if not timestep.first():
+            raise ValueError('add_first called with a non-first timestep.')
+        self.reset()
+        self._observation = timestep.observation
+
+    def add(self, action: types.NestedArray, next_timestep: dm_env.TimeStep,
+            extras: types.NestedArray = ()):
+        del extras  # Not stored, like NStepTransitionAdder without extras.
+        if self._observation is None:
+            raise ValueError('add_first must be called before add.')
+        self._steps.append((self._observation, action, next_timestep.reward,
+                            next_timestep.discount))
+        self._observation = next_timestep.observation
+        if len(self._steps) == self._n_step:
+            self._insert_oldest()
+        if next_timestep.last():
+            while self._steps:
+                self._insert_oldest()
+            self._observation = None
+
+    def _insert_oldest(self):
+        observation, action, reward, discount = self._steps[0]
+        total_reward = np.copy(reward)
+        total_discount = np.copy(discount)
+        for _, _, reward, discount in list(self._steps)[1:]:
+            total_reward = total_reward + (self._discount * total_discount *
+                                           reward)
+            total_discount = total_discount * self._discount * discount
+        self._replay.insert(
+            types.Transition(observation=observation,
+                             action=action,
+                             reward=total_reward,
+                             discount=total_discount,
+                             next_observation=self._observation))
+        self._steps.popleft()
+
+
+def make_local_dataset(replay: LocalReplay,
+                       batch_size: int,
+                       prefetch_size: int | None = None):
+    """Makes a tf.data.Dataset of batches sampled from a LocalReplay.
+
+    Batches are sampled on a tf.data thread and prefetched. The dataset ends
+    when the replay is closed.
+
+    Args:
+        replay: Replay to sample from.
+        batch_size: Batch size.
+        prefetch_size: Number of batches to prefetch.
+
+    Returns:
+        Dataset of batched ReplaySample.
+    """
+    import tensorflow as tf
+
+    def batch_spec(spec):
+        return tf.TensorSpec((batch_size, *spec.shape), spec.dtype)
+
+    signature = ReplaySample(
+        info=SampleInfo(key=tf.TensorSpec((batch_size, ), tf.int64),
+                        probability=tf.TensorSpec((batch_size, ),
+                                                  tf.float64)),
+        data=tree.map_structure(batch_spec, replay.spec))
+
+    def generator():
+        while (sample := replay.sample(batch_size)) is not None:
+            yield sample
+
+    dataset = tf.data.Dataset.from_generator(generator,
+                                             output_signature=signature)
+    if prefetch_size:
+        dataset = dataset.prefetch(prefetch_size)
+    return dataset
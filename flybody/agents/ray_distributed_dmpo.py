@@ -1,7 +1,11 @@
 """Classes for DMPO agent distributed with Ray."""
 
-from typing import Iterator, Callable
+from typing import Iterator, Callable, List
+import shutil
 import socket
+import tempfile
+import threading
+import time
 import dataclasses
 import copy
 import logging
@@ -17,7 +21,6 @@ import sonnet as snt
 import acme
 from acme import core
 from acme import specs
-from acme import datasets
 from acme import adders
 from acme.utils import counting
 from acme.utils import loggers
@@ -27,7 +30,14 @@ from acme.adders import reverb as reverb_adders
 
 from flybody.agents.learning_dmpo import DistributionalMPOLearner
 from flybody.agents import agent_dmpo
-from flybody.agents.actors import DelayedFeedForwardActor
+from flybody.agents.actors import (DelayedFeedForwardActor,
+                                   BatchedFeedForwardActor)
+from flybody.agents.batched_environment_loop import BatchedEnvironmentLoop
+from flybody.agents.counting import AggregatingCounter, ShardedCounter
+from flybody.agents.observation_codec import EncodingAdder, ObservationCodec
+from flybody.agents.remote_as_local_wrapper import RemoteAsLocal
+from flybody.agents.telemetry import Telemetry, TimedActor, TimedAdder
+from flybody.agents.variable_utils import DoubleBufferedVariableClient
 
 
 @dataclasses.dataclass
@@ -35,6 +45,9 @@ class DMPOConfig:
     num_actors: int = 32
     batch_size: int = 256
     prefetch_size: int = 4
+    num_parallel_calls: int = 12  # Parallel Reverb sample streams.
+    max_in_flight_samples_per_worker: int | None = None  # None: 2*batch_size.
+    prefetch_to_device: str | None = None  # E.g. '/gpu:0'.
     min_replay_size: int = 10_000
     max_replay_size: int = 4_000_000
     samples_per_insert: float = 32.  # None: limiter = reverb.rate_limiters.MinSize()
@@ -57,11 +70,63 @@ class DMPOConfig:
     checkpoint_max_to_keep: int | None = 1  # None: keep all checkpoints.
     checkpoint_directory: str | None = '~/ray-ckpts/'  # None: no checkpointing.
     time_delta_minutes: float = 30
+    replay_checkpoint_minutes: float | None = None  # None: no replay ckpts.
+    replay_checkpoint_max_to_keep: int = 1  # Bounds replay ckpt disk usage.
+    replay_checkpoint_to_load: str | None = None  # Replay ckpt (directory).
     terminal: str = 'current_terminal'
     replay_table_name: str = reverb_adders.DEFAULT_PRIORITY_TABLE
     print_fn: Callable = logging.info
     userdata: dict | None = None
     actor_observation_callback: Callable | None = None
+    num_envs_per_actor: int = 1  # >1: batched policy calls in actors.
+    double_buffered_weight_sync: bool = True  # Fetch weights in background.
+    num_fused_steps: int = 1  # Learner steps per compiled loop.
+    counter_time_delta: float = 1.  # Seconds between counter flushes.
+    num_counter_shards: int = 1  # Counter Ray actors, see ShardedCounter.
+    learner_jit_compile: bool = False  # XLA-compile the learner step.
+    learner_mixed_precision: str | None = None  # 'float16' or 'bfloat16'.
+    observation_codec: ObservationCodec | None = None  # Compact replay.
+    telemetry_directory: str | None = None  # None: no telemetry export.
+    telemetry_every: float = 30.  # Seconds between telemetry exports.
+
+
+def _replay_checkpoints(directory: str) -> list[str]:
+    """Returns completed Reverb checkpoints in directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if os.path.exists(os.path.join(directory, name, 'DONE')))
+
+
+def latest_replay_checkpoint(path: str) -> str:
+    """Returns the latest Reverb checkpoint in path, or path itself.
+
+    Args:
+        path: A replay checkpoint, or a directory of them, e.g. as returned
+            by ReplayServer.get_replay_checkpoint_dir.
+    """
+    path = os.path.expanduser(path)
+    if os.path.exists(os.path.join(path, 'DONE')):
+        return path
+    checkpoints = _replay_checkpoints(path)
+    if not checkpoints:
+        raise FileNotFoundError(f'No replay checkpoint in {path}.')
+    return checkpoints[-1]
+
+
+def _make_telemetry(config: DMPOConfig, role: str) -> Telemetry:
+    """Returns telemetry of role, exported if configured."""
+    telemetry = Telemetry(role)
+    if config.telemetry_directory is not None:
+        telemetry.start_exporter(config.telemetry_directory,
+                                 config.telemetry_every)
+    return telemetry
+
+
+def _counter_flush_stats(counter: AggregatingCounter) -> dict:
+    """Returns counter RPC stats for telemetry."""
+    return {f'counter_{k}': v for k, v in counter.flush_stats().items()}
 
 
 class ReplayServer():
@@ -72,6 +137,10 @@ class ReplayServer():
         """Spawn a Reverb server with experience replay tables."""
 
         self._config = config
+        if self._config.observation_codec is not None:
+            # Transitions are stored encoded.
+            environment_spec = (self._config.observation_codec.
+                                encode_environment_spec(environment_spec))
         if self._config.samples_per_insert is None:
             # We will take a samples_per_insert ratio of None to mean that there is
             # no limit, i.e. this only implies a min size limit.
@@ -95,15 +164,122 @@ class ReplayServer():
             signature=reverb_adders.NStepTransitionAdder.signature(
                 environment_spec))
 
-        self._replay_server = reverb.Server(tables=[replay_buffer], port=None)
+        # Maybe checkpoint the table periodically, and maybe warm-start it from
+        # a checkpoint, incl. rate limiter state, so learning can continue
+        # without refilling min_replay_size.
+        checkpointer = None
+        self._replay_checkpoint_dir = None
+        if (self._config.replay_checkpoint_minutes is not None
+                and self._config.checkpoint_directory is not None):
+            self._replay_checkpoint_dir = os.path.join(
+                os.path.expanduser(self._config.checkpoint_directory),
+                'replay', time.strftime('%Y%m%d-%H%M%S'))
+        if (self._replay_checkpoint_dir is not None
+                or self._config.replay_checkpoint_to_load is not None):
+            fallback = None
+            if self._config.replay_checkpoint_to_load is not None:
+                fallback = latest_replay_checkpoint(
+                    self._config.replay_checkpoint_to_load)
+            checkpointer = reverb.checkpointers.DefaultCheckpointer(
+                path=self._replay_checkpoint_dir or tempfile.mkdtemp(),
+                fallback_checkpoint_path=fallback)
+
+        self._replay_server = reverb.Server(tables=[replay_buffer],
+                                            port=None,
+                                            checkpointer=checkpointer)
         # Get hostname and port of the server.
         hostname = socket.gethostname()
         port = self._replay_server.port
         self._replay_server_address = f'{hostname}:{port}'
 
+        # Table size and rate limiter telemetry.
+        self._telemetry = _make_telemetry(self._config, 'replay')
+
+        def rate_limiter_totals():
+            stats = self.get_rate_limiter_stats()
+            return {
+                k: stats[k]
+                for k in ('inserts', 'samples', 'insert_wait_s',
+                          'sample_wait_s')
+            }
+
+        def table_gauges():
+            stats = self.get_rate_limiter_stats()
+            return {
+                k: stats[k]
+                for k in ('size', 'pending_inserts', 'pending_samples')
+            }
+
+        self._telemetry.add_collector(rate_limiter_totals, cumulative=True)
+        self._telemetry.add_collector(table_gauges)
+
+        if self._replay_checkpoint_dir is not None:
+            self._checkpoint_thread = threading.Thread(
+                target=self._checkpoint_loop, daemon=True)
+            self._checkpoint_thread.start()
+
+    def _checkpoint_loop(self):
+        """Writes table checkpoints in the background, keeps the latest."""
+        client = self._replay_server.localhost_client()
+        while True:
+            time.sleep(60 * self._config.replay_checkpoint_minutes)
+            try:
+                # The table is only locked while its items are collected,
+                # inserts and samples continue while the checkpoint is
+                # written.
+                start = time.time()
+                path = client.checkpoint()
+                logging.info('Replay checkpoint %s written in %.1f s.', path,
+                             time.time() - start)
+                checkpoints = _replay_checkpoints(self._replay_checkpoint_dir)
+                for old in checkpoints[:-self._config.
+                                       replay_checkpoint_max_to_keep]:
+                    shutil.rmtree(old, ignore_errors=True)
+            except Exception:  # Retry next interval, e.g. after a full disk.
+                logging.exception('Replay checkpoint failed.')
+
+    def get_replay_checkpoint_dir(self) -> str | None:
+        """Returns directory of replay checkpoints of this run, if any."""
+        return self._replay_checkpoint_dir
+
     def get_server_address(self):
         return self._replay_server_address
 
+    def get_rate_limiter_stats(self) -> dict:
+        """Returns cumulative rate limiter stats of the replay table.
+
+        Returns:
+            Dict with 'time', table 'size', numbers of completed 'inserts' and
+            'samples', total time insert and sample calls waited on the rate
+            limiter, 'insert_wait_s' and 'sample_wait_s' (incl. calls still
+            waiting), and numbers of calls waiting now, 'pending_inserts' and
+            'pending_samples'.
+        """
+        info = self._replay_server.localhost_client().server_info()[
+            self._config.replay_table_name]
+        limiter = info.rate_limiter_info
+
+        def wait_time(stats):
+            return (stats.completed_wait_time.ToTimedelta() +
+                    stats.pending_wait_time.ToTimedelta()).total_seconds()
+
+        return {
+            'time': time.time(),
+            'size': info.current_size,
+            'inserts': limiter.insert_stats.completed,
+            'samples': limiter.sample_stats.completed,
+            'insert_wait_s': wait_time(limiter.insert_stats),
+            'sample_wait_s': wait_time(limiter.sample_stats),
+            'pending_inserts': limiter.insert_stats.pending,
+            'pending_samples': limiter.sample_stats.pending,
+        }
+
+
+# Ray concurrency groups of the Learner actor, to pass to ray.remote. Variable
+# requests of actors run in their own thread, so they don't wait behind queued
+# `run` calls, which run one at a time in the default group.
+LEARNER_CONCURRENCY_GROUPS = {'variables': 1}
+
 
 class Learner(DistributionalMPOLearner):
     """The Learning part of the DMPO agent."""
@@ -121,6 +297,8 @@ class Learner(DistributionalMPOLearner):
         self._config = dmpo_config
         self._reverb_client = reverb.Client(replay_server_address)
         self._label = label
+        # Variables published to the object store: names -> (version, ref).
+        self._published_variables = {}
 
         def wrapped_network_factory(action_spec):
             networks_dict = network_factory(action_spec)
@@ -139,7 +317,12 @@ class Learner(DistributionalMPOLearner):
         target_networks.init(environment_spec)
 
         dataset = self._make_dataset_iterator(self._reverb_client)
-        counter = counting.Counter(parent=counter, prefix=label)
+        counter = AggregatingCounter(parent=counter,
+                                     prefix=label,
+                                     time_delta=self._config.counter_time_delta)
+        self._telemetry = _make_telemetry(self._config, label)
+        self._telemetry.add_collector(
+            lambda: _counter_flush_stats(counter), cumulative=True)
         if self._config.logger is None:
             logger = loggers.make_default_logger(
                 label=label,
@@ -188,22 +371,52 @@ class Learner(DistributionalMPOLearner):
             checkpoint_max_to_keep=self._config.checkpoint_max_to_keep,
             directory=self._config.checkpoint_directory,
             checkpoint_to_load=self._config.checkpoint_to_load,
-            time_delta_minutes=self._config.time_delta_minutes)
+            time_delta_minutes=self._config.time_delta_minutes,
+            num_fused_steps=self._config.num_fused_steps,
+            jit_compile=self._config.learner_jit_compile,
+            mixed_precision=self._config.learner_mixed_precision,
+            telemetry=self._telemetry)
 
-    def _step(self):
+    def _step(self, inputs):
         # Workaround to access _step in DistributionalMPOLearner:
         # @tf.function
-        # def _step(self)
+        # def _step(self, inputs)
         #    ...
-        return DistributionalMPOLearner._step(self)
+        return DistributionalMPOLearner._step(self, inputs)
+
+    def _fused_step(self, inputs):
+        return DistributionalMPOLearner._fused_step(self, inputs)
 
     def run(self, num_steps=None):
         del num_steps  # Not used.
-        # Run fixed number of learning steps and return control to have a chance
-        # to process calls to `get_variables`.
-        for _ in range(self._config.num_learner_steps):
+        # Run fixed number of learning steps. Each `step` call runs
+        # num_fused_steps learning steps. Calls to `get_variables_handle` are
+        # processed concurrently, see LEARNER_CONCURRENCY_GROUPS.
+        num_calls = max(
+            1, self._config.num_learner_steps // self._config.num_fused_steps)
+        for _ in range(num_calls):
             self.step()
 
+    @ray.method(concurrency_group='variables')
+    def get_variables_handle(
+            self, names: List[str]) -> tuple[int, ray.ObjectRef]:
+        """Returns version and object store reference of variables.
+
+        The variables are serialized and put in the Ray object store once per
+        version, i.e. learner step count, and all actors fetch the same object
+        zero-copy. See ObjectStoreVariableSource. Runs concurrently with `run`,
+        so the variables may be read during a learning step.
+        """
+        version = int(self._num_steps.numpy())
+        key = tuple(names)
+        published = self._published_variables.get(key)
+        self._telemetry.increment('variable_requests')
+        if published is None or published[0] != version:
+            published = (version, ray.put(self.get_variables(names)))
+            self._published_variables[key] = published
+            self._telemetry.increment('variable_publishes')
+        return published
+
     def isready(self):
         """Dummy method to check if learner is ready."""
         pass
@@ -220,15 +433,52 @@ class Learner(DistributionalMPOLearner):
     ) -> Iterator[reverb.ReplaySample]:
         """Create a dataset iterator to use for learning/updating the agent."""
         # The dataset provides an interface to sample from replay.
-        dataset = datasets.make_reverb_dataset(
-            table=self._config.replay_table_name,
+        dataset = agent_dmpo.make_replay_dataset(
             server_address=reverb_client.server_address,
+            table=self._config.replay_table_name,
             batch_size=self._config.batch_size,
             prefetch_size=self._config.prefetch_size,
-        )
+            num_parallel_calls=self._config.num_parallel_calls,
+            max_in_flight_samples_per_worker=self._config.
+            max_in_flight_samples_per_worker,
+            prefetch_to_device=self._config.prefetch_to_device,
+            observation_codec=self._config.observation_codec,
+            num_fused_steps=self._config.num_fused_steps)
         return iter(dataset)
 
 
+class ObjectStoreVariableSource(core.VariableSource):
+    """Variable source fetching learner variables from the Ray object store.
+
+    Each request only gets a small (version, ObjectRef) handle from the
+    learner. The variables themselves are fetched from the object store, and
+    only if their version changed since the last request.
+    """
+
+    def __init__(self, learner: RemoteAsLocal):
+        """Initializes the source.
+
+        Args:
+            learner: Learner wrapped with RemoteAsLocal.
+        """
+        self._learner = learner
+        self._cache = {}  # names -> (version, variables).
+
+    def get_versioned_variables(
+            self, names: List[str]) -> tuple[int, List[List[np.ndarray]]]:
+        """Returns learner step count and variables, zero-copy and read-only."""
+        version, ref = self._learner.get_variables_handle(names)
+        key = tuple(names)
+        cached = self._cache.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, ray.get(ref))
+            self._cache[key] = cached
+        return cached
+
+    def get_variables(self, names: List[str]) -> List[List[np.ndarray]]:
+        return self.get_versioned_variables(names)[1]
+
+
 class EnvironmentLoop(acme.EnvironmentLoop):
     """Actor and Evaluator class."""
 
@@ -272,9 +522,15 @@ class EnvironmentLoop(acme.EnvironmentLoop):
         self._config = dmpo_config
         label = label or actor_or_evaluator
 
-        # Create the environment.
+        # Create the environment(s). Only actors drive several environments.
         environment = environment_factory(actor_or_evaluator == 'evaluator')
         environment_spec = specs.make_environment_spec(environment)
+        num_envs = 1
+        if actor_or_evaluator == 'actor':
+            num_envs = self._config.num_envs_per_actor
+        environments = [environment] + [
+            environment_factory(False) for _ in range(num_envs - 1)
+        ]
 
         def wrapped_network_factory(action_spec):
             networks_dict = network_factory(action_spec)
@@ -296,7 +552,10 @@ class EnvironmentLoop(acme.EnvironmentLoop):
                 networks.policy_network,
                 network_utils.StochasticSamplingHead(),
             ])
-            adder = self._make_adder(self._reverb_client)
+            env_adders = [
+                self._make_adder(self._reverb_client)
+                for _ in range(num_envs)
+            ]
             save_data = False
 
         elif actor_or_evaluator == 'evaluator':
@@ -306,18 +565,31 @@ class EnvironmentLoop(acme.EnvironmentLoop):
                 networks.policy_network,
                 network_utils.StochasticMeanHead(),
             ])
-            adder = None
+            env_adders = [None]
             save_data = self._config.logger_save_csv_data
 
-        # Create the agent.
+        # Create the agent, timing policy inference, inserts and updates.
+        self._telemetry = _make_telemetry(self._config, actor_or_evaluator)
+        env_adders = [
+            adder and TimedAdder(adder, self._telemetry)
+            for adder in env_adders
+        ]
         actor = self._make_actor(
             policy_network=policy_network,
-            adder=adder,
+            env_adders=env_adders,
             variable_source=variable_source,
             observation_callback=self._config.actor_observation_callback)
+        actor = TimedActor(actor, self._telemetry)
+        if hasattr(self._variable_client, 'metrics'):
+            # Weight sync staleness.
+            self._telemetry.add_collector(self._variable_client.metrics)
 
         # Create logger and counter; actors will not spam bigtable.
-        counter = counting.Counter(parent=counter, prefix=actor_or_evaluator)
+        counter = AggregatingCounter(parent=counter,
+                                     prefix=actor_or_evaluator,
+                                     time_delta=self._config.counter_time_delta)
+        self._telemetry.add_collector(
+            lambda: _counter_flush_stats(counter), cumulative=True)
         if self._config.logger is None:
             logger = loggers.make_default_logger(
                 label=label,
@@ -336,23 +608,65 @@ class EnvironmentLoop(acme.EnvironmentLoop):
                 time_delta=self._config.log_every,
                 **logger_kwargs)
 
+        # Time of last progress, see `heartbeat`.
+        self._last_progress_time = time.time()
+        if num_envs > 1:
+            self._batched_loop = BatchedEnvironmentLoop(
+                environments, actor, counter, logger,
+                metrics_fn=self._episode_metrics)
+        else:
+            self._batched_loop = None
         super().__init__(environment, actor, counter, logger)
 
+    def run(self,
+            num_episodes: int | None = None,
+            num_steps: int | None = None):
+        if self._batched_loop is not None:
+            return self._batched_loop.run(num_episodes, num_steps)
+        return super().run(num_episodes, num_steps)
+
+    def run_episode(self):
+        result = super().run_episode()
+        result.update(self._episode_metrics())
+        return result
+
+    def _episode_metrics(self) -> dict:
+        """Records progress, returns staleness of actor's policy weights."""
+        self._last_progress_time = time.time()
+        if hasattr(self._variable_client, 'metrics'):
+            return self._variable_client.metrics()
+        return {}
+
     def isready(self):
         """Dummy method to check if actor is ready."""
         pass
 
+    def heartbeat(self) -> float:
+        """Returns seconds since the last finished episode, or since start.
+
+        Answered while `run` is running if the Ray actor was created with
+        max_concurrency > 1, see flybody.agents.actor_pool.ActorPool.
+        """
+        return time.time() - self._last_progress_time
+
     def _make_actor(
         self,
         policy_network: snt.Module,
-        adder: adders.Adder | None = None,
+        env_adders: list[adders.Adder | None],
         variable_source: core.VariableSource | None = None,
         observation_callback: Callable | None = None,
     ):
-        """Create an actor instance."""
+        """Create an actor instance, batched for several environments."""
         if variable_source:
+            if hasattr(variable_source, 'get_variables_handle'):
+                # Share one serialized copy of variables between all actors.
+                variable_source = ObjectStoreVariableSource(variable_source)
             # Create the variable client responsible for keeping the actor up-to-date.
-            variable_client = variable_utils.VariableClient(
+            if self._config.double_buffered_weight_sync:
+                variable_client_cls = DoubleBufferedVariableClient
+            else:
+                variable_client_cls = variable_utils.VariableClient
+            variable_client = variable_client_cls(
                 client=variable_source,
                 variables={'policy': policy_network.variables},
                 update_period=self._config.
@@ -363,18 +677,89 @@ class EnvironmentLoop(acme.EnvironmentLoop):
             variable_client.update_and_wait()
         else:
             variable_client = None
-
+        self._variable_client = variable_client
+
+        if len(env_adders) > 1:
+            return BatchedFeedForwardActor(policy_network=policy_network,
+                                           num_envs=len(env_adders),
+                                           adders=env_adders,
+                                           variable_client=variable_client,
+                                           action_delay=None,
+                                           observation_callback=observation_callback)
         # This is a modified version of actors.FeedForwardActor in Acme.
         return DelayedFeedForwardActor(policy_network=policy_network,
-                                       adder=adder,
+                                       adder=env_adders[0],
                                        variable_client=variable_client,
                                        action_delay=None,
                                        observation_callback=observation_callback)
 
     def _make_adder(self, replay_client: reverb.Client) -> adders.Adder:
         """Create an adder which records data generated by the actor/environment."""
-        return reverb_adders.NStepTransitionAdder(
+        adder = reverb_adders.NStepTransitionAdder(
             priority_fns={self._config.replay_table_name: lambda x: 1.},
             client=replay_client,
             n_step=self._config.n_step,
             discount=self._config.discount)
+        if self._config.observation_codec is not None:
+            adder = EncodingAdder(adder, self._config.observation_codec)
+        return adder
+
+
+def run_environment_loop(
+        environment,
+        ready: Callable[[], None],
+        replay_server_address: str,
+        learner_name: str,
+        counter_name: str,
+        network_factory,
+        dmpo_config,
+        actor_or_evaluator='actor',
+        ray_address: str = 'auto',
+        namespace: str | None = None,
+        environment_factory: Callable | None = None,
+):
+    """Worker function to run actor or evaluator in a fork server process.
+
+    Forked workers are not Ray actors, so they connect to the Ray cluster
+    themselves and look up the learner and counter by their actor names.
+    See flybody.agents.fork_server.ForkServer.start_worker.
+
+    Args:
+        environment: Environment forked from the fork server template.
+        ready: Called once the loop is built, before running it.
+        replay_server_address: Address of the Reverb replay server.
+        learner_name: Name of the learner Ray actor.
+        counter_name: Name of the counter Ray actor, or name prefix of the
+            counter shards if dmpo_config.num_counter_shards > 1.
+        network_factory: Network factory, as in EnvironmentLoop.
+        dmpo_config: DMPOConfig, as in EnvironmentLoop.
+        actor_or_evaluator: Either 'actor' or 'evaluator'.
+        ray_address: Address of the Ray cluster to connect to.
+        namespace: Ray namespace of the named learner and counter actors.
+        environment_factory: Factory of additional environments, needed if
+            dmpo_config.num_envs_per_actor > 1.
+    """
+    ray.init(address=ray_address, namespace=namespace)
+    learner = RemoteAsLocal(ray.get_actor(learner_name))
+    if dmpo_config.num_counter_shards > 1:
+        counter = ShardedCounter([
+            RemoteAsLocal(ray.get_actor(f'{counter_name}_{i}'))
+            for i in range(dmpo_config.num_counter_shards)
+        ])
+    else:
+        counter = RemoteAsLocal(ray.get_actor(counter_name))
+    environments = iter([environment])
+
+    def worker_environment_factory(training):
+        # The forked environment first, then new ones.
+        return next(environments, None) or environment_factory(training)
+
+    loop = EnvironmentLoop(replay_server_address=replay_server_address,
+                           variable_source=learner,
+                           counter=counter,
+                           network_factory=network_factory,
+                           environment_factory=worker_environment_factory,
+                           dmpo_config=dmpo_config,
+                           actor_or_evaluator=actor_or_evaluator)
+    ready()
+    loop.run()
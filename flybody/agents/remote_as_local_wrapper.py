@@ -1,8 +1,17 @@
 """Wrapper to call methods of remote Ray actors as if they were local."""
 
+import bisect
 import inspect
+import math
+import threading
+import time
+from typing import Sequence
+
 import ray
 
+# Upper bounds of latency histogram buckets, s: 100 us to ~100 s, doubling.
+LATENCY_BUCKETS = tuple(1e-4 * 2**i for i in range(21))
+
 
 class RemoteAsLocal():
     """This wrapper allows calling methods of remote Ray actors (e.g. classes
@@ -35,6 +44,18 @@ class RemoteAsLocal():
     # latter is the default behavior):
     obj_ref = counter.get_counts(block=False)  # Call as local; returns a future.
     counter.get_counts(block=True)  # Call as local; blocks and returns 2.
+
+    # Futures can be awaited in asyncio code, or converted to
+    # concurrent.futures.Future:
+    counts = await counter.get_counts(block=False)
+    future = counter.get_counts(block=False).future()
+
+    # Several calls in one round trip, run in order by the actor:
+    _, counts = counter.call_batch([('increment', (), {'inc': 1}),
+                                    'get_counts'])
+
+    Each wrapper records call counts, calls in flight and a latency histogram
+    per method, from call until the result is available; see `call_stats`.
     """
 
     def __init__(self, remote_handle):
@@ -45,17 +66,15 @@ class RemoteAsLocal():
         """
 
         self._remote_handle = remote_handle
+        self._stats_lock = threading.Lock()
+        self._stats = {}
 
         def remote_caller(method_name):
             # Wrapper for remote class's methods to mimic local calling.
             def wrapper(*args, block=True, **kwargs):
                 obj_ref = getattr(self._remote_handle,
                                   method_name).remote(*args, **kwargs)
-                if block:
-                    return ray.get(
-                        obj_ref)  # Block until called method returns.
-                else:
-                    return obj_ref  # Don't block and return a future.
+                return self._track(method_name, obj_ref, block)
 
             return wrapper
 
@@ -72,3 +91,126 @@ class RemoteAsLocal():
 
     def __dir__(self):
         return dir(self._remote_handle)
+
+    def _track(self, method_name: str, obj_ref: ray.ObjectRef, block: bool):
+        """Records the call, returns its result if block else obj_ref."""
+        start = time.perf_counter()
+        with self._stats_lock:
+            stats = self._stats.get(method_name)
+            if stats is None:
+                stats = self._stats[method_name] = {
+                    'calls': 0,
+                    'errors': 0,
+                    'in_flight': 0,
+                    'total_s': 0.,
+                    'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+                }
+            stats['calls'] += 1
+            stats['in_flight'] += 1
+
+        def done(error: bool):
+            latency = time.perf_counter() - start
+            with self._stats_lock:
+                stats['in_flight'] -= 1
+                stats['errors'] += error
+                stats['total_s'] += latency
+                stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS,
+                                                    latency)] += 1
+
+        if not block:
+            obj_ref.future().add_done_callback(
+                lambda future: done(future.exception() is not None))
+            return obj_ref  # Don't block and return a future.
+        try:
+            result = ray.get(obj_ref)  # Block until called method returns.
+        except Exception:
+            done(error=True)
+            raise
+        done(error=False)
+        return result
+
+    def call_batch(self, calls: Sequence, block: bool = True):
+        """Calls several methods of the actor in one round trip.
+
+        The calls run in order, in one task of the actor, which is recorded as
+        a single '(batch)' call in `call_stats`.
+
+        Args:
+            calls: Method names, or (method name, args, kwargs) tuples.
+            block: Whether to wait for and return the results, or return a
+                future of them.
+
+        Returns:
+            List of results of the calls, or its future if block is False.
+        """
+        calls = [(call, (), {}) if isinstance(call, str) else tuple(call)
+                 for call in calls]
+        obj_ref = self._remote_handle.__ray_call__.remote(_call_many, calls)
+        return self._track('(batch)', obj_ref, block)
+
+    def call_stats(self) -> dict:
+        """Returns call telemetry per method.
+
+        Returns:
+            Dict of method name -> dict with 'calls', 'errors' and
+            'in_flight' counts, mean latency 'mean_s', percentiles 'p50_s' and
+            'p99_s' (upper bounds of their histogram buckets, inf if beyond
+            the last bucket) and the latency histogram 'histogram' as
+            (bucket upper bound, count) pairs. Latencies are of completed
+            calls.
+        """
+        with self._stats_lock:
+            stats = {name: dict(s, buckets=list(s['buckets']))
+                     for name, s in self._stats.items()}
+        bounds = LATENCY_BUCKETS + (float('inf'), )
+        for s in stats.values():
+            buckets = s.pop('buckets')
+            done = sum(buckets)
+            s['mean_s'] = s.pop('total_s') / done if done else float('nan')
+            for key, q in (('p50_s', 0.5), ('p99_s', 0.99)):
+                cumulative, s[key] = 0, float('nan')
+                for bound, count in zip(bounds, buckets):
+                    cumulative += count
+                    if done and cumulative >= q * done:
+                        s[key] = bound
+                        break
+            s['histogram'] = [(bound, count)
+                              for bound, count in zip(bounds, buckets)
+                              if count]
+        return stats
+
+    def reset_call_stats(self):
+        """Clears call telemetry of completed calls."""
+        with self._stats_lock:
+            for name, s in list(self._stats.items()):
+                if s['in_flight']:
+                    s.update(calls=s['in_flight'], errors=0, total_s=0.,
+                             buckets=[0] * len(s['buckets']))
+                else:
+                    del self._stats[name]
+
+
+def _call_many(instance, calls):
+    """Runs calls on the actor instance, via ActorHandle.__ray_call__."""
+    return [
+        getattr(instance, name)(*args, **kwargs)
+        for name, args, kwargs in calls
+    ]
+
+
+def format_call_stats(stats: dict) -> str:
+    """Formats `RemoteAsLocal.call_stats` as a table, most total time first."""
+
+    def total_time(item):
+        s = item[1]
+        completed = s['calls'] - s['in_flight']
+        return 0. if math.isnan(s['mean_s']) else s['mean_s'] * completed
+
+    lines = []
+    for name, s in sorted(stats.items(), key=total_time, reverse=True):
+        lines.append(f'{name:<24} {s["calls"]:8d} calls '
+                     f'{s["in_flight"]:4d} in flight  '
+                     f'mean {1e3 * s["mean_s"]:9.2f} ms  '
+                     f'p50 {1e3 * s["p50_s"]:9.2f} ms  '
+                     f'p99 {1e3 * s["p99_s"]:9.2f} ms')
+    return '\n'.join(lines)
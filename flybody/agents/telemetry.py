@@ -0,0 +1,388 @@
+"""Throughput and backpressure telemetry of distributed training.
+
+Each process (replay server, learner, actors, evaluator) records metrics in a
+Telemetry instance and periodically exports them to a directory as a
+Prometheus text file, e.g. for the node exporter textfile collector, and as
+JSON. The summary CLI aggregates the JSON files of all processes:
+
+    python -m flybody.agents.telemetry ~/ray-telemetry
+
+Metrics are:
+  * counters, monotonic totals, e.g. env steps, exported with rates over the
+    last export interval;
+  * timers, count and total seconds of timed calls, e.g. policy inference;
+  * gauges, current values, e.g. replay table size or weight staleness.
+"""
+
+import argparse
+import collections
+import contextlib
+import glob
+import json
+import os
+import re
+import socket
+import threading
+import time
+from typing import Callable, Iterator
+
+from acme import adders
+from acme import types
+import dm_env
+
+PROMETHEUS_PREFIX = 'flybody_'
+
+
+class Telemetry():
+    """Thread-safe metrics of one process, see the module docstring."""
+
+    def __init__(self, role: str):
+        """Initializes the metrics.
+
+        Args:
+            role: Role of the process, e.g. 'learner', 'actor'.
+        """
+        self._role = role
+        self._host = socket.gethostname()
+        self._pid = os.getpid()
+        self._start_time = time.time()
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(float)
+        self._timers = collections.defaultdict(lambda: [0, 0., 0.])
+        self._gauges = {}
+        self._collectors = []
+        self._last_export = None  # (time, counters) for rates.
+        self._exporter = None
+        self._stop = threading.Event()
+
+    def increment(self, name: str, value: float = 1.):
+        """Adds value to counter name."""
+        with self._lock:
+            self._counters[name] += value
+
+    def set(self, name: str, value: float):
+        """Sets gauge name."""
+        with self._lock:
+            self._gauges[name] = value
+
+    def record(self, name: str, seconds: float):
+        """Records a duration of timer name."""
+        with self._lock:
+            timer = self._timers[name]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Times the enclosed block as timer name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def add_collector(self, collect: Callable[[], dict],
+                      cumulative: bool = False):
+        """Adds a function called at each snapshot, returning metrics.
+
+        Args:
+            collect: Returns a dict of metric name -> value.
+            cumulative: Whether the values are totals, exported as counters,
+                or else gauges.
+        """
+        self._collectors.append((collect, cumulative))
+
+    def snapshot(self) -> dict:
+        """Returns all metrics, incl. collected ones, as a JSON-able dict."""
+        collected_counters, collected_gauges = {}, {}
+        for collect, cumulative in self._collectors:
+            try:
+                values = collect()
+            except Exception:  # E.g. a remote call failed; skip this time.
+                continue
+            (collected_counters if cumulative else collected_gauges).update(
+                {k: float(v) for k, v in values.items()})
+        now = time.time()
+        with self._lock:
+            counters = dict(self._counters, **collected_counters)
+            timers = {
+                name: {'count': count, 'total_s': total, 'max_s': max_s}
+                for name, (count, total, max_s) in self._timers.items()
+            }
+            gauges = dict(self._gauges, **collected_gauges)
+            last, self._last_export = self._last_export, (now, counters)
+        rates = {}
+        if last is not None and now > last[0]:
+            rates = {
+                name: (value - last[1].get(name, 0.)) / (now - last[0])
+                for name, value in counters.items()
+            }
+        return {
+            'role': self._role,
+            'host': self._host,
+            'pid': self._pid,
+            'time': now,
+            'uptime_s': now - self._start_time,
+            'counters': counters,
+            'rates': rates,
+            'timers': timers,
+            'gauges': gauges,
+        }
+
+    def export(self, directory: str) -> dict:
+        """Writes a snapshot to directory as .prom and .json, returns it."""
+        snapshot = self.snapshot()
+        directory = os.path.expanduser(directory)
+        os.makedirs(directory, exist_ok=True)
+        name = os.path.join(directory,
+                            f'{self._role}-{self._host}-{self._pid}')
+        _write_atomic(f'{name}.json', json.dumps(snapshot, indent=1))
+        _write_atomic(f'{name}.prom', to_prometheus(snapshot))
+        return snapshot
+
+    def start_exporter(self, directory: str, interval: float = 30.):
+        """Exports every interval seconds on a background thread."""
+
+        def export_loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.export(directory)
+                except OSError:  # E.g. a full disk, keep training.
+                    pass
+
+        self._exporter = threading.Thread(target=export_loop, daemon=True)
+        self._exporter.start()
+
+    def close(self):
+        """Stops the exporter thread."""
+        self._stop.set()
+        if self._exporter is not None:
+            self._exporter.join()
+            self._exporter = None
+
+
+def _write_atomic(path: str, text: str):
+    """Writes text to path so readers never see a partial file."""
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _metric_name(name: str) -> str:
+    return PROMETHEUS_PREFIX + re.sub('[^a-zA-Z0-9_]', '_', name)
+
+
+def to_prometheus(snapshot: dict) -> str:
+    """Formats a Telemetry snapshot in the Prometheus text format."""
+    labels = (f'{{role="{snapshot["role"]}",host="{snapshot["host"]}",'
+              f'pid="{snapshot["pid"]}"}}')
+    lines = []
+
+    def add(name, kind, value):
+        lines.append(f'# TYPE {name} {kind}')
+        lines.append(f'{name}{labels} {value!r}')
+
+    add(_metric_name('uptime_seconds'), 'gauge', snapshot['uptime_s'])
+    for name, value in sorted(snapshot['counters'].items()):
+        add(_metric_name(name) + '_total', 'counter', value)
+    for name, timer in sorted(snapshot['timers'].items()):
+        name = _metric_name(name) + '_seconds'
+        lines.append(f'# TYPE {name} summary')
+        lines.append(f'{name}_sum{labels} {timer["total_s"]!r}')
+        lines.append(f'{name}_count{labels} {timer["count"]!r}')
+    for name, value in sorted(snapshot['gauges'].items()):
+        add(_metric_name(name), 'gauge', value)
+    return '\n'.join(lines) + '\n'
+
+
+class TimedAdder(adders.Adder):
+    """Adder which records insert latency, as timer 'adder_insert'."""
+
+    def __init__(self, adder: adders.Adder, telemetry: Telemetry):
+        self._adder = adder
+        self._telemetry = telemetry
+
+    def add_first(self, timestep: dm_env.TimeStep):
+        with self._telemetry.timer('adder_insert'):
+            self._adder.add_first(timestep)
+
+    def add(self, action: types.NestedArray, next_timestep: dm_env.TimeStep,
+            extras: types.NestedArray = ()):
+        with self._telemetry.timer('adder_insert'):
+            self._adder.add(action, next_timestep, extras)
+
+    def reset(self):
+        self._adder.reset()
+
+
+class TimedActor():
+    """Actor wrapper recording policy inference, observe and update times.
+
+    Works for DelayedFeedForwardActor and BatchedFeedForwardActor: each
+    `observe` call is one environment step, counted as 'env_steps'.
+    """
+
+    _TIMERS = {
+        'select_action': 'policy_inference',
+        'select_actions': 'policy_inference',
+        'observe': 'observe',
+        'update': 'variable_update',
+    }
+
+    def __init__(self, actor, telemetry: Telemetry):
+        self._actor = actor
+        self._telemetry = telemetry
+
+    def __getattr__(self, name):
+        attr = getattr(self._actor, name)
+        timer = self._TIMERS.get(name)
+        if timer is None:
+            return attr
+
+        def timed(*args, **kwargs):
+            with self._telemetry.timer(timer):
+                result = attr(*args, **kwargs)
+            if name == 'observe':
+                self._telemetry.increment('env_steps')
+            return result
+
+        return timed
+
+
+def load_snapshots(directory: str) -> list[dict]:
+    """Returns the latest snapshots of all processes in directory."""
+    snapshots = []
+    for path in sorted(
+            glob.glob(os.path.join(os.path.expanduser(directory), '*.json'))):
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):  # Being replaced, or not telemetry.
+            continue
+    return snapshots
+
+
+def summarize(snapshots: list[dict], stale_after: float | None = None) -> dict:
+    """Aggregates snapshots per role.
+
+    Counters and rates are summed, timers are merged and gauges are averaged
+    (and their maximum kept) over the processes of each role.
+
+    Args:
+        snapshots: Snapshots, e.g. from load_snapshots.
+        stale_after: Ignore snapshots older than this many seconds.
+
+    Returns:
+        Dict of role -> dict with 'processes', 'counters', 'rates', 'timers'
+        (with 'mean_s' and 'fraction', the fraction of uptime spent, averaged
+        over processes), 'gauges' and 'gauges_max'.
+    """
+    now = time.time()
+    roles = {}
+    for snapshot in snapshots:
+        if stale_after is not None and now - snapshot['time'] > stale_after:
+            continue
+        role = roles.setdefault(
+            snapshot['role'], {
+                'processes': 0,
+                'uptime_s': 0.,
+                'counters': collections.defaultdict(float),
+                'rates': collections.defaultdict(float),
+                'timers': {},
+                'gauges': collections.defaultdict(list),
+            })
+        role['processes'] += 1
+        role['uptime_s'] += snapshot['uptime_s']
+        for key in ('counters', 'rates'):
+            for name, value in snapshot[key].items():
+                role[key][name] += value
+        for name, timer in snapshot['timers'].items():
+            merged = role['timers'].setdefault(name, {
+                'count': 0,
+                'total_s': 0.,
+                'max_s': 0.
+            })
+            merged['count'] += timer['count']
+            merged['total_s'] += timer['total_s']
+            merged['max_s'] = max(merged['max_s'], timer['max_s'])
+        for name, value in snapshot['gauges'].items():
+            role['gauges'][name].append(value)
+    for role in roles.values():
+        for timer in role['timers'].values():
+            timer['mean_s'] = (timer['total_s'] / timer['count']
+                               if timer['count'] else float('nan'))
+            timer['fraction'] = (timer['total_s'] / role['uptime_s']
+                                 if role['uptime_s'] else float('nan'))
+        gauges = role.pop('gauges')
+        role['gauges'] = {k: sum(v) / len(v) for k, v in gauges.items()}
+        role['gauges_max'] = {k: max(v) for k, v in gauges.items()}
+        role['counters'] = dict(role['counters'])
+        role['rates'] = dict(role['rates'])
+    return roles
+
+
+def tuning_hints(summary: dict, wait_threshold: float = 0.1) -> list[str]:
+    """Returns hints on num_actors and samples_per_insert from a summary."""
+    hints = []
+    replay = summary.get('replay', {}).get('rates', {})
+    num_actors = summary.get('actor', {}).get('processes', 0)
+    if replay.get('inserts'):
+        hints.append(f'Observed samples per insert: '
+                     f'{replay.get("samples", 0.) / replay["inserts"]:.1f}.')
+    learner = summary.get('learner', {}).get('timers', {})
+    wait = learner.get('dataset_wait', {}).get('total_s', 0.)
+    compute = learner.get('learner_compute', {}).get('total_s', 0.)
+    if wait + compute > 0 and wait / (wait + compute) > wait_threshold:
+        hints.append(
+            f'Learner waits on the dataset {wait / (wait + compute):.0%} of '
+            f'the time: if the replay rate limiter blocks samples '
+            f'(sample_wait_s rate {replay.get("sample_wait_s", 0.):.2f}), add '
+            f'actors or lower samples_per_insert; else raise '
+            f'num_parallel_calls or prefetch_size.')
+    insert_wait = replay.get('insert_wait_s', 0.) / max(num_actors, 1)
+    if insert_wait > wait_threshold:
+        hints.append(f'Actors wait on inserts {insert_wait:.0%} of the time: '
+                     f'remove actors or raise samples_per_insert.')
+    return hints
+
+
+def format_summary(summary: dict) -> str:
+    """Formats a summary as a table per role, followed by tuning hints."""
+    lines = []
+    for role_name, role in sorted(summary.items()):
+        lines.append(f'{role_name} ({role["processes"]} processes)')
+        for name, total in sorted(role['counters'].items()):
+            rate = role['rates'].get(name, float('nan'))
+            lines.append(f'  {name:<28} {total:14.1f} total '
+                         f'{rate:12.2f} /s')
+        for name, timer in sorted(role['timers'].items()):
+            lines.append(f'  {name:<28} {timer["count"]:14d} calls '
+                         f'mean {1e3 * timer["mean_s"]:9.2f} ms  '
+                         f'max {1e3 * timer["max_s"]:9.2f} ms  '
+                         f'{timer["fraction"]:6.1%} of time')
+        for name, value in sorted(role['gauges'].items()):
+            lines.append(f'  {name:<28} {value:14.2f} mean '
+                         f'{role["gauges_max"][name]:12.2f} max')
+    hints = tuning_hints(summary)
+    if hints:
+        lines.append('')
+        lines.extend(hints)
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Summarize exported training telemetry.')
+    parser.add_argument('directory', help='Telemetry export directory.')
+    parser.add_argument('--stale_after', type=float, default=600.,
+        help='Ignore processes not exported for this many seconds.')
+    parser.add_argument('--json', action='store_true',
+        help='Print the summary as JSON.')
+    args = parser.parse_args()
+    summary = summarize(load_snapshots(args.directory), args.stale_after)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(format_summary(summary))
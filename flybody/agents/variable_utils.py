@@ -0,0 +1,158 @@
+"""Variable client with background fetching and staleness metrics."""
+
+import threading
+import time
+from typing import Mapping, Sequence
+
+from acme import core
+import tensorflow as tf
+import tree
+
+
+class DoubleBufferedVariableClient():
+    """Variable client which fetches variables on a background thread.
+
+    Drop-in replacement for acme.tf.variable_utils.VariableClient. A fetch is
+    requested every update_period calls to `update`, and a background thread
+    fetches the variables from the source into a standby buffer. The next call
+    to `update` swaps the standby buffer in, i.e. copies it into the actor's
+    variables with one tf.function call between steps. The actor never waits
+    on the source, unless `update(wait=True)` or `update_and_wait` is called.
+
+    If the source has a `get_versioned_variables(names)` method returning
+    (version, variables), e.g. ObjectStoreVariableSource, fetches of an
+    unchanged version are not swapped in, and the version is reported as the
+    policy version. Staleness of the variables in use is available with
+    `metrics`.
+    """
+
+    def __init__(self,
+                 client: core.VariableSource,
+                 variables: Mapping[str, Sequence[tf.Variable]],
+                 update_period: int = 1):
+        """Initializes the client and starts the fetch thread.
+
+        Args:
+            client: Source of variables, e.g. the learner.
+            variables: Variables to update, keyed by names in the source.
+            update_period: Number of `update` calls between fetches.
+        """
+        self._client = client
+        self._keys = list(variables.keys())
+        self._variables = tree.flatten(list(variables.values()))
+        self._update_period = update_period
+        self._call_counter = 0
+        # Standby buffer and when it was fetched, guarded by the lock.
+        self._lock = threading.Lock()
+        self._standby = None
+        self._fetch_requested = threading.Event()
+        self._fetch_duration = float('nan')
+        self._fetch_error = None
+        # Version and fetch time of the variables in use, -1 before the first
+        # swap. Source versions are non-negative.
+        self._version = -1
+        self._num_swaps = 0
+        self._fetch_time = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._fetch_loop, daemon=True)
+        self._thread.start()
+
+    def _fetch(self) -> tuple:
+        """Returns version (None if unversioned), variables and fetch time."""
+        start = time.time()
+        if hasattr(self._client, 'get_versioned_variables'):
+            version, variables = self._client.get_versioned_variables(
+                self._keys)
+        else:
+            version, variables = None, self._client.get_variables(self._keys)
+        variables = tree.flatten(variables)
+        if len(variables) != len(self._variables):
+            raise ValueError('Length mismatch between old variables and new.')
+        end = time.time()
+        self._fetch_duration = end - start
+        return version, variables, end
+
+    def _fetch_loop(self):
+        while not self._closed:
+            self._fetch_requested.wait()
+            if self._closed:
+                return
+            # Cleared before fetching, so a `close` during the fetch is seen.
+            self._fetch_requested.clear()
+            try:
+                standby = self._fetch()
+            except Exception as e:  # Re-raised in `update`.
+                self._fetch_error = e
+            else:
+                with self._lock:
+                    self._standby = standby
+
+    @tf.function
+    def _assign(self, values):
+        for variable, value in zip(self._variables, values):
+            variable.assign(value)
+
+    def _swap(self, version, values, fetch_time: float):
+        if version is not None and version < self._version:
+            # Older than the variables in use, e.g. fetched in the background
+            # before `update_and_wait` fetched a newer version.
+            return
+        self._fetch_time = fetch_time
+        if version is not None and version == self._version:
+            return  # Variables in use are up to date.
+        self._assign(values)
+        self._num_swaps += 1
+        self._version = self._num_swaps if version is None else version
+
+    def update(self, wait: bool = False):
+        """Swaps in fetched variables if any, periodically requests a fetch.
+
+        Args:
+            wait: If True, fetches and copies variables right away, blocking.
+        """
+        if wait:
+            self.update_and_wait()
+            return
+        if self._fetch_error is not None:
+            error, self._fetch_error = self._fetch_error, None
+            raise error
+        with self._lock:
+            standby, self._standby = self._standby, None
+        if standby is not None:
+            self._swap(*standby)
+        self._call_counter += 1
+        if (self._call_counter >= self._update_period
+                and not self._fetch_requested.is_set()):
+            self._call_counter = 0
+            self._fetch_requested.set()
+
+    def update_and_wait(self):
+        """Fetches and copies variables, blocking until done."""
+        self._call_counter = 0
+        with self._lock:
+            self._standby = None  # Would be older than this fetch.
+        self._swap(*self._fetch())
+
+    def metrics(self) -> dict:
+        """Returns staleness metrics of the variables in use.
+
+        Returns:
+            Dict with 'policy_version' (source version, or number of swaps
+            for unversioned sources, -1 before the first), 'policy_age_s' (time since the
+            variables in use were last fetched or confirmed up to date, NaN
+            before the first fetch) and 'policy_fetch_s' (duration of the
+            last fetch).
+        """
+        age = (time.time() - self._fetch_time
+               if self._fetch_time is not None else float('nan'))
+        return {
+            'policy_version': self._version,
+            'policy_age_s': age,
+            'policy_fetch_s': self._fetch_duration,
+        }
+
+    def close(self):
+        """Stops the fetch thread."""
+        self._closed = True
+        self._fetch_requested.set()
+        self._thread.join()
@@ -5,7 +5,6 @@ from typing import Callable, Sequence
 import numpy as np
 
 from dm_control import mujoco
-from dm_control import composer
 from dm_control.locomotion.arenas import floors
 
 from flybody.fruitfly import fruitfly
@@ -15,6 +14,9 @@ from flybody.tasks.walk_imitation import WalkImitation
 from flybody.tasks.walk_on_ball import WalkOnBall
 from flybody.tasks.vision_flight import VisionFlightImitationWBPG
 from flybody.tasks.template_task import TemplateTask
+from flybody.tasks.multi_fly import MultiFlyTemplateTask
+from flybody.tasks import model_cache
+from flybody.tasks.state_pool import StatePool
 
 from flybody.tasks.arenas.ball import BallFloor
 from flybody.tasks.arenas.hills import SineBumps, SineTrench
@@ -36,7 +38,8 @@ def flight_imitation(ref_path: str | None = None,
                      joint_filter: float = 0.,
                      future_steps: int = 5,
                      random_state: np.random.RandomState | None = None,
-                     terminal_com_dist: float = 2.0):
+                     terminal_com_dist: float = 2.0,
+                     model_variant: str = 'default'):
     """Requires a fruitfly to track a flying reference.
   
     Args:
@@ -60,6 +63,8 @@ def flight_imitation(ref_path: str | None = None,
         random_state: Random state for reproducibility.
         terminal_com_dist: Episode will be terminated when distance from model
             CoM to ghost CoM exceeds terminal_com_dist. Can be float('inf').
+        model_variant: Fruitfly model variant, 'default' or 'fast'. The 'fast'
+            variant has simplified collision geoms and more contact exclusions.
 
     Returns:
         Environment for flight tracking task.
@@ -89,12 +94,15 @@ def flight_imitation(ref_path: str | None = None,
                                disable_legs=disable_legs,
                                time_limit=time_limit,
                                joint_filter=joint_filter,
-                               future_steps=future_steps)
+                               future_steps=future_steps,
+                               walker_xml_path=fruitfly.get_xml_path(
+                                   model_variant))
 
-    return composer.Environment(time_limit=time_limit,
-                                task=task,
-                                random_state=random_state,
-                                strip_singleton_obs_buffer_dim=True)
+    return model_cache.Environment(time_limit=time_limit,
+                                   task=task,
+                                   random_state=random_state,
+                                   strip_singleton_obs_buffer_dim=True,
+                                   recompile_mjcf_every_episode=False)
 
 
 def walk_imitation(ref_path: str | None = None,
@@ -103,7 +111,8 @@ def walk_imitation(ref_path: str | None = None,
                    traj_indices: Sequence[int] | None = None,
                    random_state: np.random.RandomState | None = None,
                    terminal_com_dist: float = 0.3,
-                   joint_filter: float = 0.01):
+                   joint_filter: float = 0.01,
+                   model_variant: str = 'default'):
     """Requires a fruitfly to track a reference walking fly.
 
     Args:
@@ -119,6 +128,8 @@ def walk_imitation(ref_path: str | None = None,
         terminal_com_dist: Episode will be terminated when distance from model
             CoM to ghost CoM exceeds terminal_com_dist. Can be float('inf').
         joint_filter: Timescale of filter for joint actuators. 0: disabled.
+        model_variant: Fruitfly model variant, 'default' or 'fast'. The 'fast'
+            variant has simplified collision geoms and more contact exclusions.
 
     Returns:
         Environment for walking tracking task.
@@ -147,17 +158,21 @@ def walk_imitation(ref_path: str | None = None,
                          disable_wings=disable_wings,
                          joint_filter=joint_filter,
                          future_steps=64,
-                         time_limit=time_limit)
+                         time_limit=time_limit,
+                         walker_xml_path=fruitfly.get_xml_path(model_variant))
 
-    return composer.Environment(time_limit=time_limit,
-                                task=task,
-                                random_state=random_state,
-                                strip_singleton_obs_buffer_dim=True)
+    return model_cache.Environment(time_limit=time_limit,
+                                   task=task,
+                                   random_state=random_state,
+                                   strip_singleton_obs_buffer_dim=True,
+                                   recompile_mjcf_every_episode=False)
 
 
 def walk_on_ball(force_actuators: bool = False,
                  disable_wings: bool = True,
-                 random_state: np.random.RandomState | None = None):
+                 random_state: np.random.RandomState | None = None,
+                 state_pool: StatePool | str | None = None,
+                 model_variant: str = 'default'):
     """Requires a tethered fruitfly to walk on a floating ball.
 
     Args:
@@ -165,6 +180,10 @@ def walk_on_ball(force_actuators: bool = False,
         disable_wings: Whether to retract and disable wings. This includes
             removing wing DoFs, actuators, and sensors.
         random_state: Random state for reproducibility.
+        state_pool: Optional StatePool, or path to a saved one, to reset
+            episodes from pre-simulated initial states.
+        model_variant: Fruitfly model variant, 'default' or 'fast'. The 'fast'
+            variant has simplified collision geoms and more contact exclusions.
 
     Returns:
         Environment for fly walking on ball.
@@ -183,12 +202,17 @@ def walk_on_ball(force_actuators: bool = False,
                       disable_wings=disable_wings,
                       joint_filter=0.01,
                       adhesion_filter=0.007,
-                      time_limit=time_limit)
+                      time_limit=time_limit,
+                      walker_xml_path=fruitfly.get_xml_path(model_variant))
+    if isinstance(state_pool, str):
+        state_pool = StatePool.load(state_pool)
+    task.set_state_pool(state_pool)
 
-    return composer.Environment(time_limit=time_limit,
-                                task=task,
-                                random_state=random_state,
-                                strip_singleton_obs_buffer_dim=True)
+    return model_cache.Environment(time_limit=time_limit,
+                                   task=task,
+                                   random_state=random_state,
+                                   strip_singleton_obs_buffer_dim=True,
+                                   recompile_mjcf_every_episode=False)
 
 
 def vision_guided_flight(wpg_pattern_path: str | None = None,
@@ -197,6 +221,8 @@ def vision_guided_flight(wpg_pattern_path: str | None = None,
                          disable_legs: bool = True,
                          random_state: np.random.RandomState | None = None,
                          joint_filter: float = 0.,
+                         model_variant: str = 'default',
+                         eye_raycast: str | None = None,
                          **kwargs_arena):
     """Vision-guided flight tasks: 'bumps' and 'trench'.
 
@@ -211,6 +237,11 @@ def vision_guided_flight(wpg_pattern_path: str | None = None,
             removing leg DoFs, actuators, and sensors.
         random_state: Random state for reproducibility.
         joint_filter: Timescale of filter for joint actuators. 0: disabled.
+        model_variant: Fruitfly model variant, 'default' or 'fast'. The 'fast'
+            variant has simplified collision geoms and more contact exclusions.
+        eye_raycast: If given, compute eye observables by CPU ray casting
+            instead of OpenGL rendering, so no GL context is needed. One of
+            'intensity', 'depth', 'geom_id'. None: use eye cameras.
         kwargs_arena: kwargs to be passed on to arena.
 
     Returns:
@@ -238,12 +269,16 @@ def vision_guided_flight(wpg_pattern_path: str | None = None,
                                      disable_legs=disable_legs,
                                      joint_filter=joint_filter,
                                      floor_contacts=True,
-                                     floor_contacts_fatal=True)
+                                     floor_contacts_fatal=True,
+                                     eye_raycast=eye_raycast,
+                                     walker_xml_path=fruitfly.get_xml_path(
+                                         model_variant))
 
-    return composer.Environment(time_limit=time_limit,
-                                task=task,
-                                random_state=random_state,
-                                strip_singleton_obs_buffer_dim=True)
+    return model_cache.Environment(time_limit=time_limit,
+                                   task=task,
+                                   random_state=random_state,
+                                   strip_singleton_obs_buffer_dim=True,
+                                   recompile_mjcf_every_episode=False)
 
 
 def template_task(random_state: np.random.RandomState | None = None,
@@ -254,7 +289,9 @@ def template_task(random_state: np.random.RandomState | None = None,
                   time_limit: float = 1.,
                   mjcb_control: Callable | None = None,
                   observables_options: dict | None = None,
-                  action_corruptor: Callable | None = None):
+                  action_corruptor: Callable | None = None,
+                  state_pool: StatePool | str | None = None,
+                  model_variant: str = 'default'):
     """An empty no-op walking task for testing.
 
     Args:
@@ -274,6 +311,10 @@ def template_task(random_state: np.random.RandomState | None = None,
         action_corruptor (optional): A callable which takes an action as an
             argument, modifies it, and returns it. An example use case for
             this is to add random noise to the action.
+        state_pool: Optional StatePool, or path to a saved one, to reset
+            episodes from pre-simulated initial states.
+        model_variant: Fruitfly model variant, 'default' or 'fast'. The 'fast'
+            variant has simplified collision geoms and more contact exclusions.
 
     Returns:
         Template walking environment.
@@ -291,10 +332,68 @@ def template_task(random_state: np.random.RandomState | None = None,
                         observables_options=observables_options,
                         mjcb_control=mjcb_control,
                         action_corruptor=action_corruptor,
-                        time_limit=time_limit)
+                        time_limit=time_limit,
+                        walker_xml_path=fruitfly.get_xml_path(model_variant))
+    if isinstance(state_pool, str):
+        state_pool = StatePool.load(state_pool)
+    task.set_state_pool(state_pool)
     # Reset control callback, if any.
     mujoco.set_mjcb_control(None)
-    return composer.Environment(time_limit=time_limit,
-                                task=task,
-                                random_state=random_state,
-                                strip_singleton_obs_buffer_dim=True)
+    return model_cache.Environment(time_limit=time_limit,
+                                   task=task,
+                                   random_state=random_state,
+                                   strip_singleton_obs_buffer_dim=True,
+                                   recompile_mjcf_every_episode=False)
+
+
+def multi_fly_template_task(num_flies: int = 4,
+                            spacing: float = 1.,
+                            random_state: np.random.RandomState | None = None,
+                            force_actuators: bool = False,
+                            disable_wings: bool = True,
+                            joint_filter: float = 0.01,
+                            adhesion_filter: float = 0.007,
+                            time_limit: float = 1.,
+                            model_variant: str = 'default'):
+    """An empty no-op walking task with multiple flies in one MuJoCo model.
+
+    Actions, rewards and discounts are batched, with leading dimension
+    num_flies. Observations of fly k are prefixed with its walker name, and
+    can be stacked with `env.task.batch_observation(timestep.observation)`.
+
+    Args:
+        num_flies: Number of independent flies, up to 31.
+        spacing: Distance between flies in the xy-grid.
+        random_state: Random state for reproducibility.
+        force_actuators: Whether to use force or position actuators.
+        disable_wings: Whether to retract and disable wings. This includes
+            removing wing DoFs, actuators, and sensors.
+        joint_filter: Timescale of filter for joint actuators. 0: disabled.
+        adhesion_filter: Timescale of filter for adhesion actuators. 0: disabled.
+        time_limit: Episode time limit.
+        model_variant: Fruitfly model variant, 'default' or 'fast'. The 'fast'
+            variant has simplified collision geoms and more contact exclusions.
+
+    Returns:
+        Template walking environment with multiple flies.
+    """
+    # Build a fruitfly walker and arena.
+    walker = fruitfly.FruitFly
+    arena = floors.Floor()
+    # Build a no-op task.
+    task = MultiFlyTemplateTask(walker=walker,
+                                arena=arena,
+                                num_flies=num_flies,
+                                spacing=spacing,
+                                force_actuators=force_actuators,
+                                disable_wings=disable_wings,
+                                joint_filter=joint_filter,
+                                adhesion_filter=adhesion_filter,
+                                time_limit=time_limit,
+                                walker_xml_path=fruitfly.get_xml_path(
+                                    model_variant))
+    return model_cache.Environment(time_limit=time_limit,
+                                   task=task,
+                                   random_state=random_state,
+                                   strip_singleton_obs_buffer_dim=True,
+                                   recompile_mjcf_every_episode=False)
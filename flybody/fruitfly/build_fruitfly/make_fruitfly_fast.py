@@ -0,0 +1,247 @@
+"""Make fast fruitfly model variant with simplified collisions.
+
+The fast variant is generated from the final fruitfly.xml (see make_fruitfly.py)
+and differs from it only in collision detection:
+  1. Collision ellipsoids with nearly round cross-sections are replaced with
+     capsules or spheres, which have analytic collision functions.
+  2. A <contact><exclude> list is added for body pairs that often come close
+     enough to reach narrowphase collision, but never come in contact, as
+     estimated by sampling random joint configurations within joint ranges.
+Visual geoms, bodies, joints, actuators and sensors are unchanged.
+"""
+
+import collections
+import itertools
+import os
+import time
+from typing import Sequence
+
+from absl import app
+
+from dm_control import mjcf
+from dm_control.mujoco.wrapper.mjbindings import enums
+from dm_control.mujoco.wrapper.mjbindings import mjlib
+from lxml import etree
+import numpy as np
+
+ASSET_DIR = os.path.join(os.path.dirname(__file__), '../assets/')
+BASE_MODEL = 'fruitfly.xml'
+FINAL_MODEL = 'fruitfly_fast.xml'  # Output file of this script.
+
+# Ellipsoids with ratio of two smaller semi-axes below this are made capsules.
+_MAX_CROSS_SECTION_RATIO = 2.
+# Number of random joint configurations for finding non-contacting body pairs.
+_NUM_SAMPLES = 20000
+# Extra geom margin during sampling, for conservative contact exclusion.
+_SAMPLING_MARGIN = 0.005
+# Exclude only pairs reaching narrowphase in at least this fraction of samples.
+# MuJoCo checks the exclude list for every pair passing broadphase, so rarely
+# close pairs cost more to exclude than to collide.
+_MIN_NEAR_FRACTION = 0.05
+# Number of steps for timing report.
+_NUM_TIMING_STEPS = 2000
+
+
+def mul_quat(quat_a, quat_b):
+    """Returns quat_a * quat_b."""
+    quat_c = np.zeros(4)
+    mjlib.mju_mulQuat(quat_c, quat_a, quat_b)
+    return quat_c
+
+
+def fmt(values):
+    """Format array for XML, same precision as make_fruitfly.py."""
+    return ' '.join(f'{v:.3g}' for v in values)
+
+
+def simplify_collision_geoms(root, physics):
+    """Replace round collision ellipsoids with capsules or spheres."""
+    model = physics.model
+    # Quaternions rotating the z-axis (capsule axis) to the x-, y-, z-axis.
+    s = np.sqrt(0.5)
+    z_to_axis = [np.array([s, 0, s, 0]),
+                 np.array([s, -s, 0, 0]),
+                 np.array([1., 0, 0, 0])]
+    for geom in root.iter('geom'):
+        if geom.get('type') != 'ellipsoid' or 'collision' not in (
+                geom.get('name') or ''):
+            continue
+        geom_id = model.name2id(geom.get('name'), 'geom')
+        semi_axes = model.geom_size[geom_id]
+        order = np.argsort(semi_axes)
+        small, mid, large = semi_axes[order]
+        if mid / small > _MAX_CROSS_SECTION_RATIO:
+            continue
+        radius = np.sqrt(small * mid)
+        half_length = large - radius
+        quat = mul_quat(model.geom_quat[geom_id], z_to_axis[order[2]])
+        for attr in ['euler', 'quat', 'size']:
+            if attr in geom.attrib:
+                del geom.attrib[attr]
+        if half_length > 0:
+            geom.set('type', 'capsule')
+            geom.set('size', fmt([radius, half_length]))
+            geom.set('quat', fmt(quat))
+        else:
+            geom.set('type', 'sphere')
+            geom.set('size', fmt([radius]))
+        geom.set('pos', fmt(model.geom_pos[geom_id]))
+        print(f'  {geom.get("name")}: ellipsoid -> {geom.get("type")}')
+
+
+def find_non_contacting_pairs(physics, rng):
+    """Body pairs with collision geoms that never contact in random poses."""
+    model, data = physics.model, physics.data
+    colliding = (model.geom_contype != 0) | (model.geom_conaffinity != 0)
+    col_bodies = sorted(set(model.geom_bodyid[colliding]) - {0})
+    weld = model.body_weldid
+    parent_weld = weld[model.body_parentid[weld]]
+    # Pairs already excluded in the model.
+    excluded = set()
+    for signature in model.exclude_signature:
+        b1, b2 = signature >> 16, signature & 0xFFFF
+        excluded.add((min(b1, b2), max(b1, b2)))
+    candidates = set()
+    for b1, b2 in itertools.combinations(col_bodies, 2):
+        if weld[b1] == weld[b2]:
+            continue
+        # Parent-child contacts are filtered by MuJoCo anyway.
+        if parent_weld[b1] == weld[b2] or parent_weld[b2] == weld[b1]:
+            continue
+        if (b1, b2) in excluded:
+            continue
+        candidates.add((b1, b2))
+    # Sample hinge joint configurations uniformly within joint ranges.
+    hinges = np.nonzero(model.jnt_type == enums.mjtJoint.mjJNT_HINGE)[0]
+    qpos_adr = model.jnt_qposadr[hinges]
+    low, high = model.jnt_range[hinges].T
+    # Geom pairs of candidate body pairs, for bounding sphere overlap tests.
+    geom_ids = np.nonzero(colliding)[0]
+    geom_pairs = np.array([
+        (g1, g2) for g1, g2 in itertools.combinations(geom_ids, 2)
+        if (min(model.geom_bodyid[g1], model.geom_bodyid[g2]),
+            max(model.geom_bodyid[g1], model.geom_bodyid[g2])) in candidates
+    ])
+    rbound = model.geom_rbound + model.geom_margin + _SAMPLING_MARGIN
+    rbound_sum = rbound[geom_pairs[:, 0]] + rbound[geom_pairs[:, 1]]
+    model.geom_margin[:] += _SAMPLING_MARGIN
+    observed = set()
+    near = collections.Counter()
+    for _ in range(_NUM_SAMPLES):
+        data.qpos[qpos_adr] = rng.uniform(low, high)
+        mjlib.mj_kinematics(model.ptr, data.ptr)
+        mjlib.mj_collision(model.ptr, data.ptr)
+        for con in data.contact[:data.ncon]:
+            b1 = model.geom_bodyid[con.geom1]
+            b2 = model.geom_bodyid[con.geom2]
+            observed.add((min(b1, b2), max(b1, b2)))
+        # Pairs which pass the bounding sphere test and reach narrowphase.
+        dist = np.linalg.norm(data.geom_xpos[geom_pairs[:, 0]] -
+                              data.geom_xpos[geom_pairs[:, 1]], axis=1)
+        near_pairs = set()
+        for g1, g2 in geom_pairs[dist < rbound_sum]:
+            b1, b2 = sorted((model.geom_bodyid[g1], model.geom_bodyid[g2]))
+            near_pairs.add((b1, b2))
+        near.update(near_pairs)
+    model.geom_margin[:] -= _SAMPLING_MARGIN
+    frequently_near = {
+        pair for pair, count in near.items()
+        if count >= _MIN_NEAR_FRACTION * _NUM_SAMPLES
+    }
+    pairs = (candidates & frequently_near) - observed
+    # Keep the exclude list left-right symmetric.
+    def mirror(body_id):
+        name = model.id2name(body_id, 'body')
+        name = name.replace('left', 'tmp').replace('right', 'left')
+        return model.name2id(name.replace('tmp', 'right'), 'body')
+    for b1, b2 in list(pairs):
+        b1, b2 = sorted((mirror(b1), mirror(b2)))
+        if (b1, b2) in candidates - observed:
+            pairs.add((b1, b2))
+    return [(model.id2name(b1, 'body'), model.id2name(b2, 'body'))
+            for b1, b2 in sorted(pairs)]
+
+
+def time_collisions(xml_path, rng):
+    """Returns collision detection time and steps per second for a model."""
+    physics = mjcf.Physics.from_mjcf_model(mjcf.from_path(xml_path))
+    model, data = physics.model, physics.data
+    hinges = np.nonzero(model.jnt_type == enums.mjtJoint.mjJNT_HINGE)[0]
+    qpos_adr = model.jnt_qposadr[hinges]
+    low, high = model.jnt_range[hinges].T
+    # Collision detection time, averaged over random poses.
+    poses = rng.uniform(low, high, size=(_NUM_TIMING_STEPS, len(hinges)))
+    elapsed = 0.
+    for pose in poses:
+        data.qpos[qpos_adr] = pose
+        mjlib.mj_kinematics(model.ptr, data.ptr)
+        start = time.perf_counter()
+        mjlib.mj_collision(model.ptr, data.ptr)
+        elapsed += time.perf_counter() - start
+    collision_us = 1e6 * elapsed / _NUM_TIMING_STEPS
+    # Steps per second, from default pose.
+    physics.reset()
+    start = time.perf_counter()
+    for _ in range(_NUM_TIMING_STEPS):
+        physics.step()
+    sps = _NUM_TIMING_STEPS / (time.perf_counter() - start)
+    return collision_us, sps
+
+
+def main(argv: Sequence[str]):
+    if len(argv) > 1:
+        raise app.UsageError('Too many command-line arguments.')
+    rng = np.random.RandomState(0)
+
+    print(f'Load {BASE_MODEL}.')
+    base_path = os.path.join(ASSET_DIR, BASE_MODEL)
+    with open(base_path, 'r') as f:
+        root = etree.XML(f.read(), etree.XMLParser(remove_blank_text=True))
+    physics = mjcf.Physics.from_mjcf_model(mjcf.from_path(base_path))
+
+    print('Simplify collision geoms.')
+    simplify_collision_geoms(root, physics)
+
+    print(f'Find non-contacting body pairs in {_NUM_SAMPLES} random poses.')
+    physics = mjcf.Physics.from_mjcf_model(
+        mjcf.from_xml_string(etree.tostring(root), model_dir=ASSET_DIR))
+    pairs = find_non_contacting_pairs(physics, rng)
+    print(f'  Excluding {len(pairs)} body pairs.')
+    contact = root.find('contact')
+    for body1, body2 in pairs:
+        etree.SubElement(contact,
+                         'exclude',
+                         name=f'{body1}_{body2}',
+                         body1=body1,
+                         body2=body2)
+
+    print('Get string from lxml.')
+    xml_string = etree.tostring(root, pretty_print=True)
+
+    print('Insert spaces between top level elements.')
+    lines = xml_string.splitlines()
+    newlines = []
+    for line in lines:
+        newlines.append(line)
+        if line.startswith(b'  <'):
+            if line.startswith(b'  </') or line.endswith(b'/>'):
+                newlines.append(b'')
+    newlines.append(b'')
+    xml_string = b'\n'.join(newlines)
+
+    final_path = os.path.join(ASSET_DIR, FINAL_MODEL)
+    print(f'Save {FINAL_MODEL} to file.')
+    with open(final_path, 'wb') as f:
+        f.write(xml_string)
+
+    print('Timing report:')
+    for xml_path in [base_path, final_path]:
+        collision_us, sps = time_collisions(xml_path, rng)
+        print(f'  {os.path.basename(xml_path)}: '
+              f'collision {collision_us:.1f} us, {sps:.0f} steps/s')
+
+    print('Done.')
+
+
+if __name__ == '__main__':
+    app.run(main)
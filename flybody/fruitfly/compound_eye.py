@@ -0,0 +1,135 @@
+"""CPU ray-cast compound eye, an alternative to OpenGL eye cameras."""
+# ruff: noqa: F821
+
+from dm_control.mujoco.wrapper.mjbindings import mjlib
+import numpy as np
+
+OUTPUTS = ('intensity', 'depth', 'geom_id')
+PROJECTIONS = ('pinhole', 'equiangular')
+# Geom groups visible to the eye, same as in the eye camera observables.
+_GEOMGROUP = np.array([1, 1, 1, 0, 0, 0], dtype=np.uint8)
+
+
+def ommatidia_directions(fovy: float,
+                         size: int,
+                         projection: str = 'pinhole') -> np.ndarray:
+    """Returns unit ray directions in camera frame, shape (size, size, 3).
+
+    Directions are ordered as pixels in rendered images: row 0 is the top of
+    the image, column 0 is the left. MuJoCo cameras look along -z with y up.
+
+    Args:
+        fovy: Field of view, degrees. Same horizontally and vertically.
+        size: Number of ommatidia (pixels) along each image dimension.
+        projection: 'pinhole' for the same pixel grid as an eye camera with
+            the same fovy, 'equiangular' for ommatidia equally spaced in
+            azimuth and elevation, closer to a real compound eye.
+
+    Returns:
+        Ray directions, shape (size, size, 3).
+    """
+    half_fov = np.deg2rad(fovy) / 2
+    # Pixel centers in [-1, 1], top to bottom and left to right.
+    grid = 1 - (2 * np.arange(size) + 1) / size
+    rows, cols = np.meshgrid(grid, -grid, indexing='ij')
+    if projection == 'pinhole':
+        scale = np.tan(half_fov)
+        directions = np.stack(
+            [cols * scale, rows * scale, -np.ones_like(rows)], axis=-1)
+    elif projection == 'equiangular':
+        elevation, azimuth = rows * half_fov, cols * half_fov
+        directions = np.stack([
+            np.cos(elevation) * np.sin(azimuth),
+            np.sin(elevation),
+            -np.cos(elevation) * np.cos(azimuth),
+        ], axis=-1)
+    else:
+        raise ValueError(
+            f'projection should be one of {PROJECTIONS}, got {projection}.')
+    return directions / np.linalg.norm(directions, axis=-1, keepdims=True)
+
+
+class RayCastEye():
+    """Eye images computed by casting one ray per ommatidium with mj_multiRay.
+
+    Can be used as the callable of an `observable.Generic`. No OpenGL context
+    is needed, so actors can run headless on CPU-only machines. The eye sees
+    geoms in groups 0-2, except the ones of the body the camera is attached
+    to, e.g. the fly's head.
+
+    Outputs have the same shape as the corresponding camera observables:
+      'intensity': (size, size, 3) uint8 RGB image. Geom colors are shaded
+          with the model's headlight only; textures, other lights and the
+          skybox are not rendered, misses are black.
+      'depth': (size, size) float32 depth along the camera axis, as in depth
+          camera images. Misses are at the far clipping distance.
+      'geom_id': (size, size) int32 geom IDs, -1 for misses.
+    """
+
+    def __init__(self,
+                 camera: 'mjcf.Element',
+                 size: int,
+                 output: str = 'intensity',
+                 projection: str = 'pinhole'):
+        """Initializes the eye.
+
+        Args:
+            camera: MJCF camera defining the eye position, orientation and
+                field of view.
+            size: Number of ommatidia (pixels) along each image dimension.
+            output: One of 'intensity', 'depth', 'geom_id'.
+            projection: 'pinhole' or 'equiangular', see ommatidia_directions.
+        """
+        if output not in OUTPUTS:
+            raise ValueError(
+                f'output should be one of {OUTPUTS}, got {output}.')
+        if projection not in PROJECTIONS:
+            raise ValueError(
+                f'projection should be one of {PROJECTIONS}, got {projection}.')
+        self._camera = camera
+        self._size = size
+        self._output = output
+        self._projection = projection
+        # Ray directions are recomputed only if camera fovy changes.
+        self._fovy = None
+        self._directions = None
+        nray = size * size
+        self._geom_id = np.zeros(nray, dtype=np.int32)
+        self._dist = np.zeros(nray)
+        self._normal = np.zeros(3 * nray) if output == 'intensity' else None
+
+    def __call__(self, physics: 'mjcf.Physics') -> np.ndarray:
+        camera = physics.bind(self._camera)
+        fovy = float(camera.fovy)
+        if fovy != self._fovy:
+            self._fovy = fovy
+            self._directions = ommatidia_directions(
+                fovy, self._size, self._projection).reshape(-1, 3)
+        # Rotate ray directions to world frame.
+        xmat = camera.xmat.reshape(3, 3)
+        vec = self._directions @ xmat.T
+        model, data = physics.model, physics.data
+        far = model.vis.map.zfar * model.stat.extent
+        mjlib.mj_multiRay(model.ptr, data.ptr, camera.xpos, vec.ravel(),
+                          _GEOMGROUP, 1, camera.bodyid, self._geom_id,
+                          self._dist, self._normal, len(vec), far)
+        hit = self._geom_id >= 0
+        shape = (self._size, self._size)
+        if self._output == 'geom_id':
+            return self._geom_id.reshape(shape).copy()
+        if self._output == 'depth':
+            depth = np.where(hit, self._dist * -self._directions[:, 2], far)
+            return depth.reshape(shape).astype(np.float32)
+        # Shaded intensity, as lit by the headlight at the camera.
+        geom_id = self._geom_id[hit]
+        rgb = model.geom_rgba[geom_id, :3]
+        mat_id = model.geom_matid[geom_id]
+        has_mat = mat_id >= 0
+        rgb[has_mat] = model.mat_rgba[mat_id[has_mat], :3]
+        normal = self._normal.reshape(-1, 3)[hit]
+        cos = np.abs(np.sum(normal * vec[hit], axis=1, keepdims=True))
+        headlight = model.vis.headlight
+        light = headlight.ambient + headlight.diffuse * cos
+        image = np.zeros((len(vec), 3))
+        image[hit] = np.clip(rgb * light, 0, 1)
+        return (255 * image).astype(np.uint8).reshape(shape + (3, ))
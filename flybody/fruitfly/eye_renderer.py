@@ -0,0 +1,122 @@
+"""Single-pass rendering of several eye cameras with a persistent scene."""
+# ruff: noqa: F821
+
+from typing import Sequence
+
+from dm_control.mujoco import wrapper as mj_wrapper
+from dm_control.mujoco.wrapper.mjbindings import enums
+from dm_control.mujoco.wrapper.mjbindings import mjlib
+import numpy as np
+
+
+class StereoEyeRenderer():
+    """Renders eye cameras side by side into one offscreen framebuffer.
+
+    Separate `physics.render` calls allocate and update a new scene for each
+    eye. Here the scene is allocated once per physics and updated once per
+    frame; between eyes only the camera and headlight are updated. The eyes
+    are rendered into adjacent viewports and read back with a single
+    mjr_readPixels into a preallocated buffer.
+
+    A new frame is rendered when an eye image is requested at a new physics
+    time, or when the same eye is requested twice at the same time. Thus the
+    eyes evaluated in one observation update share a frame.
+    """
+
+    def __init__(self,
+                 cameras: Sequence['mjcf.Element'],
+                 size: int,
+                 scene_option: mj_wrapper.MjvOption | None = None,
+                 max_geom: int = 1000):
+        """Initializes the renderer.
+
+        Args:
+            cameras: MJCF cameras, e.g. the left and right eye cameras.
+            size: Height and width of each eye image, pixels.
+            scene_option: Optional visualization options for all eyes.
+            max_geom: Maximum number of geoms in the scene.
+        """
+        self._cameras = list(cameras)
+        self._size = size
+        self._scene_option = scene_option or mj_wrapper.MjvOption()
+        self._max_geom = max_geom
+        num_eyes = len(self._cameras)
+        self._rgb_buffer = np.empty((size, num_eyes * size, 3), dtype=np.uint8)
+        self._images = np.empty((num_eyes, size, size, 3), dtype=np.uint8)
+        self._rects = [
+            mjlib.MjrRect(k * size, 0, size, size) for k in range(num_eyes)
+        ]
+        self._full_rect = mjlib.MjrRect(0, 0, num_eyes * size, size)
+        # Per-physics state, set up on first render.
+        self._physics = None
+        self._scene = None
+        self._perturb = None
+        self._mjv_cameras = None
+        # Time of the last frame and which eyes have been served from it.
+        self._time = None
+        self._served = np.zeros(num_eyes, dtype=bool)
+
+    def _setup(self, physics: 'mjcf.Physics'):
+        buffer_width = physics.model.vis.global_.offwidth
+        buffer_height = physics.model.vis.global_.offheight
+        if (self._full_rect.width > buffer_width
+                or self._size > buffer_height):
+            raise ValueError(
+                f'Eye images ({self._full_rect.width}x{self._size}) exceed '
+                f'the offscreen framebuffer ({buffer_width}x{buffer_height}), '
+                'increase <visual><global offwidth offheight/> in the model.')
+        self._scene = mj_wrapper.MjvScene(model=physics.model,
+                                          max_geom=self._max_geom)
+        self._perturb = mj_wrapper.MjvPerturb()
+        self._mjv_cameras = []
+        for camera in self._cameras:
+            mjv_camera = mj_wrapper.MjvCamera()
+            mjv_camera.type = enums.mjtCamera.mjCAMERA_FIXED
+            mjv_camera.fixedcamid = physics.bind(camera).element_id
+            self._mjv_cameras.append(mjv_camera)
+        with physics.contexts.gl.make_current() as ctx:
+            ctx.call(mjlib.mjr_setBuffer, enums.mjtFramebuffer.mjFB_OFFSCREEN,
+                     physics.contexts.mujoco.ptr)
+        self._physics = physics
+
+    def _render_on_gl_thread(self, physics: 'mjcf.Physics'):
+        model, data = physics.model, physics.data
+        context = physics.contexts.mujoco.ptr
+        for k, (mjv_camera, rect) in enumerate(
+                zip(self._mjv_cameras, self._rects)):
+            if k > 0:
+                # Same geoms, only move the camera and its headlight.
+                mjlib.mjv_updateCamera(model.ptr, data.ptr, mjv_camera.ptr,
+                                       self._scene.ptr)
+                mjlib.mjv_makeLights(model.ptr, data.ptr, self._scene.ptr)
+            mjlib.mjr_render(rect, self._scene.ptr, context)
+        mjlib.mjr_readPixels(self._rgb_buffer, None, self._full_rect, context)
+
+    def render(self, physics: 'mjcf.Physics') -> np.ndarray:
+        """Renders all eyes, returns images of shape (num_eyes, size, size, 3).
+
+        The returned array is reused by the next render.
+        """
+        if physics is not self._physics:
+            self._setup(physics)
+        mjlib.mjv_updateScene(physics.model.ptr, physics.data.ptr,
+                              self._scene_option.ptr, self._perturb.ptr,
+                              self._mjv_cameras[0].ptr,
+                              enums.mjtCatBit.mjCAT_ALL, self._scene.ptr)
+        with physics.contexts.gl.make_current() as ctx:
+            ctx.call(self._render_on_gl_thread, physics)
+        # Flip rows to image order and split the framebuffer into eyes.
+        image = np.flipud(self._rgb_buffer)
+        for k in range(len(self._cameras)):
+            self._images[k] = image[:, k * self._size:(k + 1) * self._size]
+        self._time = physics.data.time
+        self._served[:] = False
+        return self._images
+
+    def get_image(self, physics: 'mjcf.Physics', index: int) -> np.ndarray:
+        """Returns a copy of the image of eye `index`, rendering if needed."""
+        if (physics is not self._physics or physics.data.time != self._time
+                or self._served[index]):
+            self.render(physics)
+        self._served[index] = True
+        return self._images[index].copy()
@@ -1,6 +1,7 @@
 """Fruit fly model walker."""
 
 import collections as col
+import functools
 import os
 from typing import Sequence
 
@@ -15,10 +16,20 @@ from dm_control.utils.transformations import quat_mul
 from dm_env import specs
 import numpy as np
 
+from flybody.fruitfly import compound_eye
+from flybody.fruitfly import eye_renderer
+
 enums = mjbindings.enums
 mjlib = mjbindings.mjlib
 
 _XML_PATH = os.path.join(os.path.dirname(__file__), 'assets/fruitfly.xml')
+# Model variants. The 'fast' variant has simplified collisions, see
+# build_fruitfly/make_fruitfly_fast.py.
+_XML_PATHS = {
+    'default': _XML_PATH,
+    'fast': os.path.join(os.path.dirname(__file__),
+                         'assets/fruitfly_fast.xml'),
+}
 # === Constants.
 _SPAWN_POS = np.array((0, 0, 0.1278))
 # OrderedDict used to streamline enabling/disabling of action classes.
@@ -32,6 +43,14 @@ _ACTION_CLASSES = col.OrderedDict(adhesion=0,
                                   user=0)
 
 
+def get_xml_path(model_variant: str = 'default') -> str:
+    """Returns path to the fruitfly XML file of model_variant."""
+    if model_variant not in _XML_PATHS:
+        raise ValueError(f'Unknown model variant {model_variant}, expected '
+                         f'one of {list(_XML_PATHS)}.')
+    return _XML_PATHS[model_variant]
+
+
 def neg_quat(quat_a):
     """Returns neg(quat_a)."""
     quat_b = quat_a.copy()
@@ -139,6 +158,7 @@ class FruitFly(legacy_base.Walker):
         num_user_actions: int = 0,
         eye_camera_fovy: float = 150.,
         eye_camera_size: int = 32,
+        eye_raycast: str | None = None,
     ):
         """Build a fruitfly walker.
 
@@ -170,7 +190,13 @@ class FruitFly(legacy_base.Walker):
                 size.
             eye_camera_size: Size in pixels (height and width) of the eye cameras.
                 Height and width are assumed equal.
+            eye_raycast: If given, eye observables are computed by CPU ray
+                casting instead of OpenGL rendering, see compound_eye.py. One of
+                'intensity', 'depth', 'geom_id'. None: use eye cameras.
         """
+        if eye_raycast not in (None, ) + compound_eye.OUTPUTS:
+            raise ValueError('eye_raycast should be None or one of '
+                             f'{compound_eye.OUTPUTS}, got {eye_raycast}.')
         if xml_path is None:
             xml_path = _XML_PATH
         self._use_wings = use_wings
@@ -178,6 +204,7 @@ class FruitFly(legacy_base.Walker):
         self._control_timestep = control_timestep
         self._buffer_size = int(round(control_timestep / physics_timestep))
         self._eye_camera_size = eye_camera_size
+        self._eye_raycast = eye_raycast
         root = mjcf.from_path(xml_path)
         self._mjcf_root = root
         if name:
@@ -188,6 +215,12 @@ class FruitFly(legacy_base.Walker):
         # Set eye camera fovy.
         root.find('camera', 'eye_right').fovy = eye_camera_fovy
         root.find('camera', 'eye_left').fovy = eye_camera_fovy
+        # Transparent geoms are not rendered, hide them from ray-cast eyes too.
+        if eye_raycast:
+            for default in root.find_all('default'):
+                rgba = default.geom.rgba
+                if rgba is not None and rgba[3] == 0:
+                    default.geom.group = 3
 
         # Identify actuator/body/joint/tendon class by substrings in its name.
         name_substr = {
@@ -342,7 +375,8 @@ class FruitFly(legacy_base.Walker):
         # === Get action-class indices into the MuJoCo control vector.
         # Find all ctrl indices except adhesion.
         self._ctrl_indices = _ACTION_CLASSES.copy()
-        names = [a.name for a in root.find_all('actuator')]
+        self._actuators = root.find_all('actuator')
+        names = [a.name for a in self._actuators]
         for act_class in self._ctrl_indices.keys():
             indices = [
                 i for i, name in enumerate(names)
@@ -390,20 +424,31 @@ class FruitFly(legacy_base.Walker):
     def initialize_episode(self, physics: 'mjcf.Physics',
                            random_state: np.random.RandomState):
         """Set the walker."""
-        # Save the weight of the body (in Dyne i.e. gram*cm/s^2).
-        body_mass = physics.named.model.body_subtreemass[
-            'walker/thorax']  # gram.
-        self._weight = np.linalg.norm(physics.model.opt.gravity) * body_mass
-        # Retract wings if not used.
-        if not self._use_wings and self.name == 'walker':
+        self._set_weight(physics)
+        # Retract wings if not used. The ghost fly has no wing joints.
+        if not self._use_wings:
             for s in ['left', 'right']:
                 for dof in ['yaw', 'roll', 'pitch']:
-                    j = f'walker/wing_{dof}_{s}'
-                    physics.named.data.qpos[
-                        j] = physics.named.model.qpos_spring[j]
+                    joint = self._mjcf_root.find('joint', f'wing_{dof}_{s}')
+                    if joint is not None:
+                        joint = physics.bind(joint)
+                        joint.qpos = joint.qpos_spring
         # Set previous action to zero.
         self._prev_action = np.zeros_like(self._prev_action)
 
+    def _set_weight(self, physics: 'mjcf.Physics'):
+        # Save the weight of the body (in Dyne i.e. gram*cm/s^2).
+        body_mass = physics.named.model.body_subtreemass[
+            'walker/thorax']  # gram.
+        self._weight = np.linalg.norm(physics.model.opt.gravity) * body_mass
+
+    def restore_episode(self, physics: 'mjcf.Physics',
+                        prev_action: np.ndarray):
+        """Set the walker for a restored physics state, instead of
+        initialize_episode, which would overwrite the state."""
+        self._set_weight(physics)
+        self._prev_action = np.array(prev_action, dtype=self._prev_action.dtype)
+
     # -------------------------------------------------------------------------
 
     @property
@@ -498,7 +543,7 @@ class FruitFly(legacy_base.Walker):
 
     def _build_observables(self):
         return FruitFlyObservables(self, self._buffer_size,
-                                   self._eye_camera_size)
+                                   self._eye_camera_size, self._eye_raycast)
 
     @composer.cached_property
     def left_eye(self):
@@ -532,16 +577,17 @@ class FruitFly(legacy_base.Walker):
     def apply_action(self, physics, action, random_state):
         """Apply action to walker's actuators."""
         del random_state  # Unused.
-        if not self.mjcf_model.find_all('actuator'):
+        if not self._actuators:
             return
         # Update previous action.
         self._prev_action[:] = action
-        # Apply MuJoCo actions.
-        ctrl = np.zeros(physics.model.nu)
+        # Apply MuJoCo actions. Ctrl indices are relative to this walker's
+        # actuators, which may be offset in a model with several walkers.
+        ctrl = np.zeros(len(self._actuators))
         for key, indices in self._action_indices.items():
             if self._ctrl_indices[key] and indices:
                 ctrl[self._ctrl_indices[key]] = action[indices]
-        physics.set_control(ctrl)
+        physics.bind(self._actuators).ctrl = ctrl
 
     # -------------------------------------------------------------------------
 
@@ -585,10 +631,12 @@ class FruitFly(legacy_base.Walker):
 class FruitFlyObservables(legacy_base.WalkerObservables):
     """Observables for the fruit fly."""
 
-    def __init__(self, walker, buffer_size, eye_camera_size):
+    def __init__(self, walker, buffer_size, eye_camera_size, eye_raycast=None):
         self._walker = walker
         self._buffer_size = buffer_size
         self._eye_camera_size = eye_camera_size
+        self._eye_raycast = eye_raycast
+        self._eye_renderer = None
         super().__init__(walker)
 
     @composer.observable
@@ -725,32 +773,42 @@ class FruitFlyObservables(legacy_base.WalkerObservables):
             self.world_zaxis, self.world_zaxis_abdomen, self.world_zaxis_head
         ]
 
+    def _eye_image(self, index):
+        """Returns a callable rendering eye `index`, 0: left, 1: right.
+
+        Both eyes share one StereoEyeRenderer, which renders them together.
+        """
+        if self._eye_renderer is None:
+            # Render this walker's geoms.
+            scene_options = mj_wrapper.MjvOption()
+            cosmetic_geom_group = 1
+            scene_options.geomgroup[cosmetic_geom_group] = 1
+            self._eye_renderer = eye_renderer.StereoEyeRenderer(
+                [self._entity.left_eye, self._entity.right_eye],
+                self._eye_camera_size,
+                scene_option=scene_options)
+        return functools.partial(self._eye_renderer.get_image, index=index)
+
     @composer.observable
     def right_eye(self):
         """Observable of the right_eye camera."""
 
-        if not hasattr(self, '_scene_options'):
-            # Render this walker's geoms.
-            self._scene_options = mj_wrapper.MjvOption()
-            cosmetic_geom_group = 1
-            self._scene_options.geomgroup[cosmetic_geom_group] = 1
+        if self._eye_raycast:
+            return observable.Generic(
+                compound_eye.RayCastEye(self._entity.right_eye,
+                                        self._eye_camera_size,
+                                        output=self._eye_raycast))
 
-        return observable.MJCFCamera(self._entity.right_eye,
-                                     width=self._eye_camera_size,
-                                     height=self._eye_camera_size,
-                                     scene_option=self._scene_options)
+        return observable.Generic(self._eye_image(1))
 
     @composer.observable
     def left_eye(self):
         """Observable of the left_eye camera."""
 
-        if not hasattr(self, '_scene_options'):
-            # Render this walker's geoms.
-            self._scene_options = mj_wrapper.MjvOption()
-            cosmetic_geom_group = 1
-            self._scene_options.geomgroup[cosmetic_geom_group] = 1
+        if self._eye_raycast:
+            return observable.Generic(
+                compound_eye.RayCastEye(self._entity.left_eye,
+                                        self._eye_camera_size,
+                                        output=self._eye_raycast))
 
-        return observable.MJCFCamera(self._entity.left_eye,
-                                     width=self._eye_camera_size,
-                                     height=self._eye_camera_size,
-                                     scene_option=self._scene_options)
+        return observable.Generic(self._eye_image(0))
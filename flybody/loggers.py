@@ -1,19 +1,36 @@
 """Loggers for RL training with Ray."""
 
+import collections
+import logging
+import queue
+import threading
 import time
 import numpy as np
 from acme.utils.loggers import base
 import mlflow
+from mlflow.entities import Metric
+
+# Maximum number of metrics per MlflowClient.log_batch call.
+_MAX_METRICS_PER_BATCH = 1000
 
 
 class MLflowLogger(base.Logger):
-    """Logs training stats to local MLflow tracking server."""
+    """Logs training stats to local MLflow tracking server.
+
+    Metrics are queued by `write` and sent by a background thread in
+    `log_batch` calls, so writing never waits on the tracking server. The
+    learner's logger also computes the moving average of actor episode returns
+    (logged by all actors under the same run) incrementally on that thread.
+    """
 
     def __init__(self,
                  uri: str,
                  run_id: str,
                  label: str = '',
                  time_delta: float = 0.,
+                 flush_interval: float = 5.,
+                 history_interval: float = 60.,
+                 kernel_size: int = 50,
                 ):
         """Initializes the logger.
 
@@ -26,6 +43,10 @@ class MLflowLogger(base.Logger):
                 'evaluator'.
             time_delta: How often (in seconds) to write values.
                 If zero, everything is written.
+            flush_interval: Seconds between batched sends of queued metrics.
+            history_interval: Seconds between reads of new actor episode
+                returns, for the learner's average_episode_return.
+            kernel_size: Number of episode returns averaged.
         """
         # Start logging under an existing run.
         mlflow.set_tracking_uri(uri=uri)
@@ -49,6 +70,29 @@ class MLflowLogger(base.Logger):
         # over all actors.
         self._client = mlflow.tracking.MlflowClient()
         self._run_id = run_id
+
+        # Moving average state: number of actor returns consumed, the last
+        # kernel_size returns and their steps, and the number of averages
+        # to skip because they were logged before a restart (None: unknown).
+        self._kernel_size = kernel_size
+        self._num_returns = 0
+        self._returns = collections.deque(maxlen=kernel_size)
+        self._return_steps = collections.deque(maxlen=kernel_size)
+        self._num_averages_to_skip = None
+        self._history_interval = history_interval
+        self._last_history_time = 0.
+
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._send_loop, daemon=True)
+        self._thread.start()
+
+    def _log(self, metrics: dict, step: int):
+        """Queues metrics for the background thread."""
+        timestamp = int(time.time() * 1000)
+        for key, value in metrics.items():
+            self._queue.put(Metric(key, float(value), timestamp, int(step)))
     
     def write(self, values: base.LoggingData):
         """Write data to destination.
@@ -60,10 +104,7 @@ class MLflowLogger(base.Logger):
         # Always log saved_snapshot_at_actor_steps when it occurs.
         if 'saved_snapshot_at_actor_steps' in values:
             step = values['saved_snapshot_at_actor_steps']
-            mlflow.log_metric(
-                key='saved_snapshot_at_actor_steps',
-                value=step,
-                step=step)
+            self._log({'saved_snapshot_at_actor_steps': step}, step=step)
 
         now = time.time()
         if (now - self._time) < self._time_delta:
@@ -100,30 +141,68 @@ class MLflowLogger(base.Logger):
         # Log the subset of metrics.
         step = metrics['actor_steps'] if 'actor_steps' in metrics else 0
         metrics = {k: v for k, v in metrics.items() if k in self._keys2log}
-        mlflow.log_metrics(metrics, step=step)
+        self._log(metrics, step=step)
         self._time = now
-    
+
+    def _send_loop(self):
+        """Sends queued metrics, and maybe average returns, periodically."""
+        while not self._stop.wait(self._flush_interval):
+            self._send()
+
+    def _send(self):
         # If this logger instance is in learner, also calculate and log average
         # return over all actors.
-        if self._label == 'learner':
-            history = self._client.get_metric_history(
-                run_id=self._run_id, key='actor_episode_return')
-            if history:
-                x = [entry.step for entry in history]
-                y = [entry.value for entry in history]
-                x_conv, y_conv = self._convolve(x, y)
-                logged_so_far = self._client.get_metric_history(
-                    run_id=self._run_id, key='average_episode_return')
-                idx_from = len(logged_so_far)
-                for value, step in zip(y_conv[idx_from:], x_conv[idx_from:]):
-                    mlflow.log_metric('average_episode_return', value, step=step)
-
-    def _convolve(self, x, y, kernel_size=50):
-        y_conv = np.convolve(y, np.ones(kernel_size)/kernel_size)
-        y_conv = y_conv[kernel_size:-kernel_size]
-        x_conv = x[kernel_size//2:-kernel_size//2-1]
-        return x_conv, y_conv
+        if (self._label == 'learner' and time.time() -
+                self._last_history_time >= self._history_interval):
+            self._last_history_time = time.time()
+            try:
+                self._update_average_return()
+            except Exception:  # Tracking server unavailable, retry later.
+                logging.exception('Reading actor episode returns failed.')
+        metrics = []
+        while True:
+            try:
+                metrics.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(metrics), _MAX_METRICS_PER_BATCH):
+            try:
+                self._client.log_batch(
+                    self._run_id,
+                    metrics=metrics[i:i + _MAX_METRICS_PER_BATCH])
+            except Exception:  # Drop the batch rather than block training.
+                logging.exception('Logging %d metrics to MLflow failed.',
+                                  len(metrics[i:i + _MAX_METRICS_PER_BATCH]))
+
+    def _update_average_return(self):
+        """Queues moving averages of actor returns logged since last call.
+
+        For i >= kernel_size, the average of returns i - kernel_size + 1, ...,
+        i is logged at the step of return i - kernel_size // 2, once return
+        i + 1 exists, the same points as the former full-history convolution.
+        """
+        if self._num_averages_to_skip is None:
+            self._num_averages_to_skip = len(
+                self._client.get_metric_history(
+                    run_id=self._run_id, key='average_episode_return'))
+        history = self._client.get_metric_history(
+            run_id=self._run_id, key='actor_episode_return')
+        # Only the last return is pending, until the next one arrives.
+        for entry in history[self._num_returns:len(history) - 1]:
+            self._returns.append(entry.value)
+            self._return_steps.append(entry.step)
+            self._num_returns += 1
+            if self._num_returns <= self._kernel_size:
+                continue
+            if self._num_averages_to_skip > 0:
+                self._num_averages_to_skip -= 1
+                continue
+            self._log({'average_episode_return': np.mean(self._returns)},
+                      step=self._return_steps[-(self._kernel_size // 2) - 1])
 
     def close(self):
         """Closes the logger, not expecting any further write."""
+        self._stop.set()
+        self._thread.join()
+        self._send()
         mlflow.end_run()
@@ -273,8 +273,9 @@ class Hills(composer.Arena):
                                       res**2] = terrain.ravel()
 
             # If we have a rendering context, we need to re-upload the modified
-            # heightfield data.
-            if physics.contexts:
+            # heightfield data. Don't create one here, so that headless
+            # physics (e.g. with ray-cast eyes) works without OpenGL.
+            if physics._contexts:
                 with physics.contexts.gl.make_current() as ctx:
                     ctx.call(mjlib.mjr_uploadHField, physics.model.ptr,
                              physics.contexts.mujoco.ptr,
@@ -385,8 +386,9 @@ class SineTrench(Hills):
                                       res**2] = terrain.ravel()
 
             # If we have a rendering context, we need to re-upload the modified
-            # heightfield data.
-            if physics.contexts:
+            # heightfield data. Don't create one here, so that headless
+            # physics (e.g. with ray-cast eyes) works without OpenGL.
+            if physics._contexts:
                 with physics.contexts.gl.make_current() as ctx:
                     ctx.call(mjlib.mjr_uploadHField, physics.model.ptr,
                              physics.contexts.mujoco.ptr,
@@ -464,8 +466,9 @@ class SineBumps(Hills):
                                       res**2] = terrain.ravel()
 
             # If we have a rendering context, we need to re-upload the modified
-            # heightfield data.
-            if physics.contexts:
+            # heightfield data. Don't create one here, so that headless
+            # physics (e.g. with ray-cast eyes) works without OpenGL.
+            if physics._contexts:
                 with physics.contexts.gl.make_current() as ctx:
                     ctx.call(mjlib.mjr_uploadHField, physics.model.ptr,
                              physics.contexts.mujoco.ptr,
@@ -44,6 +44,7 @@ class FruitFlyTask(composer.Task, ABC):
         num_user_actions: int = 0,
         eye_camera_fovy: float = 150.,
         eye_camera_size: int = 32,
+        eye_raycast: str | None = None,
         future_steps: int = 0,
         initialize_qvel: bool = False,
         observables_options: dict | None = None,
@@ -78,6 +79,8 @@ class FruitFlyTask(composer.Task, ABC):
             eye_camera_fovy: Vertical field of view of the eye cameras, degrees.
             eye_camera_size: Size in pixels (height and width) of the eye cameras.
                 Height and width are assumed equal.
+            eye_raycast: If given, compute eye observables by CPU ray casting
+                instead of OpenGL rendering: 'intensity', 'depth' or 'geom_id'.
             future_steps: Number of future steps of reference trajectory to provide
                 as observables. Zero means only the current step is used.
             initialize_qvel: whether to init qvel of root or not (wings are always vel
@@ -96,6 +99,8 @@ class FruitFlyTask(composer.Task, ABC):
         self._should_terminate = False
         # Initialize timestep counter.
         self._step_counter = 0
+        # Optional pool of pre-simulated initial states.
+        self._state_pool = None
 
         # Create the arena.
         self._arena = arena
@@ -122,7 +127,8 @@ class FruitFlyTask(composer.Task, ABC):
                               control_timestep=control_timestep,
                               num_user_actions=num_user_actions,
                               eye_camera_fovy=eye_camera_fovy,
-                              eye_camera_size=eye_camera_size)
+                              eye_camera_size=eye_camera_size,
+                              eye_raycast=eye_raycast)
         # Set options to fly observables, if provided.
         self._walker.observables.set_options(observables_options)
 
@@ -148,10 +154,9 @@ class FruitFlyTask(composer.Task, ABC):
             spawn_site = arena.mjcf_model.worldbody.add('site', pos=spawn_pos)
             self._ghost_frame = arena.attach(self._ghost, spawn_site)
             spawn_site.remove()
-
-            self._ghost_joint = self._ghost_frame.add('joint',
-                                                      type='free',
-                                                      armature=1)
+            # The ghost is a kinematic mocap body driven directly from the
+            # reference, it adds no DoFs to the simulation.
+            self._ghost_frame.mocap = True
         else:
             self._ghost = None
 
@@ -166,17 +171,6 @@ class FruitFlyTask(composer.Task, ABC):
         self._walker.mjcf_model.compiler.boundmass = 0.
         self._walker.mjcf_model.compiler.boundinertia = 0.
 
-        # === Explicitly enable observables.
-        # Basic sensors.
-        # vestibular: gyro, accelerometer, velocimeter, world_zaxis.
-        # proprioception: joints_pos, joints_vel, actuator_activation.
-        for sensor in (self._walker.observables.vestibular +
-                       self._walker.observables.proprioception):
-            sensor.enabled = True
-
-    def initialize_episode_mjcf(self, random_state: np.random.RandomState):
-        if hasattr(self._arena, 'regenerate'):
-            self._arena.regenerate(random_state)
         # Better visual defaults for CGS units.
         # Important: these particular values of znear, zfar, extent are
         # critical for the visually-guided flight task.
@@ -190,9 +184,73 @@ class FruitFlyTask(composer.Task, ABC):
         self.root_entity.mjcf_model.visual.scale.jointwidth = 0.06
         self.root_entity.mjcf_model.statistic.extent = 4.01
 
+        # === Explicitly enable observables.
+        # Basic sensors.
+        # vestibular: gyro, accelerometer, velocimeter, world_zaxis.
+        # proprioception: joints_pos, joints_vel, actuator_activation.
+        for sensor in (self._walker.observables.vestibular +
+                       self._walker.observables.proprioception):
+            sensor.enabled = True
+
     def initialize_episode(self, physics, random_state):
         # Reset control timestep counter.
         self._step_counter = 0
+        # Arenas are regenerated at the physics level (e.g. hfield data), so
+        # the MJCF model is not recompiled between episodes.
+        if hasattr(self._arena, 'regenerate'):
+            self._arena.regenerate(random_state)
+
+    def restore_episode(self, physics: 'mjcf.Physics',
+                        random_state: np.random.RandomState):
+        """Initializes the episode from a state sampled from the state pool.
+
+        Called by model_cache.Environment instead of the initialize_episode
+        hooks of the task and its entities, inside physics.reset_context.
+        """
+        if hasattr(self._arena, 'regenerate'):
+            self._arena.regenerate(random_state)
+        state, bookkeeping = self._state_pool.sample(random_state)
+        physics.set_state(state)
+        self.set_bookkeeping(physics, bookkeeping)
+
+    def set_ghost_pose(self, physics: 'mjcf.Physics', position: np.ndarray,
+                       quaternion: np.ndarray):
+        """Sets position and orientation of the mocap ghost fly."""
+        ghost = physics.bind(self._ghost_frame)
+        ghost.mocap_pos = position
+        ghost.mocap_quat = quaternion / np.linalg.norm(quaternion)
+
+    def set_state_pool(self, state_pool: 'StatePool | None'):
+        """Sets pool of initial states to reset episodes from.
+
+        With a state pool, episode initialization restores a state sampled
+        from the pool instead of initializing and settling the walker, see
+        `restore_episode`. The environment has to be a
+        model_cache.Environment. This is
+        intended for tasks whose initial states do not depend on per-episode
+        data, e.g. WalkOnBall and TemplateTask. See tasks/state_pool.py.
+
+        Args:
+            state_pool: StatePool, or None to disable.
+        """
+        self._state_pool = state_pool
+
+    @property
+    def state_pool(self):
+        return self._state_pool
+
+    def get_bookkeeping(self) -> dict:
+        """Returns per-episode task and walker state not in the physics
+        state, to be recorded in a state pool."""
+        return {
+            'step_counter': np.int64(self._step_counter),
+            'prev_action': np.copy(self._walker.prev_action),
+        }
+
+    def set_bookkeeping(self, physics: 'mjcf.Physics', bookkeeping: dict):
+        """Restores state recorded with get_bookkeeping."""
+        self._step_counter = int(bookkeeping['step_counter'])
+        self._walker.restore_episode(physics, bookkeeping['prev_action'])
 
     def before_step(self, physics: 'mjcf.Physics', action,
                     random_state: np.random.RandomState):
@@ -65,7 +65,9 @@ class FlightImitationWBPG(Flying):
         if self._trajectory_sites:
             self._n_traj_sites = (
                 round(self._time_limit / self.control_timestep) + 1) // 10
-            add_trajectory_sites(self.root_entity, self._n_traj_sites, group=1)
+            self._traj_sites = add_trajectory_sites(self.root_entity,
+                                                    self._n_traj_sites,
+                                                    group=1)
 
         # Explicitly add tracking task observables.
         self._walker.observables.add_observable('ref_displacement',
@@ -79,8 +81,14 @@ class FlightImitationWBPG(Flying):
         """
         self._next_traj_idx = idx
 
-    def initialize_episode_mjcf(self, random_state: np.random.RandomState):
-        super().initialize_episode_mjcf(random_state)
+    def initialize_episode(self, physics: 'mjcf.Physics',
+                           random_state: np.random.RandomState):
+        """Randomly select a starting point and set the walker.
+
+        Environment call sequence:
+            check_termination, get_reward_factors, get_discount
+        """
+        super().initialize_episode(physics, random_state)
 
         # Get next trajectory.
         self._ref_qpos, self._ref_qvel = self._traj_generator.get_trajectory(
@@ -103,26 +111,24 @@ class FlightImitationWBPG(Flying):
 
         # Update positions of trajectory sites.
         if self._trajectory_sites:
-            update_trajectory_sites(self.root_entity, self._ref_qpos,
-                                    self._n_traj_sites, self._traj_timesteps)
-        # Update axis crosshair position.
+            update_trajectory_sites(physics, self._traj_sites, self._ref_qpos,
+                                    self._traj_timesteps)
+        # Update axis crosshair position. The capsule sites are updated in the
+        # compiled model: the vertical one spans [0, z + 0.5], the horizontal
+        # ones are moved to height z.
         z = self._ref_qpos[0, 2]
-        self._crosshair_sites[0].fromto[[2, 5]] = [0, z + 0.5]
-        self._crosshair_sites[1].fromto[[2, 5]] = z
-        self._crosshair_sites[2].fromto[[2, 5]] = z
-
-    def initialize_episode(self, physics: 'mjcf.Physics',
-                           random_state: np.random.RandomState):
-        """Randomly select a starting point and set the walker.
-
-        Environment call sequence:
-            check_termination, get_reward_factors, get_discount
-        """
-        super().initialize_episode(physics, random_state)
-
-        ghost_qpos = self._ref_qpos[0, :] + np.hstack(
+        crosshair = physics.bind(self._crosshair_sites)
+        pos = crosshair.pos
+        size = crosshair.size
+        pos[:, 2] = [(z + 0.5) / 2, z, z]
+        size[0, 1] = (z + 0.5) / 2
+        crosshair.pos = pos
+        crosshair.size = size
+
+        self._ghost_qpos = self._ref_qpos[0, :] + np.hstack(
             (self._ghost_offset, 4 * [0]))
-        self._ghost.set_pose(physics, ghost_qpos[:3], ghost_qpos[3:])
+        self.set_ghost_pose(physics, self._ghost_qpos[:3],
+                            self._ghost_qpos[3:])
 
         # Reset wing pattern generator and get initial wing qpos.
         init_wing_qpos, init_wing_qvel = self._wbpg.reset(
@@ -145,7 +151,7 @@ class FlightImitationWBPG(Flying):
 
     def before_step(self, physics: 'mjcf.Physics', action,
                     random_state: np.random.RandomState):
-        """Combine action with WPG base pattern. Update ghost pos and vel."""
+        """Combine action with WPG base pattern. Update ghost pos."""
         # Get target wing joint angles at beat frequency requested by the agent.
         base_freq, rel_range = self._wbpg.base_beat_freq, self._wbpg.rel_freq_range
         act = action[self._user_idx_action]  # action in [-1, 1].
@@ -157,13 +163,12 @@ class FlightImitationWBPG(Flying):
         # Convert position control to force control.
         action[self._wing_inds_action] += (ctrl - length)
 
-        # Update ghost joint pos and vel.
+        # Update ghost pos.
         step = int(np.round(physics.data.time / self.control_timestep))
-        ghost_qpos = self._ref_qpos[step, :] + np.hstack(
+        self._ghost_qpos = self._ref_qpos[step, :] + np.hstack(
             (self._ghost_offset, 4 * [0]))
-        self._ghost.set_pose(physics, ghost_qpos[:3], ghost_qpos[3:])
-        self._ghost.set_velocity(physics, self._ref_qvel[step, :3],
-                                 self._ref_qvel[step, 3:])
+        self.set_ghost_pose(physics, self._ghost_qpos[:3],
+                            self._ghost_qpos[3:])
 
         super().before_step(physics, action, random_state)
 
@@ -171,8 +176,8 @@ class FlightImitationWBPG(Flying):
         """Returns factorized reward terms."""
 
         # Reference CoM displacement reward.
-        ghost_xpos, ghost_quat = self._ghost.get_pose(physics)
-        ghost_com = root2com(np.concatenate((ghost_xpos, ghost_quat)))
+        # Ghost pose is read from the reference, not from physics.
+        ghost_com = root2com(self._ghost_qpos)
         model_com = physics.named.data.subtree_com['walker/']
         displacement = np.linalg.norm(ghost_com - model_com)
         displacement = rewards.tolerance(displacement,
@@ -0,0 +1,211 @@
+"""Cache of compiled MuJoCo models keyed by MJCF model structure."""
+
+import collections
+import hashlib
+import logging
+import os
+import tempfile
+
+from dm_control import composer
+from dm_control import mjcf
+from dm_control.mujoco.wrapper import mjbindings
+import dm_env
+import mujoco
+
+mjlib = mjbindings.mjlib
+
+# Directory of the on-disk model cache used by the process-wide default cache.
+_CACHE_DIR_ENV_VAR = 'FLYBODY_MODEL_CACHE_DIR'
+
+# MuJoCo release and header (MJB format) versions, part of the cache key since
+# MJB files are only loadable by the MuJoCo version that saved them.
+_MUJOCO_VERSION = f'mujoco-{mujoco.__version__}-{mujoco.mjVERSION_HEADER}'
+
+
+def mjcf_structure_hash(xml_string: str) -> str:
+    """Returns a hash of the MJCF model structure.
+
+    Asset filenames in the XML string generated by PyMJCF already include a
+    hash of the asset contents, so hashing the XML string and the MuJoCo
+    version is sufficient.
+
+    Args:
+        xml_string: XML string of the MJCF model, as returned by
+            mjcf_model.to_xml_string().
+
+    Returns:
+        Hex digest of the structure hash.
+    """
+    hasher = hashlib.sha1(_MUJOCO_VERSION.encode('utf-8'))
+    hasher.update(xml_string.encode('utf-8'))
+    return hasher.hexdigest()
+
+
+class CompiledModelCache():
+    """LRU cache of compiled MjModels keyed by MJCF structure hash.
+
+    Each `get_physics` call returns a new Physics instance built from a copy of
+    the cached model, so physics-level writes to the model (e.g. site_pos,
+    geom_rgba, hfield_data) do not leak into the cache.
+
+    Optionally, compiled models are also stored as MJB files in cache_dir, so
+    that other processes (e.g. distributed actors on the same node) load them
+    instead of compiling.
+    """
+
+    def __init__(self, max_size: int = 8, cache_dir: str | None = None):
+        """Initializes the cache.
+
+        Args:
+            max_size: Maximum number of compiled models to keep in memory.
+            cache_dir: Optional directory for MJB files shared between
+                processes. It is created if it doesn't exist.
+        """
+        self._max_size = max_size
+        self._cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._models = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get_physics(self, mjcf_model: mjcf.RootElement) -> mjcf.Physics:
+        """Returns a new Physics for mjcf_model, compiling only on cache miss."""
+        xml_string = mjcf_model.to_xml_string()
+        key = mjcf_structure_hash(xml_string)
+        model = self._models.get(key)
+        if model is not None:
+            self._hits += 1
+            self._models.move_to_end(key)
+            return mjcf.Physics.from_model(model.copy())
+        self._misses += 1
+        mjb_path = self._mjb_path(key)
+        physics = None
+        if mjb_path is not None and os.path.exists(mjb_path):
+            try:
+                physics = mjcf.Physics.from_binary_path(mjb_path)
+            except Exception:  # E.g. a corrupt file, it's overwritten below.
+                logging.warning('Loading %s failed, compiling instead.',
+                                mjb_path, exc_info=True)
+        if physics is None:
+            physics = mjcf.Physics.from_xml_string(
+                xml_string=xml_string, assets=mjcf_model.get_assets())
+            if mjb_path is not None:
+                self._save_mjb(physics, mjb_path)
+        self._models[key] = physics.model.copy()
+        if len(self._models) > self._max_size:
+            _, evicted = self._models.popitem(last=False)
+            evicted.free()
+        return physics
+
+    def _mjb_path(self, key: str) -> str | None:
+        if self._cache_dir is None:
+            return None
+        return os.path.join(self._cache_dir, f'{key}.mjb')
+
+    def _save_mjb(self, physics: mjcf.Physics, mjb_path: str):
+        """Saves MJB atomically, so concurrent readers never see partial files."""
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            mjlib.mj_saveModel(physics.model.ptr, tmp_path, None)
+            os.replace(tmp_path, mjb_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def clear(self):
+        """Removes all in-memory cached models. MJB files are kept."""
+        for model in self._models.values():
+            model.free()
+        self._models.clear()
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def __len__(self):
+        return len(self._models)
+
+
+# Process-wide cache shared by all environments, e.g. actor and evaluator
+# environments built in the same process. Set FLYBODY_MODEL_CACHE_DIR to also
+# share compiled models between processes.
+_DEFAULT_CACHE = CompiledModelCache(
+    cache_dir=os.environ.get(_CACHE_DIR_ENV_VAR))
+
+
+def default_cache() -> CompiledModelCache:
+    """Returns the process-wide compiled model cache."""
+    return _DEFAULT_CACHE
+
+
+class Environment(composer.Environment):
+    """Composer environment which gets compiled models from a cache.
+
+    Recompilation only happens when the MJCF model structure changes, e.g.
+    when an arena regenerates its MJCF. Per-episode visual and trajectory
+    updates in flybody tasks are written at the physics level and do not change
+    the MJCF model.
+    """
+
+    def __init__(self,
+                 *args,
+                 model_cache: CompiledModelCache | None = None,
+                 **kwargs):
+        """Initializes the environment.
+
+        Args:
+            *args: Arguments passed to composer.Environment.
+            model_cache: Compiled model cache to use. If None, the process-wide
+                default cache is used.
+            **kwargs: Keyword arguments passed to composer.Environment.
+        """
+        # Set before calling the superclass constructor, which compiles.
+        self._model_cache = model_cache or _DEFAULT_CACHE
+        super().__init__(*args, **kwargs)
+
+    def _recompile_physics(self):
+        """Creates a new Physics using the cached compiled model, if any."""
+        physics = getattr(self, '_physics', None)
+        if physics:
+            physics.free()
+        self._physics = self._model_cache.get_physics(
+            self._task.root_entity.mjcf_model)
+        self._physics.legacy_step = self._legacy_step
+
+    def _reset_attempt(self):
+        """Resets, restoring a pooled state if the task has a state pool.
+
+        The pooled state replaces the initialize_episode hooks of the task and
+        all entities, which would otherwise partly overwrite it.
+        """
+        if getattr(self._task, 'state_pool', None) is None:
+            return super()._reset_attempt()
+        if self._recompile_mjcf_every_episode or self._mjcf_never_compiled:
+            if self._fixed_initial_state:
+                self._random_state.set_state(self._fixed_random_state)
+            self._hooks.initialize_episode_mjcf(self._random_state)
+            self._recompile_physics_and_update_observables()
+            self._mjcf_never_compiled = False
+        if self._fixed_initial_state:
+            self._random_state.set_state(self._fixed_random_state)
+        with self._physics.reset_context():
+            self._hooks._episode_step_count = 0
+            self._task.restore_episode(self._physics_proxy, self._random_state)
+        self._observation_updater.reset(self._physics_proxy,
+                                        self._random_state)
+        self._reset_next_step = False
+        return dm_env.TimeStep(
+            step_type=dm_env.StepType.FIRST,
+            reward=None,
+            discount=None,
+            observation=self._observation_updater.get_observation())
+
+    @property
+    def model_cache(self):
+        return self._model_cache
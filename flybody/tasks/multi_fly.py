@@ -0,0 +1,230 @@
+"""Multiple independent flies packed in one MuJoCo model."""
+# ruff: noqa: F821
+
+from typing import Callable
+
+from dm_control import composer
+from dm_control import mjcf
+from dm_env import specs
+import numpy as np
+
+from flybody.tasks.base import Walking
+from flybody.tasks.constants import _TERMINAL_QACC
+
+# Collision bit 0 is used by the arena, one bit per fly for the rest.
+_MAX_FLIES = 31
+
+
+def fly_positions(num_flies: int, spacing: float) -> np.ndarray:
+    """Returns (num_flies, 3) xy-grid positions, the first one at origin."""
+    num_cols = int(np.ceil(np.sqrt(num_flies)))
+    positions = np.zeros((num_flies, 3))
+    for k in range(num_flies):
+        row, col = divmod(k, num_cols)
+        positions[k, :2] = col * spacing, row * spacing
+    return positions
+
+
+def set_collision_bits(mjcf_model: 'mjcf.RootElement', bits: int):
+    """Replaces all nonzero contype and conaffinity values with bits.
+
+    Geoms with equal bits collide with each other, geoms with disjoint bits
+    don't. This excludes contacts between whole models at no runtime cost,
+    unlike <contact><exclude> lists of all body pairs.
+    """
+    geoms = [mjcf_model.default.geom]
+    geoms += [default.geom for default in mjcf_model.find_all('default')]
+    geoms += mjcf_model.find_all('geom')
+    for geom in geoms:
+        for attr in ['contype', 'conaffinity']:
+            if getattr(geom, attr):
+                setattr(geom, attr, bits)
+    # Unset top-level defaults mean MuJoCo's default value 1.
+    for attr in ['contype', 'conaffinity']:
+        if getattr(mjcf_model.default.geom, attr) is None:
+            setattr(mjcf_model.default.geom, attr, bits)
+
+
+def match_global_settings(mjcf_model: 'mjcf.RootElement',
+                          reference: 'mjcf.RootElement'):
+    """Copies option, visual and statistic attributes from reference model.
+
+    Global settings of an attached model are merged into the parent model,
+    so they should match the ones the task has already set, e.g. timesteps.
+    """
+    for name in ['option', 'visual', 'statistic']:
+        src, dst = getattr(reference, name), getattr(mjcf_model, name)
+        for src_elem in [src] + list(src.all_children()):
+            dst_elem = dst if src_elem is src else getattr(dst, src_elem.tag)
+            dst_elem.set_attributes(**src_elem.get_attributes())
+
+
+class MultiFlyTemplateTask(Walking):
+    """Independent walking flies packed in one MuJoCo model.
+
+    Each fly is placed in its own region of the arena, and contacts between
+    different flies are disabled. One environment step advances all flies
+    with a single physics step, amortizing per-step Python overhead across
+    flies. Actions, rewards and discounts are batched along the first
+    dimension, with fly k corresponding to `self.walkers[k]`.
+
+    Flies terminate independently: a terminated fly gets discount 0 and its
+    subsequent transitions should be ignored. The episode ends when all flies
+    have terminated or at the time limit, and all flies are reset together.
+    """
+
+    def __init__(self,
+                 walker: Callable,
+                 arena: composer.Arena,
+                 num_flies: int = 4,
+                 spacing: float = 1.,
+                 claw_friction: float | None = 1.0,
+                 **kwargs):
+        """Independent walking flies packed in one MuJoCo model.
+
+        Args:
+            walker: Walker constructor to be used.
+            arena: Arena to be used. Its ground geoms collide with all flies.
+            num_flies: Number of flies, up to 31.
+            spacing: Distance between flies in the xy-grid.
+            claw_friction: Friction of claw geoms with floor.
+            **kwargs: Arguments passed to the superclass constructor.
+        """
+        if not 1 <= num_flies <= _MAX_FLIES:
+            raise ValueError(
+                f'num_flies should be in [1, {_MAX_FLIES}], got {num_flies}.')
+        self._num_flies = num_flies
+
+        # Record walker constructor arguments to build the other flies alike.
+        walker_kwargs = {}
+        def make_walker(**kw):
+            walker_kwargs.update(kw)
+            return walker(**kw)
+
+        super().__init__(walker=make_walker,
+                         arena=arena,
+                         add_ghost=False,
+                         ghost_visible_legs=False,
+                         **kwargs)
+
+        # Add the rest of the flies, configured as the first one.
+        positions = fly_positions(num_flies, spacing)
+        self._walkers = [self._walker]
+        for k in range(1, num_flies):
+            fly = walker(**{**walker_kwargs, 'name': f'walker_{k}'})
+            fly.observables.set_options(kwargs.get('observables_options'))
+            match_global_settings(fly.mjcf_model,
+                                  self.root_entity.mjcf_model)
+            spawn_site = arena.mjcf_model.worldbody.add(
+                'site', pos=fly.upright_pose.xpos + positions[k])
+            fly.create_root_joints(arena.attach(fly, spawn_site))
+            spawn_site.remove()
+            fly.mjcf_model.compiler.boundmass = 0.
+            fly.mjcf_model.compiler.boundinertia = 0.
+            # Enable the same observables as for the first fly.
+            enabled = {
+                name: obs.enabled for name, obs in
+                self._walker.observables.as_dict(fully_qualified=False).items()
+            }
+            for name, obs in fly.observables.as_dict(
+                    fully_qualified=False).items():
+                obs.enabled = enabled.get(name, False)
+            self._walkers.append(fly)
+
+        # Flies collide with themselves and the arena, not with each other.
+        all_bits = 1
+        for k, fly in enumerate(self._walkers):
+            set_collision_bits(fly.mjcf_model, 1 << (k + 1))
+            all_bits |= 1 << (k + 1)
+        for geom in arena.ground_geoms:
+            geom.contype = 1
+            geom.conaffinity = all_bits
+
+        # Maybe change default claw friction.
+        if claw_friction is not None:
+            for fly in self._walkers:
+                fly.mjcf_model.find(
+                    'default',
+                    'adhesion-collision').geom.friction = (claw_friction, )
+
+        self._fly_joints = [[mjcf.get_frame_freejoint(fly.mjcf_model)] +
+                            fly.mjcf_model.find_all('joint')
+                            for fly in self._walkers]
+        self._fly_terminated = np.zeros(num_flies, dtype=bool)
+
+    def initialize_episode(self, physics: 'mjcf.Physics',
+                           random_state: np.random.RandomState):
+        super().initialize_episode(physics, random_state)
+        self._fly_terminated = np.zeros(self._num_flies, dtype=bool)
+
+    def before_step(self, physics: 'mjcf.Physics', action,
+                    random_state: np.random.RandomState):
+        """Apply batched actions, shape (num_flies, num_actions)."""
+        self._step_counter += 1
+        for fly, fly_action in zip(self._walkers, action):
+            fly.apply_action(physics, fly_action, random_state)
+
+    def action_spec(self, physics: 'mjcf.Physics'):
+        """Batched action spec, shape (num_flies, num_actions)."""
+        spec = self._walker.get_action_spec(physics)
+        return specs.BoundedArray(
+            shape=(self._num_flies, ) + spec.shape,
+            dtype=spec.dtype,
+            minimum=np.tile(spec.minimum, (self._num_flies, 1)),
+            maximum=np.tile(spec.maximum, (self._num_flies, 1)),
+            name=spec.name)
+
+    def get_reward_spec(self):
+        return specs.Array(shape=(self._num_flies, ),
+                           dtype=np.float64,
+                           name='reward')
+
+    def get_discount_spec(self):
+        return specs.BoundedArray(shape=(self._num_flies, ),
+                                  dtype=np.float64,
+                                  minimum=0.,
+                                  maximum=1.,
+                                  name='discount')
+
+    def get_reward(self, physics: 'mjcf.Physics') -> np.ndarray:
+        self._fly_terminated |= self.check_fly_termination(physics)
+        return np.prod(self.get_reward_factors(physics), axis=1)
+
+    def get_reward_factors(self, physics):
+        """Returns factorized reward terms, shape (num_flies, num_factors)."""
+        # Calculate reward factors here.
+        return np.ones((self._num_flies, 1))
+
+    def check_fly_termination(self, physics: 'mjcf.Physics') -> np.ndarray:
+        """Check termination conditions of each fly."""
+        qacc = np.array([
+            np.linalg.norm(physics.bind(joints).qacc)
+            for joints in self._fly_joints
+        ])
+        return qacc > _TERMINAL_QACC
+
+    def get_discount(self, physics: 'mjcf.Physics'):
+        del physics  # Unused by get_discount.
+        return np.where(self._fly_terminated, 0., 1.)
+
+    def should_terminate_episode(self, physics: 'mjcf.Physics'):
+        return bool(np.all(self._fly_terminated))
+
+    def batch_observation(self, observation: dict) -> dict:
+        """Stacks per-fly observations, e.g. `walker_1/gyro`, along the first
+        dimension, with keys without fly prefix, e.g. `gyro`."""
+        prefix = self._walker.name + '/'
+        names = [k[len(prefix):] for k in observation if k.startswith(prefix)]
+        return {
+            name: np.stack([
+                observation[f'{fly.name}/{name}'] for fly in self._walkers
+            ]) for name in names
+        }
+
+    @property
+    def walkers(self):
+        return self._walkers
+
+    @property
+    def num_flies(self):
+        return self._num_flies
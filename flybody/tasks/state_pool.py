@@ -0,0 +1,125 @@
+"""Pool of pre-simulated initial states for fast episode resets."""
+# ruff: noqa: F821
+
+from typing import Any, Callable
+
+import numpy as np
+
+_BOOKKEEPING_PREFIX = 'bookkeeping/'
+
+
+class StatePool():
+    """Pool of recorded post-initialization physics states.
+
+    Each entry is a physics state as returned by `physics.get_state()` plus
+    the task bookkeeping recorded at the same time, see
+    `FruitFlyTask.get_bookkeeping`. The pool is immutable and consists of
+    plain numpy arrays, so it can be saved to disk once and loaded by, or
+    passed (e.g. with ray.put) to, all actors on a node.
+    """
+
+    def __init__(self,
+                 states: np.ndarray,
+                 bookkeeping: dict[str, np.ndarray] | None = None):
+        """Initializes the pool.
+
+        Args:
+            states: Physics states, shape (num_states, state_size).
+            bookkeeping: Optional dict of task bookkeeping arrays, each with
+                leading dimension num_states.
+        """
+        states = np.asarray(states, dtype=np.float64)
+        if states.ndim != 2 or not len(states):
+            raise ValueError('states should have shape (num_states, '
+                             f'state_size), got {states.shape}.')
+        bookkeeping = bookkeeping or {}
+        for name, value in bookkeeping.items():
+            if len(value) != len(states):
+                raise ValueError(
+                    f'Bookkeeping entry {name} has {len(value)} items, '
+                    f'expected {len(states)}.')
+        self._states = states
+        self._bookkeeping = {k: np.asarray(v) for k, v in bookkeeping.items()}
+
+    def sample(
+        self, random_state: np.random.RandomState
+    ) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+        """Samples a state and its bookkeeping uniformly from the pool."""
+        idx = random_state.randint(len(self._states))
+        return self[idx]
+
+    def __getitem__(self, idx):
+        bookkeeping = {k: v[idx] for k, v in self._bookkeeping.items()}
+        return self._states[idx], bookkeeping
+
+    def __len__(self):
+        return len(self._states)
+
+    @property
+    def state_size(self):
+        return self._states.shape[1]
+
+    def save(self, path: str):
+        """Saves the pool to an .npz file."""
+        arrays = {
+            _BOOKKEEPING_PREFIX + k: v
+            for k, v in self._bookkeeping.items()
+        }
+        np.savez(path, states=self._states, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> 'StatePool':
+        """Loads a pool saved with `save`."""
+        with np.load(path) as data:
+            states = data['states']
+            bookkeeping = {
+                k[len(_BOOKKEEPING_PREFIX):]: data[k]
+                for k in data.files if k.startswith(_BOOKKEEPING_PREFIX)
+            }
+        return cls(states, bookkeeping)
+
+
+def collect_state_pool(
+        env: 'composer.Environment',
+        num_states: int,
+        settle_steps: int = 0,
+        policy: Callable[[Any], np.ndarray] | None = None) -> StatePool:
+    """Pre-simulates initial states by resetting and (optionally) stepping env.
+
+    Args:
+        env: Environment to collect states from. A state pool already set on
+            env's task is bypassed during collection.
+        num_states: Number of states to collect.
+        settle_steps: Number of control steps to run after each reset before
+            recording the state.
+        policy: Callable mapping observation to action, used during settling,
+            e.g. task_utils.get_random_policy. Defaults to zero actions.
+
+    Returns:
+        Collected state pool.
+    """
+    task = env.task
+    previous_pool = task.state_pool
+    task.set_state_pool(None)
+    try:
+        states = []
+        bookkeeping = []
+        for _ in range(num_states):
+            timestep = env.reset()
+            for _ in range(settle_steps):
+                if policy is None:
+                    action = np.zeros(env.action_spec().shape)
+                else:
+                    action = policy(timestep.observation)
+                timestep = env.step(action)
+                if timestep.last():
+                    break
+            states.append(env.physics.get_state())
+            bookkeeping.append(task.get_bookkeeping())
+    finally:
+        task.set_state_pool(previous_pool)
+    bookkeeping = {
+        k: np.stack([b[k] for b in bookkeeping])
+        for k in bookkeeping[0]
+    }
+    return StatePool(np.stack(states), bookkeeping)
@@ -0,0 +1,243 @@
+"""Per-phase profiler of control steps of composer environments."""
+# ruff: noqa: F821
+
+import collections
+import time
+
+# Phases of a control step, in order of execution. Time not attributed to
+# any phase (e.g. discount, composer bookkeeping) is reported as 'other'.
+PHASES = ('before_step', 'physics', 'after_step', 'observables',
+          'get_reward_factors', 'check_termination')
+
+
+class StepProfiler():
+    """Times phases of each control step of a composer environment.
+
+    The profiler instruments the environment in place by wrapping methods of
+    the environment, its task, observation updater and observables on the
+    instance level; the environment is used as usual. Timed phases:
+      'before_step', 'after_step': Task hooks, incl. applying the action.
+      'physics': All physics substeps, incl. substep hooks.
+      'observables': Observation updates and aggregation, also broken down
+          by individual observable callables.
+      'get_reward_factors', 'check_termination': Reward and termination of
+          FruitFlyTask; for other tasks 'get_reward' and
+          'should_terminate_episode' are timed instead.
+
+    Time is accumulated with time.perf_counter_ns. Each reset stores a report
+    of the finished episode in `episode_reports`; `report()` returns the
+    report of the current episode at any time. When disabled, all wrappers
+    are removed, so there is no overhead.
+
+    Example:
+
+        env = template_task()
+        profiler = StepProfiler(env)
+        ...  # Run episodes.
+        print(format_report(profiler.report()))
+        profiler.disable()
+    """
+
+    def __init__(self, env: 'composer.Environment', enabled: bool = True,
+                 max_episode_reports: int | None = 100):
+        """Initializes the profiler.
+
+        Args:
+            env: Composer environment to profile.
+            enabled: Whether to start profiling right away.
+            max_episode_reports: Number of most recent episode reports to keep,
+                None to keep all.
+        """
+        self._env = env
+        self._enabled = False
+        self._wrapped = []  # (object, attribute name) of installed wrappers.
+        self._observables_wrapped = []
+        self._ns = {}
+        self._observable_ns = {}
+        self._num_steps = 0
+        self.episode_reports = collections.deque(maxlen=max_episode_reports)
+        task = env.task
+        if hasattr(task, 'get_reward_factors'):
+            self._reward_phases = ('get_reward_factors', 'check_termination')
+        else:
+            self._reward_phases = ('get_reward', 'should_terminate_episode')
+        self._clear()
+        if enabled:
+            self.enable()
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    def enable(self):
+        """Installs the wrappers."""
+        if self._enabled:
+            return
+        self._enabled = True
+        env, task = self._env, self._env.task
+        self._wrap(env, 'step', None, self._step_wrapper)
+        self._wrap(env, 'reset', None, self._reset_wrapper)
+        self._wrap(env, '_substep', 'physics')
+        self._wrap(task, 'before_step', 'before_step')
+        self._wrap(task, 'after_step', 'after_step')
+        reward_factors, termination = self._reward_phases
+        self._wrap(task, reward_factors, reward_factors)
+        self._wrap(task, termination, termination)
+        self._wrap_observables()
+
+    def disable(self):
+        """Removes all wrappers, keeps the accumulated times."""
+        if not self._enabled:
+            return
+        self._enabled = False
+        self._unwrap_observables()
+        for obj, name in self._wrapped:
+            delattr(obj, name)
+        self._wrapped = []
+
+    def report(self) -> dict:
+        """Returns report of the current episode.
+
+        Returns:
+            Dict with 'num_steps', 'step_ms' (mean step time), 'phases_ms' and
+            'observables_ms' (mean time per step of each phase and observable).
+        """
+        n = max(self._num_steps, 1)
+        phases = {
+            phase: self._ns[phase] / n / 1e6
+            for phase in self._ns if phase != 'step'
+        }
+        step = self._ns['step'] / n / 1e6
+        phases['other'] = step - sum(phases.values()) if self._num_steps else 0.
+        return {
+            'num_steps': self._num_steps,
+            'step_ms': step,
+            'phases_ms': phases,
+            'observables_ms': {
+                name: ns / n / 1e6
+                for name, ns in self._observable_ns.items()
+            },
+        }
+
+    def _clear(self):
+        phases = ('step', ) + PHASES[:4] + self._reward_phases
+        self._ns.update(dict.fromkeys(phases, 0))
+        for name in self._observable_ns:
+            self._observable_ns[name] = 0
+        self._num_steps = 0
+
+    def _timed(self, fn, phase, accumulator):
+        perf_counter_ns = time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                accumulator[phase] += perf_counter_ns() - start
+
+        timed.__wrapped__ = fn
+        return timed
+
+    def _wrap(self, obj, name, phase, make_wrapper=None):
+        fn = getattr(obj, name)
+        if make_wrapper is None:
+            wrapper = self._timed(fn, phase, self._ns)
+        else:
+            wrapper = make_wrapper(fn)
+        setattr(obj, name, wrapper)
+        self._wrapped.append((obj, name))
+
+    def _step_wrapper(self, step):
+        perf_counter_ns = time.perf_counter_ns
+        env, ns = self._env, self._ns
+
+        def wrapped_step(action):
+            if env._reset_next_step:
+                return step(action)  # Resets, timed as a reset.
+            start = perf_counter_ns()
+            timestep = step(action)
+            ns['step'] += perf_counter_ns() - start
+            self._num_steps += 1
+            return timestep
+
+        return wrapped_step
+
+    def _reset_wrapper(self, reset):
+
+        def wrapped_reset():
+            if self._num_steps:
+                self.episode_reports.append(self.report())
+            timestep = reset()
+            self._clear()
+            # Observation updater and observables are rebuilt on reset.
+            self._unwrap_observables()
+            self._wrap_observables()
+            return timestep
+
+        return wrapped_reset
+
+    def _wrap_observables(self):
+        """Wraps observation updater and the enabled observable callables."""
+        updater = getattr(self._env, '_observation_updater', None)
+        if updater is None or updater._enabled_structure is None:
+            return  # Not reset yet.
+        for name in ('update', 'get_observation'):
+            setattr(updater, name,
+                    self._timed(getattr(updater, name), 'observables',
+                                self._ns))
+            self._observables_wrapped.append((updater, name))
+        structure = updater._enabled_structure
+        if isinstance(structure, dict):
+            structure = [structure]
+        for enabled_dict in structure:
+            for name, enabled in enabled_dict.items():
+                self._observable_ns.setdefault(name, 0)
+                enabled.observation_callable = self._timed(
+                    enabled.observation_callable, name, self._observable_ns)
+                self._observables_wrapped.append((enabled, None))
+
+    def _unwrap_observables(self):
+        for obj, name in self._observables_wrapped:
+            if name is None:
+                # Observable callables are plain attributes, restore originals.
+                obj.observation_callable = obj.observation_callable.__wrapped__
+            else:
+                delattr(obj, name)
+        self._observables_wrapped = []
+
+
+def format_report(report: dict) -> str:
+    """Formats a StepProfiler report as a table, slowest observables first."""
+    step = report['step_ms']
+    lines = [f'{report["num_steps"]} steps, {step:.3f} ms/step']
+    rows = list(report['phases_ms'].items())
+    rows += [(f'  {name}', t) for name, t in sorted(
+        report['observables_ms'].items(), key=lambda item: -item[1])]
+    width = max(len(name) for name, _ in rows)
+    for name, t in rows:
+        share = 100 * t / step if step else 0.
+        lines.append(f'{name:<{width}}  {t:8.3f} ms  {share:5.1f}%')
+    return '\n'.join(lines)
+
+
+def merge_reports(reports) -> dict:
+    """Merges StepProfiler reports, e.g. of several episodes, into one."""
+    reports = [r for r in reports if r['num_steps']]
+    num_steps = sum(r['num_steps'] for r in reports)
+
+    def mean(values):
+        return sum(v * r['num_steps']
+                   for v, r in zip(values, reports)) / max(num_steps, 1)
+
+    merged = {
+        'num_steps': num_steps,
+        'step_ms': mean(r['step_ms'] for r in reports),
+    }
+    for key in ('phases_ms', 'observables_ms'):
+        names = dict.fromkeys(name for r in reports for name in r[key])
+        merged[key] = {
+            name: mean(r[key].get(name, 0.) for r in reports)
+            for name in names
+        }
+    return merged
@@ -122,7 +122,11 @@ def canonical2real(action: np.ndarray,
 
 
 def make_ghost_fly(walker, visible=True, visible_legs=True):
-    """Create a 'ghost' fly to serve as a tracking target."""
+    """Create a 'ghost' fly to serve as a tracking target.
+
+    The ghost is left with visual-only geoms and no joints, sensors or
+    collisions, so it can be attached as a kinematic mocap body.
+    """
     # Remove model elements.
     for tendon in walker.mjcf_model.find_all('tendon'):
         tendon.remove()
@@ -131,8 +135,7 @@ def make_ghost_fly(walker, visible=True, visible_legs=True):
     for act in walker.mjcf_model.find_all('actuator'):
         act.remove()
     for sensor in walker.mjcf_model.find_all('sensor'):
-        if sensor.tag == 'touch' or sensor.tag == 'force':
-            sensor.remove()
+        sensor.remove()
     for exclude in walker.mjcf_model.find_all('contact'):
         exclude.remove()
     all_bodies = walker.mjcf_model.find_all('body')
@@ -173,26 +176,36 @@ def retract_wings(physics: 'mjcf.Physics',
 
 
 def add_trajectory_sites(root_entity, n_traj_sites, group=4):
-    """Adds trajectory sites to root entity."""
+    """Adds trajectory sites to root entity and returns them."""
+    sites = []
     for i in range(n_traj_sites):
-        root_entity.mjcf_model.worldbody.add(element_name='site',
-                                             name=f'traj_{i}',
-                                             size=(0.005, 0.005, 0.005),
-                                             rgba=(0, 1, 1, 0.5),
-                                             group=group)
+        sites.append(
+            root_entity.mjcf_model.worldbody.add(element_name='site',
+                                                 name=f'traj_{i}',
+                                                 size=(0.005, 0.005, 0.005),
+                                                 rgba=(0, 1, 1, 0.5),
+                                                 group=group))
+    return sites
 
 
-def update_trajectory_sites(root_entity, ref_qpos, n_traj_sites,
-                            traj_timesteps):
-    """Updates trajectory sites"""
-    for i in range(n_traj_sites):
-        site = root_entity.mjcf_model.worldbody.find('site', f'traj_{i}')
-        if i < traj_timesteps // 10:
-            site.pos = ref_qpos[10 * i, :3]
-            site.rgba[3] = 0.5
-        else:
-            # Hide extra sites beyond current trajectory length, if any.
-            site.rgba[3] = 0.
+def update_trajectory_sites(physics, sites, ref_qpos, traj_timesteps):
+    """Updates trajectory sites in physics, without changing the MJCF model.
+
+    Writing to the compiled model (rather than to the MJCF elements) keeps the
+    MJCF model unchanged between episodes, so it does not need recompiling.
+    """
+    if not sites:
+        return
+    n_visible = min(len(sites), traj_timesteps // 10)
+    bound_sites = physics.bind(sites)
+    pos = bound_sites.pos
+    rgba = bound_sites.rgba
+    pos[:n_visible] = ref_qpos[:10 * n_visible:10, :3]
+    rgba[:n_visible, 3] = 0.5
+    # Hide extra sites beyond current trajectory length, if any.
+    rgba[n_visible:, 3] = 0.
+    bound_sites.pos = pos
+    bound_sites.rgba = rgba
 
 
 def neg_quat(quat_a):
@@ -64,6 +64,13 @@ class TemplateTask(Walking):
             self._mjcb_control.reset()
         # Maybe do something here.
 
+    def restore_episode(self, physics: 'mjcf.Physics',
+                        random_state: np.random.RandomState):
+        """Restores a pooled state before the next episode begins."""
+        super().restore_episode(physics, random_state)
+        if self._mjcb_control is not None:
+            self._mjcb_control.reset()
+
     def before_step(self, physics: 'mjcf.Physics', action,
                     random_state: np.random.RandomState):
         """A callback which is executed before an agent control step."""
@@ -97,15 +97,6 @@ class VisionFlightImitationWBPG(Flying):
         return elevation_z * physics.model.hfield_data[y_idx * self._ncol +
                                                        x_idx]
 
-    def initialize_episode_mjcf(self, random_state: np.random.RandomState):
-        super().initialize_episode_mjcf(random_state)
-
-        self._target_height = random_state.uniform(*self._target_height_range)
-        self._target_speed = random_state.uniform(*self._target_speed_range)
-
-        theta = np.deg2rad(self._body_pitch_angle)
-        self._target_zaxis = np.array([np.sin(theta), 0, np.cos(theta)])
-
     def initialize_episode(self, physics: 'mjcf.Physics',
                            random_state: np.random.RandomState):
         """Randomly selects a starting point and set the walker.
@@ -115,6 +106,12 @@ class VisionFlightImitationWBPG(Flying):
         """
         super().initialize_episode(physics, random_state)
 
+        self._target_height = random_state.uniform(*self._target_height_range)
+        self._target_speed = random_state.uniform(*self._target_speed_range)
+
+        theta = np.deg2rad(self._body_pitch_angle)
+        self._target_zaxis = np.array([np.sin(theta), 0, np.cos(theta)])
+
         init_x = random_state.uniform(*self._init_pos_x_range)
         init_y = random_state.uniform(*self._init_pos_y_range)
 
@@ -76,7 +76,9 @@ class WalkImitation(Walking):
         if self._trajectory_sites:
             self._n_traj_sites = (
                 round(self._time_limit / self.control_timestep) + 1) // 10
-            add_trajectory_sites(self.root_entity, self._n_traj_sites, group=1)
+            self._traj_sites = add_trajectory_sites(self.root_entity,
+                                                    self._n_traj_sites,
+                                                    group=1)
 
         # Additional task observables for tracking reference fly.
         self._walker.observables.add_observable('ref_displacement',
@@ -89,8 +91,10 @@ class WalkImitation(Walking):
         Could be used for testing, debugging."""
         self._next_traj_idx = idx
 
-    def initialize_episode_mjcf(self, random_state: np.random.RandomState):
-        super().initialize_episode_mjcf(random_state)
+    def initialize_episode(self, physics: 'mjcf.Physics',
+                           random_state: np.random.RandomState):
+        """Randomly selects a starting point and set the walker."""
+        super().initialize_episode(physics, random_state)
 
         # Pick walking snippet (get snippet dict).
         self._snippet = self._traj_generator.get_trajectory(
@@ -106,13 +110,8 @@ class WalkImitation(Walking):
 
         # Update positions of trajectory sites.
         if self._trajectory_sites:
-            update_trajectory_sites(self.root_entity, self._ref_qpos,
-                                    self._n_traj_sites, self._episode_steps)
-
-    def initialize_episode(self, physics: 'mjcf.Physics',
-                           random_state: np.random.RandomState):
-        """Randomly selects a starting point and set the walker."""
-        super().initialize_episode(physics, random_state)
+            update_trajectory_sites(physics, self._traj_sites, self._ref_qpos,
+                                    self._episode_steps)
 
         # Set full initial qpos
         physics.bind(self._mocap_joints).qpos = self._ref_qpos[0, :]
@@ -133,16 +132,14 @@ class WalkImitation(Walking):
 
         # Set initial ghost position.
         ghost_qpos = self._ref_qpos[0, :7] + self._ghost_offset_with_quat
-        self._ghost.set_pose(physics, ghost_qpos[:3], ghost_qpos[3:])
+        self.set_ghost_pose(physics, ghost_qpos[:3], ghost_qpos[3:])
 
     def before_step(self, physics: 'mjcf.Physics', action,
                     random_state: np.random.RandomState):
-        # Set ghost joint position and velocity.
+        # Set ghost position.
         step = int(np.round(physics.data.time / self.control_timestep))
         ghost_qpos = self._ref_qpos[step, :7] + self._ghost_offset_with_quat
-        ghost_qvel = self._ref_qvel[step, :6]
-        self._ghost.set_pose(physics, ghost_qpos[:3], ghost_qpos[3:])
-        self._ghost.set_velocity(physics, ghost_qvel[:3], ghost_qvel[3:])
+        self.set_ghost_pose(physics, ghost_qpos[:3], ghost_qpos[3:])
 
         # Protect from rare NaN actions.
         action[np.isnan(action)] = 0.
@@ -6,6 +6,11 @@ DMPO agent. The training runs in an infinite loop until terminated.
 For lightweight testing, run this script with --test argument. It will run
 training with a single actor and print training statistics every 10 seconds.
 
+With --fork_server, actors and evaluator are forked from a node-local fork
+server which imports the dependencies and builds the environment once, instead
+of starting each as a Ray actor from scratch. All actors still start on this
+node and are not managed by Ray's resource scheduling.
+
 This script is not task-specific and can be used with other fly RL tasks by
 swapping in other environments in the environment_factory function. The single
 main configurable component below is the DMPO agent configuration and
@@ -35,8 +40,9 @@ from acme import wrappers
 import sonnet as snt
 
 import flybody
-from flybody.agents.remote_as_local_wrapper import RemoteAsLocal
-from flybody.agents.counting import PicklableCounter
+from flybody.agents.remote_as_local_wrapper import (RemoteAsLocal,
+                                                   format_call_stats)
+from flybody.agents.counting import PicklableCounter, ShardedCounter
 from flybody.agents.network_factory import policy_loss_module_dmpo
 from flybody.agents.losses_mpo import PenalizationCostRealActions
 
@@ -47,8 +53,13 @@ from flybody.agents.ray_distributed_dmpo import (
     DMPOConfig,
     ReplayServer,
     Learner,
+    LEARNER_CONCURRENCY_GROUPS,
     EnvironmentLoop,
+    run_environment_loop,
 )
+from flybody.agents.fork_server import ForkServer
+from flybody.agents.actor_pool import ActorPool
+from flybody.agents.observation_codec import ObservationCodec
 
 PYHTONPATH = os.path.dirname(os.path.dirname(flybody.__file__))
 LD_LIBRARY_PATH = (
@@ -61,6 +72,28 @@ parser = argparse.ArgumentParser()
 parser.add_argument('--test', '-t',
     help='Run job in test mode with one actor and output to current terminal.',
     action='store_true')
+parser.add_argument('--fork_server',
+    help='Fork actors and evaluator from a node-local fork server.',
+    action='store_true')
+parser.add_argument('--replay_checkpoint_to_load',
+    help='Replay checkpoint, or directory of them, to warm-start replay from.')
+parser.add_argument('--min_actors', type=int,
+    help='Minimum number of actors of the elastic actor pool.')
+parser.add_argument('--max_actors', type=int,
+    help='Maximum number of actors of the elastic actor pool.')
+parser.add_argument('--spread_actors',
+    help='Spread pooled actors over the nodes of the cluster.',
+    action='store_true')
+parser.add_argument('--pool_check_every', type=float, default=60.,
+    help='Seconds between actor pool health checks and rescaling.')
+parser.add_argument('--call_stats_every', type=float, default=0.,
+    help='Seconds between printing remote call telemetry, 0 for never.')
+parser.add_argument('--float16_replay',
+    help='Store float32 observations in replay as float16.',
+    action='store_true')
+parser.add_argument('--telemetry_dir',
+    help='Directory to export throughput telemetry of all processes to, '
+         'summarize with: python -m flybody.agents.telemetry <dir>.')
 args = parser.parse_args()
 is_test = args.test
 if parser.parse_args().test:
@@ -133,6 +166,11 @@ dmpo_config = DMPOConfig(
     checkpoint_max_to_keep=None,
     checkpoint_directory='~/ray-ckpts/',
     checkpoint_to_load=None,
+    replay_checkpoint_minutes=30,
+    replay_checkpoint_max_to_keep=1,
+    replay_checkpoint_to_load=args.replay_checkpoint_to_load,
+    observation_codec=ObservationCodec(float16=args.float16_replay),
+    telemetry_directory=args.telemetry_dir,
     print_fn=print
 )
 
@@ -177,27 +215,38 @@ ReplayServer = ray.remote(
 replay_server = ReplayServer.remote(dmpo_config, environment_spec)
 addr = ray.get(replay_server.get_server_address.remote())
 print(f'Started Replay Server on {addr}')
+print('Replay checkpoint directory:',
+      ray.get(replay_server.get_replay_checkpoint_dir.remote()))
 
 # === Create Counter.
 counter = ray.remote(PicklableCounter)  # This is class (direct call to
                                         # ray.remote decorator).
-counter = counter.remote()  # Instantiate.
-counter = RemoteAsLocal(counter)
+# Named, so that fork server workers can look it up.
+if dmpo_config.num_counter_shards > 1:
+    counter = ShardedCounter([
+        RemoteAsLocal(counter.options(name=f'counter_{i}').remote())
+        for i in range(dmpo_config.num_counter_shards)
+    ])
+else:
+    counter = counter.options(name='counter').remote()  # Instantiate.
+    counter = RemoteAsLocal(counter)
 
 # === Create Learner.
 Learner = ray.remote(
-    num_gpus=1, runtime_env=runtime_env_learner)(Learner)
-learner = Learner.remote(replay_server.get_server_address.remote(),
-                         counter,
-                         environment_spec,
-                         dmpo_config,
-                         network_factory)
+    num_gpus=1,
+    runtime_env=runtime_env_learner,
+    concurrency_groups=LEARNER_CONCURRENCY_GROUPS)(Learner)
+learner = Learner.options(name='learner').remote(
+    replay_server.get_server_address.remote(),
+    counter,
+    environment_spec,
+    dmpo_config,
+    network_factory)
 learner = RemoteAsLocal(learner)
 
 print('Waiting until learner is ready...')
-learner.isready(block=True)
-
-checkpointer_dir, snapshotter_dir = learner.get_checkpoint_dir()
+_, (checkpointer_dir, snapshotter_dir) = learner.call_batch(
+    ['isready', 'get_checkpoint_dir'])
 print('Checkpointer directory:', checkpointer_dir)
 print('Snapshotter directory:', snapshotter_dir)
 
@@ -207,58 +256,99 @@ EnvironmentLoop = ray.remote(
     num_gpus=0, runtime_env=runtime_env_actor)(EnvironmentLoop)
 
 n_actors = dmpo_config.num_actors
-
-def create_actors(n_actors):
-    """Return list of requested number of actor instances."""
-    actors = []
-    for _ in range(n_actors):
-        actor = EnvironmentLoop.remote(
-            replay_server_address=replay_server.get_server_address.remote(),
-            variable_source=learner,
-            counter=counter,
+roles = ['actor'] * n_actors + ['evaluator']
+start_time = time.time()
+
+if args.fork_server:
+    # Workers are forked as soon as the template environment is built, they
+    # start running their loops once ready.
+    fork_server = ForkServer(
+        environment_factory=lambda: environment_factory(training=True),
+        preload_modules=['tensorflow', 'sonnet', 'acme'],
+        env_vars=runtime_env_actor['env_vars'])
+    print(f'Fork server ready in {fork_server.build_time:.1f} s')
+    if hasattr(counter, 'run'):
+        counter.run(block=False)
+    futures = [
+        fork_server.start_worker(
+            run_environment_loop,
+            replay_server_address=addr,
+            learner_name='learner',
+            counter_name='counter',
             network_factory=network_factory,
-            environment_factory=environment_factory,
             dmpo_config=dmpo_config,
-            actor_or_evaluator='actor',
-            )
-        actor = RemoteAsLocal(actor)
-        actors.append(actor)
-        time.sleep(0.2)
-    return actors
-
-# Get actors.
-actors = create_actors(n_actors)
-
-# Get evaluator.
-evaluator = EnvironmentLoop.remote(
-    replay_server_address=replay_server.get_server_address.remote(),
-    variable_source=learner,
-    counter=counter,
-    network_factory=network_factory,
-    environment_factory=environment_factory,
-    dmpo_config=dmpo_config,
-    actor_or_evaluator='evaluator')
-evaluator = RemoteAsLocal(evaluator)
-
-print('Waiting until actors are ready...')
-# Block until all actors and evaluator are ready and have called `get_variables`
-# in learner with variable_client.update_and_wait() from _make_actor. Otherwise
-# they will be blocked and won't be inserting data to replay table, which in
-# turn will cause learner to be blocked.
-for actor in actors:
-    actor.isready(block=True)
-evaluator.isready(block=True)
-
-print('Actors ready, issuing run command to all')
-
-# === Run all.
-if hasattr(counter, 'run'):
-    counter.run(block=False)
-for actor in actors:
-    actor.run(block=False)
-evaluator.run(block=False)
-
+            actor_or_evaluator=role,
+            ray_address=ray_context.address_info['address'],
+            namespace=ray.get_runtime_context().namespace,
+            environment_factory=environment_factory,
+        ) for role in roles
+    ]
+    print('Waiting until actors are ready...')
+    for future in futures:
+        future.result()
+    print(f'Actors ready in {time.time() - start_time:.1f} s')
+else:
+    # Pools launch their actors concurrently, replace dead and stalled ones,
+    # and the actor pool rescales between --min_actors and --max_actors to
+    # balance the replay rate limiter.
+
+    def make_create_actor(role):
+
+        def create_actor(options):
+            # Threaded, so `heartbeat` is answered while `run` runs.
+            return RemoteAsLocal(
+                EnvironmentLoop.options(max_concurrency=2, **options).remote(
+                    replay_server_address=addr,
+                    variable_source=learner,
+                    counter=counter,
+                    network_factory=network_factory,
+                    environment_factory=environment_factory,
+                    dmpo_config=dmpo_config,
+                    actor_or_evaluator=role,
+                ))
+
+        return create_actor
+
+    pools = [
+        ActorPool(make_create_actor('actor'),
+                  num_actors=n_actors,
+                  min_actors=args.min_actors or n_actors,
+                  max_actors=max(args.max_actors or n_actors, n_actors),
+                  replay_server=RemoteAsLocal(replay_server),
+                  spread=args.spread_actors,
+                  label='actor'),
+        ActorPool(make_create_actor('evaluator'),
+                  num_actors=1,
+                  spread=args.spread_actors,
+                  label='evaluator'),
+    ]
+    if hasattr(counter, 'run'):
+        counter.run(block=False)
+    print('Waiting until actors are ready...')
+    # Each pool blocks until its actors are ready and have called
+    # `get_variables` in learner with variable_client.update_and_wait() from
+    # _make_actor, then issues the run command to them.
+    for pool in pools:
+        pool.start()
+        pool.start_supervisor(interval=args.pool_check_every)
+    print(f'Actors ready in {time.time() - start_time:.1f} s')
+
+# Single call to `run` makes a fixed number of learning steps. Keep one call
+# queued behind the running one, so the learner doesn't idle for a round trip
+# between calls, but wait for each, otherwise `run` calls pile up and spam the
+# queue. Actors' variable requests don't queue behind them, they run in their
+# own concurrency group.
+pending_run = learner.run(block=False)
+last_stats_time = time.time()
 while True:
-    # Single call to `run` makes a fixed number of learning steps.
-    # Here we need to block, otherwise `run` calls pile up and spam the queue.
-    learner.run(block=True)
+    next_run = learner.run(block=False)
+    ray.get(pending_run)
+    pending_run = next_run
+    if args.call_stats_every and (time.time() - last_stats_time >
+                                  args.call_stats_every):
+        # Where the driver waits on remote calls.
+        for name, handle in (('learner', learner), ('counter', counter)):
+            if hasattr(handle, 'call_stats'):
+                print(f'\n{name} calls:\n'
+                      f'{format_call_stats(handle.call_stats())}')
+        last_stats_time = time.time()
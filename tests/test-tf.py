@@ -1,12 +1,20 @@
 """Test: create and run tensorflow policy network in environment loop."""
 
+import time
+
+import numpy as np
 import sonnet as snt
+import tensorflow as tf
+from acme import core
 from acme import wrappers
 from acme.tf import networks as network_utils
 from acme.tf import utils as tf2_utils
 
-from flybody.fly_envs import walk_on_ball
+from flybody.fly_envs import walk_on_ball, template_task
 from flybody.agents.network_factory import make_network_factory_dmpo
+from flybody.agents.actors import BatchedFeedForwardActor
+from flybody.agents.batched_environment_loop import BatchedEnvironmentLoop
+from flybody.agents.variable_utils import DoubleBufferedVariableClient
 
 
 def test_can_create_and_run_tf_policy():
@@ -31,3 +39,69 @@ def test_can_create_and_run_tf_policy():
         action = policy_network(batched_observation)
         action = tf2_utils.to_numpy_squeeze(action)
         timestep = env.step(action)
+
+
+def test_batched_actor_and_loop():
+
+    def make_env():
+        env = template_task(time_limit=0.02)
+        env = wrappers.SinglePrecisionWrapper(env)
+        return wrappers.CanonicalSpecWrapper(env, clip=True)
+
+    envs = [make_env() for _ in range(3)]
+    network_factory = make_network_factory_dmpo()
+    networks = network_factory(envs[0].action_spec())
+    policy_network = snt.Sequential([
+        networks['observation'],
+        networks['policy'],
+        network_utils.StochasticSamplingHead()
+    ])
+    actor = BatchedFeedForwardActor(policy_network, num_envs=3, action_delay=2)
+
+    observations = [env.reset().observation for env in envs]
+    actions = actor.select_actions(observations)
+    assert len(actions) == 3
+    assert actions[0].shape == envs[0].action_spec().shape
+    assert not actions[0].any()  # Delayed.
+
+    loop = BatchedEnvironmentLoop(envs, actor)
+    loop.run(num_episodes=4)
+
+
+def test_double_buffered_variable_client():
+
+    class Source(core.VariableSource):
+        value = np.zeros(3, np.float32)
+
+        def get_variables(self, names):
+            return [[self.value] for _ in names]
+
+    source = Source()
+    variable = tf.Variable(np.zeros(3, np.float32))
+    client = DoubleBufferedVariableClient(source, {'policy': [variable]},
+                                          update_period=2)
+    source.value = np.ones(3, np.float32)
+    # Fetch is requested on the second call, swapped in on a later one.
+    start = time.time()
+    while client.metrics()['policy_version'] < 1:
+        assert time.time() - start < 10
+        client.update()
+        time.sleep(0.01)
+    np.testing.assert_array_equal(variable.numpy(), 1)
+    assert client.metrics()['policy_age_s'] >= 0
+    client.close()
+
+    # Closing during a fetch returns once the fetch is done.
+    class SlowSource(Source):
+
+        def get_variables(self, names):
+            time.sleep(0.5)
+            return super().get_variables(names)
+
+    client = DoubleBufferedVariableClient(SlowSource(), {'policy': [variable]},
+                                          update_period=1)
+    client.update()
+    time.sleep(0.1)
+    start = time.time()
+    client.close()
+    assert time.time() - start < 5
@@ -0,0 +1,254 @@
+"""Test agent-side utilities: counters, fork server, local replay,
+observation codec and telemetry."""
+
+import pickle
+import threading
+import time
+import numpy as np
+import tree
+import dm_env
+from acme import specs
+from flybody.agents.counting import (AggregatingCounter, PicklableCounter,
+                                     ShardedCounter)
+from flybody.agents.fork_server import ForkServer
+from flybody.agents.local_replay import LocalNStepTransitionAdder, LocalReplay
+from flybody.agents.observation_codec import EncodingAdder, ObservationCodec
+from flybody.agents.telemetry import (Telemetry, format_summary,
+                                      load_snapshots, summarize)
+from flybody.fly_envs import template_task
+
+
+def _fork_server_worker(env, ready, fail):
+    if fail:
+        raise ValueError('Worker failed.')
+    env.reset()
+    ready()
+
+
+def test_fork_server():
+
+    server = ForkServer(template_task)
+    try:
+        futures = [server.start_worker(_fork_server_worker, fail=False)
+                   for _ in range(3)]
+        pids = [future.result(timeout=60) for future in futures]
+        assert len(set(pids)) == 3
+        future = server.start_worker(_fork_server_worker, fail=True)
+        try:
+            future.result(timeout=60)
+            assert False, 'Worker error not propagated.'
+        except RuntimeError as e:
+            assert 'Worker failed.' in str(e)
+    finally:
+        server.close()
+
+
+def test_aggregating_counter():
+
+    shards = [PicklableCounter() for _ in range(3)]
+    parent = ShardedCounter(shards)
+    actors = [
+        AggregatingCounter(parent, prefix='actor', time_delta=1000.)
+        for _ in range(2)
+    ]
+    learner = AggregatingCounter(parent, prefix='learner', time_delta=1000.)
+    for _ in range(5):
+        for actor in actors:
+            counts = actor.increment(steps=10)
+    # Local counts only, nothing flushed yet.
+    assert counts == {'actor_steps': 50}
+    assert learner.get_counts() == {}
+    for actor in actors:
+        actor.close()
+    learner.flush()
+    assert learner.increment(steps=1) == {'actor_steps': 100,
+                                          'learner_steps': 1}
+    assert sum(shard.get_counts().get('actor_steps', 0)
+               for shard in shards) == 100
+    learner.close()
+
+    # Pickles after use, with counts not yet flushed, incl. in flight.
+    counter = AggregatingCounter(PicklableCounter(), time_delta=1000.)
+    counter.increment(steps=2)
+    counter._in_flight = {'steps': 1}
+    copy = pickle.loads(pickle.dumps(counter))
+    assert copy.increment(steps=1) == {'steps': 4}
+
+
+def test_sharded_counter():
+
+    shards = [PicklableCounter() for _ in range(3)]
+    counters = [ShardedCounter(shards, time_delta=1000.) for _ in range(3)]
+    for i, counter in enumerate(counters):
+        counter.get_counts()
+        counter._shard = i
+    for i, counter in enumerate(counters):
+        counter.increment(steps=i + 1)
+    # Each counter increments only its own shard.
+    assert [shard.get_counts() for shard in shards] == [{
+        'steps': 1
+    }, {
+        'steps': 2
+    }, {
+        'steps': 3
+    }]
+    # Counts of the other shards are cached until the next fetch.
+    assert counters[2].get_counts()['steps'] <= 6
+    assert counters[0].refresh() == {'steps': 6}
+    assert counters[0].get_counts() == {'steps': 6}
+    # Pickles after use, e.g. with Ray actor handles as shards.
+    counter = ShardedCounter([PicklableCounter() for _ in range(2)])
+    counter.get_counts()
+    copy = pickle.loads(pickle.dumps(counter))
+    assert copy.increment(steps=1) == {'steps': 1}
+
+
+def test_aggregating_counter_retries_failed_flush():
+
+    class FailingOnceCounter(PicklableCounter):
+
+        def __init__(self):
+            super().__init__()
+            self.failed = False
+
+        def increment(self, **counts):
+            if not self.failed:
+                self.failed = True
+                raise RuntimeError('Transient failure.')
+            return super().increment(**counts)
+
+    parent = FailingOnceCounter()
+    counter = AggregatingCounter(parent, prefix='actor', time_delta=0.01)
+    counter.increment(steps=5)
+    deadline = time.time() + 10.
+    while (counter.flush_stats()['flushes'] < 1
+           and time.time() < deadline):
+        time.sleep(0.01)
+    assert counter.flush_stats()['flush_errors'] == 1
+    assert parent.get_counts() == {'actor_steps': 5}
+    counter.increment(steps=1)
+    counter.close()
+    assert parent.get_counts() == {'actor_steps': 6}
+
+
+def test_local_replay():
+
+    environment_spec = specs.EnvironmentSpec(
+        observations=specs.Array((2, ), np.float32),
+        actions=specs.BoundedArray((1, ), np.float32, -1., 1.),
+        rewards=specs.Array((), np.float32),
+        discounts=specs.BoundedArray((), np.float32, 0., 1.))
+    replay = LocalReplay(environment_spec, max_size=100)
+    adder = LocalNStepTransitionAdder(replay, n_step=2, discount=0.5)
+    adder.add_first(dm_env.restart(np.zeros(2, np.float32)))
+    for t in range(1, 4):
+        observation = np.full(2, t, np.float32)
+        timestep = (dm_env.transition(1., observation) if t < 3 else
+                    dm_env.termination(1., observation))
+        adder.add(np.zeros(1, np.float32), timestep)
+    # Two 2-step transitions and the last, 1-step one.
+    assert replay.size() == 3
+    data = replay.sample(100).data
+    order = np.argsort(data.observation[:, 0])
+    _, first = np.unique(data.observation[order, 0], return_index=True)
+    np.testing.assert_array_equal(data.next_observation[order][first, 0],
+                                  [2, 3, 3])
+    np.testing.assert_allclose(data.reward[order][first], [1.5, 1.5, 1.])
+    np.testing.assert_allclose(data.discount[order][first], [0.5, 0., 0.])
+
+    # Rate limiter: 2 samples per insert within 4 samples, after 3 inserts.
+    limited = LocalReplay(environment_spec, max_size=10, min_size_to_sample=3,
+                          samples_per_insert=2., error_buffer=4.)
+    transition = tree.map_structure(lambda x: x[0], data)
+    for _ in range(5):
+        limited.insert(transition)
+    assert not limited._can_insert()
+    limited.sample(2)
+    assert limited._can_insert() and not limited._can_sample(7)
+    limited.close()
+    assert limited.sample(1) is None
+
+    # Batches larger than twice the error buffer are sampled in parts.
+    limited = LocalReplay(environment_spec, max_size=1000,
+                          min_size_to_sample=10, samples_per_insert=8.,
+                          error_buffer=16.)
+
+    def insert():
+        try:
+            for _ in range(100):
+                limited.insert(transition)
+        except RuntimeError:  # Closed while blocked.
+            pass
+
+    inserter = threading.Thread(target=insert, daemon=True)
+    inserter.start()
+    batches = []
+    sampler = threading.Thread(
+        target=lambda: batches.extend(limited.sample(64) for _ in range(5)),
+        daemon=True)
+    sampler.start()
+    sampler.join(timeout=10.)
+    assert not sampler.is_alive()
+    assert [batch.info.key.shape for batch in batches] == [(64, )] * 5
+    limited.close()
+    inserter.join(timeout=10.)
+
+
+def test_observation_codec():
+
+    observation_spec = {
+        'walker/left_eye': specs.Array((4, 4, 3), np.uint8),
+        'walker/joints_pos': specs.Array((2, ), np.float32),
+    }
+    environment_spec = specs.EnvironmentSpec(
+        observations=observation_spec,
+        actions=specs.BoundedArray((1, ), np.float32, -1., 1.),
+        rewards=specs.Array((), np.float32),
+        discounts=specs.BoundedArray((), np.float32, 0., 1.))
+    codec = ObservationCodec(float16=True)
+    encoded_spec = codec.encode_environment_spec(environment_spec)
+    assert encoded_spec.observations['walker/left_eye'].shape == (4, 4)
+    assert encoded_spec.observations['walker/joints_pos'].dtype == np.float16
+
+    replay = LocalReplay(encoded_spec, max_size=10)
+    adder = EncodingAdder(
+        LocalNStepTransitionAdder(replay, n_step=1, discount=1.), codec)
+    eye = np.zeros((4, 4, 3), np.uint8)
+    eye[..., 0] = 255
+    observation = {'walker/left_eye': eye,
+                   'walker/joints_pos': np.array([0.1, -2.], np.float32)}
+    adder.add_first(dm_env.restart(observation))
+    adder.add(np.zeros(1, np.float32), dm_env.termination(1., observation))
+    data = replay.sample(1).data
+    np.testing.assert_array_equal(data.observation['walker/left_eye'],
+                                  np.full((1, 4, 4), 85, np.uint8))
+    np.testing.assert_allclose(data.next_observation['walker/joints_pos'],
+                               [[0.1, -2.]], rtol=1e-3)
+
+
+def test_telemetry(tmp_path):
+
+    replay = Telemetry('replay')
+    totals = {'inserts': 100., 'samples': 3000.}
+    replay.add_collector(lambda: totals, cumulative=True)
+    replay.add_collector(lambda: {'size': 100})
+    replay.export(tmp_path)
+    totals.update(inserts=200., samples=6000.)
+    for _ in range(2):
+        actor = Telemetry('actor')
+        actor.increment('env_steps', 10)
+        actor.record('policy_inference', 0.002)
+        with actor.timer('policy_inference'):
+            pass
+        actor.export(tmp_path)
+    snapshot = replay.export(tmp_path)
+    assert snapshot['rates']['inserts'] > 0
+    assert 'flybody_size{role="replay"' in (
+        tmp_path / f'replay-{snapshot["host"]}-{snapshot["pid"]}.prom'
+    ).read_text()
+
+    # Both actors have the same pid here, so one file.
+    summary = summarize(load_snapshots(tmp_path))
+    assert summary['actor']['timers']['policy_inference']['count'] == 2
+    assert summary['replay']['counters']['samples'] == 6000.
+    assert 'Observed samples per insert: 30.0' in format_summary(summary)
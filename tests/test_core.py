@@ -3,7 +3,8 @@
 import os
 import numpy as np
 from dm_control import mujoco
-from flybody.fly_envs import template_task
+from flybody.fly_envs import template_task, multi_fly_template_task
+from flybody.tasks.task_utils import get_random_policy
 
 
 obs_names = ['accelerometer',
@@ -101,3 +102,33 @@ def test_ctrl_callback():
 
     # Reset callback, otherwise subsequent tests will fail.
     mujoco.set_mjcb_control(None)
+
+
+def test_multi_fly_template_task():
+
+    num_flies = 2
+    # Overlapping flies, which should not collide with each other.
+    env = multi_fly_template_task(num_flies=num_flies, spacing=0.)
+    num_actions = env.action_spec().shape[1]
+    assert env.action_spec().shape == (num_flies, num_actions)
+    assert env.reward_spec().shape == (num_flies, )
+
+    timestep = env.reset()
+    observation = env.task.batch_observation(timestep.observation)
+    assert set(observation) == {s[len('walker/'):] for s in obs_names}
+    assert all(len(v) == num_flies for v in observation.values())
+
+    policy = get_random_policy(env.action_spec())
+    for _ in range(10):
+        timestep = env.step(policy(timestep.observation))
+        assert timestep.reward.shape == (num_flies, )
+        # Each fly is actuated independently.
+        ctrl = [env.physics.bind(fly.actuators).ctrl for fly in env.task.walkers]
+        assert not np.allclose(ctrl[0], ctrl[1])
+
+    model, data = env.physics.model, env.physics.data
+    for contact in data.contact:
+        fly_names = {model.id2name(model.geom_bodyid[g], 'body').split('/')[0]
+                     for g in [contact.geom1, contact.geom2]}
+        assert fly_names in [{'world', 'walker'}, {'world', 'walker_1'},
+                             {'walker'}, {'walker_1'}]
@@ -8,6 +8,7 @@ import flybody
 
 flybody_path = os.path.dirname(flybody.__file__)
 xml_path = os.path.join(flybody_path, 'fruitfly/assets/fruitfly.xml')
+fast_xml_path = os.path.join(flybody_path, 'fruitfly/assets/fruitfly_fast.xml')
 
 expect = {
     'nq': 109,  # Generalized coordinates.
@@ -42,6 +43,16 @@ def test_fly_parameters():
         assert getattr(physics.model, k) == v
     
 
+def test_fast_variant_parameters():
+    physics = mjcf.Physics.from_xml_path(fast_xml_path)
+    for k, v in expect.items():
+        assert getattr(physics.model, k) == v
+    # Only collisions are simplified.
+    default_physics = mjcf.Physics.from_xml_path(xml_path)
+    assert physics.model.nexclude > default_physics.model.nexclude
+    assert all(physics.model.geom_contype == default_physics.model.geom_contype)
+
+
 def test_fly_masses():
     physics = mjcf.Physics.from_xml_path(xml_path)
     
@@ -211,3 +211,17 @@ def test_set_name():
     name = 'fruity'
     fly = FruitFly(name=name)
     assert fly.name == name
+
+
+def test_raycast_eyes():
+    size = 16
+    expected = {'intensity': ((size, size, 3), np.uint8),
+                'depth': ((size, size), np.float32),
+                'geom_id': ((size, size), np.int32)}
+    for output, (shape, dtype) in expected.items():
+        fly = FruitFly(eye_camera_size=size, eye_raycast=output)
+        physics = mjcf.Physics.from_mjcf_model(fly.mjcf_model)
+        for name in ['right_eye', 'left_eye']:
+            observation = getattr(fly.observables, name)(physics)
+            assert observation.shape == shape
+            assert observation.dtype == dtype
@@ -0,0 +1,81 @@
+"""Test task utilities: state pool, compiled model cache and step
+profiler."""
+
+import numpy as np
+from flybody.fly_envs import template_task
+from flybody.tasks.model_cache import CompiledModelCache
+from flybody.tasks.state_pool import collect_state_pool
+from flybody.tasks.step_profiler import StepProfiler, merge_reports
+from flybody.tasks.task_utils import get_random_policy
+
+
+def test_state_pool_reset(tmp_path):
+
+    env = template_task()
+    policy = get_random_policy(env.action_spec())
+    pool = collect_state_pool(env, num_states=3, settle_steps=5, policy=policy)
+    assert len(pool) == 3
+    path = str(tmp_path / 'pool.npz')
+    pool.save(path)
+
+    env = template_task(state_pool=path)
+    for _ in range(3):
+        _ = env.reset()
+        state = env.physics.get_state()
+        matches = [i for i in range(len(pool))
+                   if np.array_equal(state, pool[i][0])]
+        assert matches
+        _, bookkeeping = pool[matches[0]]
+        assert env.task._step_counter == bookkeeping['step_counter']
+        np.testing.assert_array_equal(env.task._walker.prev_action,
+                                      bookkeeping['prev_action'])
+        assert env.physics.data.time == 0.
+    _ = env.step(np.zeros(env.action_spec().shape))
+
+
+def test_model_cache_dir(tmp_path):
+
+    env = template_task()
+    mjcf_model = env.task.root_entity.mjcf_model
+    cache = CompiledModelCache(cache_dir=str(tmp_path))
+    physics = cache.get_physics(mjcf_model)
+    assert len(list(tmp_path.glob('*.mjb'))) == 1
+    # A new cache, e.g. in another process, loads the saved MJB.
+    physics_loaded = CompiledModelCache(
+        cache_dir=str(tmp_path)).get_physics(mjcf_model)
+    assert physics_loaded.model.nq == physics.model.nq
+    assert np.all(physics_loaded.model.body_mass == physics.model.body_mass)
+    # An unloadable MJB is compiled again and overwritten.
+    mjb_path, = tmp_path.glob('*.mjb')
+    mjb_path.write_bytes(b'corrupt')
+    physics_loaded = CompiledModelCache(
+        cache_dir=str(tmp_path)).get_physics(mjcf_model)
+    assert physics_loaded.model.nq == physics.model.nq
+    assert mjb_path.stat().st_size > len(b'corrupt')
+
+
+def test_step_profiler():
+
+    env = template_task(time_limit=0.02)
+    profiler = StepProfiler(env)
+    env.reset()
+    action = np.zeros(env.action_spec().shape)
+    num_steps = 0
+    while not env.step(action).last():
+        num_steps += 1
+    env.reset()
+    assert len(profiler.episode_reports) == 1
+    report = profiler.episode_reports[0]
+    assert report['num_steps'] == num_steps + 1
+    assert report['phases_ms']['physics'] > 0
+    assert report['observables_ms']['walker/joints_pos'] > 0
+    assert np.isclose(sum(report['phases_ms'].values()), report['step_ms'])
+    merged = merge_reports([report, report])
+    assert merged['num_steps'] == 2 * report['num_steps']
+    assert np.isclose(merged['step_ms'], report['step_ms'])
+    # Disabling removes all instance-level wrappers.
+    profiler.disable()
+    assert 'step' not in vars(env)
+    assert 'get_reward_factors' not in vars(env.task)
+    env.step(action)
+    assert profiler.report()['num_steps'] == 0
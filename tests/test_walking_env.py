@@ -74,3 +74,20 @@ def test_can_step_env_inference_mode():
     # For local testing only.
     if 'MUJOCO_GL' in os.environ and os.environ['MUJOCO_GL'] == 'egl':
         _ = env.physics.render()
+
+
+def test_reset_does_not_recompile():
+
+    env = walk_imitation(terminal_com_dist=float('inf'))
+    env.task._traj_generator.set_next_trajectory(
+        snippet['qpos'], snippet['qvel'])
+    _ = env.reset()
+    physics = env.physics
+    # Trajectory sites are updated in physics, not in the MJCF model.
+    traj_sites = env.task._traj_sites
+    assert np.allclose(physics.bind(traj_sites[0]).pos, qpos[0, :3])
+    env.task._traj_generator.set_next_trajectory(
+        snippet['qpos'] + 1., snippet['qvel'])
+    _ = env.reset()
+    assert env.physics is physics
+    assert np.allclose(physics.bind(traj_sites[0]).pos, qpos[0, :3] + 1.)